@@ -0,0 +1,105 @@
+#ifndef KARAOKE_CONTOUR_H
+#define KARAOKE_CONTOUR_H
+
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+#include <string>
+
+/**
+ * @file KaraokeContour.h
+ * @brief Đọc file contour nhị phân KSPC (ghi bởi contour_export.py) không cần parse
+ *
+ * File gồm header 40 byte little-endian và các cột căn theo 8 byte:
+ *   - time:            float[frame_count]   (giây)
+ *   - cents_user:      float[frame_count]   (NaN = không có pitch)
+ *   - cents_reference: float[frame_count]   (NaN = không có pitch)
+ *   - deviation:       int16_t[frame_count] (cents, KARAOKE_DEVIATION_INVALID = bỏ qua)
+ *
+ * Chỉ hỗ trợ máy little-endian (x86, ARM thông thường). Dữ liệu phải được
+ * giữ sống (ví dụ vùng mmap hoặc std::vector) trong lúc dùng KaraokeContourView.
+ */
+
+static const uint32_t KARAOKE_CONTOUR_VERSION = 1;
+static const int16_t KARAOKE_DEVIATION_INVALID = -32768;
+
+#pragma pack(push, 1)
+struct KaraokeContourHeader {
+    char magic[4];          // "KSPC"
+    uint16_t version;
+    uint16_t header_size;
+    uint32_t frame_count;
+    uint32_t flags;
+    float grid_rate;        // Hz
+    uint32_t time_offset;
+    uint32_t user_offset;
+    uint32_t ref_offset;
+    uint32_t dev_offset;
+    uint32_t reserved;
+};
+#pragma pack(pop)
+
+/**
+ * @brief Các con trỏ trỏ thẳng vào buffer KSPC (không copy)
+ */
+struct KaraokeContourView {
+    uint32_t version;
+    uint32_t frame_count;
+    float grid_rate;
+    const float* time;
+    const float* cents_user;
+    const float* cents_reference;
+    const int16_t* deviation;
+};
+
+/**
+ * @brief Map buffer KSPC thành KaraokeContourView
+ *
+ * @param data Con trỏ tới nội dung file (căn ít nhất 4 byte, ví dụ từ mmap)
+ * @param size Kích thước buffer (byte)
+ * @param view Kết quả
+ * @param error Thông báo lỗi nếu thất bại (có thể NULL)
+ * @return true nếu buffer hợp lệ
+ */
+inline bool mapContours(const void* data, size_t size, KaraokeContourView& view,
+                        std::string* error = NULL) {
+    KaraokeContourHeader header;
+    if (data == NULL || size < sizeof(header)) {
+        if (error) *error = "Contour data is too short";
+        return false;
+    }
+    std::memcpy(&header, data, sizeof(header));
+    if (std::memcmp(header.magic, "KSPC", 4) != 0) {
+        if (error) *error = "Not a KSPC contour file";
+        return false;
+    }
+    if (header.version > KARAOKE_CONTOUR_VERSION) {
+        if (error) *error = "Unsupported contour format version";
+        return false;
+    }
+
+    const size_t n = header.frame_count;
+    const uint32_t float_offsets[3] = {header.time_offset, header.user_offset, header.ref_offset};
+    for (int i = 0; i < 3; ++i) {
+        if (float_offsets[i] % sizeof(float) != 0 || float_offsets[i] + n * sizeof(float) > size) {
+            if (error) *error = "Contour column out of bounds";
+            return false;
+        }
+    }
+    if (header.dev_offset % sizeof(int16_t) != 0 || header.dev_offset + n * sizeof(int16_t) > size) {
+        if (error) *error = "Contour column out of bounds";
+        return false;
+    }
+
+    const char* base = static_cast<const char*>(data);
+    view.version = header.version;
+    view.frame_count = header.frame_count;
+    view.grid_rate = header.grid_rate;
+    view.time = reinterpret_cast<const float*>(base + header.time_offset);
+    view.cents_user = reinterpret_cast<const float*>(base + header.user_offset);
+    view.cents_reference = reinterpret_cast<const float*>(base + header.ref_offset);
+    view.deviation = reinterpret_cast<const int16_t*>(base + header.dev_offset);
+    return true;
+}
+
+#endif // KARAOKE_CONTOUR_H
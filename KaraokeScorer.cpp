@@ -1,6 +1,7 @@
 #include "KaraokeScorer.h"
 #include <Python.h>
 #include <sstream>
+#include <fstream>
 #include <iostream>
 #include <cmath>
 
@@ -58,18 +59,24 @@ std::map<std::string, double> parseSimpleJson(const std::string& json_str) {
     return result;
 }
 
-KaraokeScorer::KaraokeScorer() : initialized(false), lastError("") {
+KaraokeScorer::KaraokeScorer()
+    : initialized(false), lastError(""), ownsInterpreter(false), mainThreadState(NULL),
+      pModule(NULL), pFunc(NULL), pPcmFunc(NULL) {
     // Khởi tạo Python interpreter với error handling
     try {
         if (!Py_IsInitialized()) {
             // Đảm bảo Python path được set trước khi initialize
             Py_SetProgramName(L"KaraokeScorer");
             Py_Initialize();
+            ownsInterpreter = Py_IsInitialized() != 0;
         }
         
         if (Py_IsInitialized()) {
             initialized = true;
             
+            // Lấy GIL (interpreter có thể đã được host khởi tạo trên thread khác)
+            PyGILState_STATE gstate = PyGILState_Ensure();
+            
             // Thêm thư mục hiện tại vào Python path
             PyObject* sysPath = PySys_GetObject("path");
             if (sysPath) {
@@ -79,6 +86,13 @@ KaraokeScorer::KaraokeScorer() : initialized(false), lastError("") {
                     Py_DECREF(currentDir);
                 }
             }
+            
+            PyGILState_Release(gstate);
+            
+            // Nhả GIL để các thread khác có thể gọi Python qua PyGILState_Ensure
+            if (ownsInterpreter) {
+                mainThreadState = PyEval_SaveThread();
+            }
         } else {
             lastError = "Không thể khởi tạo Python interpreter - Py_Initialize() failed";
         }
@@ -89,8 +103,26 @@ KaraokeScorer::KaraokeScorer() : initialized(false), lastError("") {
 }
 
 KaraokeScorer::~KaraokeScorer() {
+    if (!isInitialized()) {
+        return;
+    }
+    
+    // Trả lại các tham chiếu đã cache
+    PyGILState_STATE gstate = PyGILState_Ensure();
+    Py_XDECREF(pPcmFunc);
+    Py_XDECREF(pFunc);
+    Py_XDECREF(pModule);
+    pPcmFunc = NULL;
+    pFunc = NULL;
+    pModule = NULL;
+    PyGILState_Release(gstate);
+    
     // Không finalize Python ở đây vì có thể có nhiều instance
-    // Nên để caller quyết định khi nào finalize
+    // Nên để caller quyết định khi nào finalize - trả GIL về thread đã khởi tạo
+    if (ownsInterpreter && mainThreadState) {
+        PyEval_RestoreThread(static_cast<PyThreadState*>(mainThreadState));
+        mainThreadState = NULL;
+    }
 }
 
 bool KaraokeScorer::isInitialized() const {
@@ -98,62 +130,91 @@ bool KaraokeScorer::isInitialized() const {
 }
 
 std::string KaraokeScorer::getLastError() const {
+    std::lock_guard<std::mutex> lock(errorMutex);
     return lastError;
 }
 
-std::string KaraokeScorer::callPythonFunction(
-    const std::string& user_audio_path,
-    const std::string& reference_path,
-    const std::string& method,
-    double tolerance_cents,
-    const std::string& difficulty_mode) {
-    
-    if (!isInitialized()) {
-        return "{\"error\": \"Python interpreter not initialized\"}";
+void KaraokeScorer::setLastError(const std::string& error) {
+    std::lock_guard<std::mutex> lock(errorMutex);
+    lastError = error;
+}
+
+bool KaraokeScorer::ensureFunction() {
+    // Phải gọi khi đang giữ GIL - GIL bảo vệ pModule/pFunc
+    if (pFunc) {
+        return true;
     }
     
-    // Import module
-    PyObject* pModule = PyImport_ImportModule("library_interface");
-    if (!pModule) {
+    // Import module (chỉ một lần)
+    PyObject* module = PyImport_ImportModule("library_interface");
+    if (!module) {
         PyErr_Print();
-        lastError = "Failed to import library_interface module";
-        return "{\"error\": \"" + lastError + "\"}";
+        setLastError("Failed to import library_interface module");
+        return false;
     }
     
-    // Get function
-    PyObject* pFunc = PyObject_GetAttrString(pModule, "score_karaoke_and_get_json");
-    if (!pFunc || !PyCallable_Check(pFunc)) {
-        Py_XDECREF(pFunc);
-        Py_DECREF(pModule);
+    // Get functions
+    PyObject* func = PyObject_GetAttrString(module, "score_karaoke_and_get_json");
+    if (!func || !PyCallable_Check(func)) {
+        Py_XDECREF(func);
+        Py_DECREF(module);
         PyErr_Print();
-        lastError = "Function score_karaoke_and_get_json not found";
-        return "{\"error\": \"" + lastError + "\"}";
+        setLastError("Function score_karaoke_and_get_json not found");
+        return false;
+    }
+    PyObject* pcmFunc = PyObject_GetAttrString(module, "score_karaoke_pcm_and_get_json");
+    if (!pcmFunc || !PyCallable_Check(pcmFunc)) {
+        Py_XDECREF(pcmFunc);
+        Py_DECREF(func);
+        Py_DECREF(module);
+        PyErr_Print();
+        setLastError("Function score_karaoke_pcm_and_get_json not found");
+        return false;
     }
     
-    // Prepare arguments
-    PyObject* pArgs = PyTuple_New(5);
-    PyObject* pUserPath = PyUnicode_FromString(user_audio_path.c_str());
-    PyObject* pRefPath = PyUnicode_FromString(reference_path.c_str());
-    PyObject* pMethod = PyUnicode_FromString(method.c_str());
-    PyObject* pTolerance = PyFloat_FromDouble(tolerance_cents);
-    PyObject* pDifficulty = PyUnicode_FromString(difficulty_mode.c_str());
-    
-    PyTuple_SetItem(pArgs, 0, pUserPath);
-    PyTuple_SetItem(pArgs, 1, pRefPath);
-    PyTuple_SetItem(pArgs, 2, pMethod);
-    PyTuple_SetItem(pArgs, 3, pTolerance);
-    PyTuple_SetItem(pArgs, 4, pDifficulty);
-    
-    // Call function
-    PyObject* pResult = PyObject_CallObject(pFunc, pArgs);
+    // Import có thể tạm nhả GIL; nếu thread khác đã cache trước thì dùng bản đó
+    if (pFunc) {
+        Py_DECREF(pcmFunc);
+        Py_DECREF(func);
+        Py_DECREF(module);
+    } else {
+        pModule = module;
+        pFunc = func;
+        pPcmFunc = pcmFunc;
+    }
+    return true;
+}
+
+// start / end truyền theo keyword, chỉ khi được đặt (giá trị âm = không giới hạn).
+// Trả về NULL nếu không cần kwargs (cần giữ GIL)
+static PyObject* makeRangeKwargs(double start, double end) {
+    if (start < 0.0 && end < 0.0) {
+        return NULL;
+    }
+    PyObject* pKwargs = PyDict_New();
+    if (start >= 0.0) {
+        PyObject* pStart = PyFloat_FromDouble(start);
+        PyDict_SetItemString(pKwargs, "start", pStart);
+        Py_DECREF(pStart);
+    }
+    if (end >= 0.0) {
+        PyObject* pEnd = PyFloat_FromDouble(end);
+        PyDict_SetItemString(pKwargs, "end", pEnd);
+        Py_DECREF(pEnd);
+    }
+    return pKwargs;
+}
+
+std::string KaraokeScorer::invokeCached(PyObject* func, PyObject* pArgs, PyObject* pKwargs) {
+    // Call function (numpy/TensorFlow tự nhả GIL trong các phép tính nặng)
+    PyObject* pResult = PyObject_Call(func, pArgs, pKwargs);
     Py_DECREF(pArgs);
-    Py_DECREF(pFunc);
-    Py_DECREF(pModule);
+    Py_XDECREF(pKwargs);
     
     if (!pResult) {
         PyErr_Print();
-        lastError = "Python function call failed";
-        return "{\"error\": \"" + lastError + "\"}";
+        setLastError("Python function call failed");
+        return "{\"error\": \"Python function call failed\"}";
     }
     
     // Convert to string
@@ -182,27 +243,243 @@ std::string KaraokeScorer::callPythonFunction(
     return result;
 }
 
+std::string KaraokeScorer::callPythonFunction(
+    const std::string& user_audio_path,
+    const std::string& reference_path,
+    const std::string& method,
+    double tolerance_cents,
+    const std::string& difficulty_mode,
+    const std::string& contour_output_path,
+    double start,
+    double end) {
+    
+    if (!isInitialized()) {
+        return "{\"error\": \"Python interpreter not initialized\"}";
+    }
+    
+    PyGILState_STATE gstate = PyGILState_Ensure();
+    
+    if (!ensureFunction()) {
+        PyGILState_Release(gstate);
+        return "{\"error\": \"" + getLastError() + "\"}";
+    }
+    
+    // Prepare arguments (include_advice + contour_output_path chỉ truyền khi cần file contour)
+    PyObject* pArgs = PyTuple_New(contour_output_path.empty() ? 5 : 7);
+    PyObject* pUserPath = PyUnicode_FromString(user_audio_path.c_str());
+    PyObject* pRefPath = PyUnicode_FromString(reference_path.c_str());
+    PyObject* pMethod = PyUnicode_FromString(method.c_str());
+    PyObject* pTolerance = PyFloat_FromDouble(tolerance_cents);
+    PyObject* pDifficulty = PyUnicode_FromString(difficulty_mode.c_str());
+    
+    PyTuple_SetItem(pArgs, 0, pUserPath);
+    PyTuple_SetItem(pArgs, 1, pRefPath);
+    PyTuple_SetItem(pArgs, 2, pMethod);
+    PyTuple_SetItem(pArgs, 3, pTolerance);
+    PyTuple_SetItem(pArgs, 4, pDifficulty);
+    if (!contour_output_path.empty()) {
+        Py_INCREF(Py_False);
+        PyTuple_SetItem(pArgs, 5, Py_False);
+        PyTuple_SetItem(pArgs, 6, PyUnicode_FromString(contour_output_path.c_str()));
+    }
+    
+    std::string result = invokeCached(pFunc, pArgs, makeRangeKwargs(start, end));
+    PyGILState_Release(gstate);
+    return result;
+}
+
+std::string KaraokeScorer::callPythonPcmFunction(
+    const float* samples,
+    size_t num_samples,
+    int sample_rate,
+    const std::string& reference_path,
+    const std::string& method,
+    double tolerance_cents,
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
+    
+    if (!isInitialized()) {
+        return "{\"error\": \"Python interpreter not initialized\"}";
+    }
+    if (!samples && num_samples > 0) {
+        return "{\"error\": \"PCM buffer is null\"}";
+    }
+    
+    PyGILState_STATE gstate = PyGILState_Ensure();
+    
+    if (!ensureFunction()) {
+        PyGILState_Release(gstate);
+        return "{\"error\": \"" + getLastError() + "\"}";
+    }
+    
+    // Bọc buffer của caller bằng memoryview chỉ đọc - không copy dữ liệu
+    static float emptyBuffer[1] = {0.0f};
+    PyObject* pPcm = PyMemoryView_FromMemory(
+        reinterpret_cast<char*>(const_cast<float*>(samples ? samples : emptyBuffer)),
+        static_cast<Py_ssize_t>(num_samples * sizeof(float)),
+        PyBUF_READ);
+    if (!pPcm) {
+        PyErr_Print();
+        PyGILState_Release(gstate);
+        setLastError("Failed to wrap PCM buffer");
+        return "{\"error\": \"Failed to wrap PCM buffer\"}";
+    }
+    
+    // score_karaoke_pcm_and_get_json(user_pcm, sample_rate, reference_path, method, tolerance, difficulty, dtype)
+    PyObject* pArgs = PyTuple_New(7);
+    PyTuple_SetItem(pArgs, 0, pPcm);
+    PyTuple_SetItem(pArgs, 1, PyLong_FromLong(sample_rate));
+    PyTuple_SetItem(pArgs, 2, PyUnicode_FromString(reference_path.c_str()));
+    PyTuple_SetItem(pArgs, 3, PyUnicode_FromString(method.c_str()));
+    PyTuple_SetItem(pArgs, 4, PyFloat_FromDouble(tolerance_cents));
+    PyTuple_SetItem(pArgs, 5, PyUnicode_FromString(difficulty_mode.c_str()));
+    PyTuple_SetItem(pArgs, 6, PyUnicode_FromString("float32"));
+    
+    std::string result = invokeCached(pPcmFunc, pArgs, makeRangeKwargs(start, end));
+    PyGILState_Release(gstate);
+    return result;
+}
+
 std::string KaraokeScorer::scoreAsJson(
     const std::string& user_audio_path,
     const std::string& reference_path,
     const std::string& method,
     double tolerance_cents,
-    const std::string& difficulty_mode) {
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
+    
+    return callPythonFunction(user_audio_path, reference_path, method, tolerance_cents, difficulty_mode,
+                              "", start, end);
+}
+
+std::map<std::string, double> KaraokeScorer::score(
+    const std::string& user_audio_path,
+    const std::string& reference_path,
+    const std::string& method,
+    double tolerance_cents,
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
+    
+    std::string json_result = callPythonFunction(user_audio_path, reference_path, method, tolerance_cents,
+                                                 difficulty_mode, "", start, end);
+    return parseSimpleJson(json_result);
+}
+
+std::string KaraokeScorer::scoreAsJson(
+    const float* samples,
+    size_t num_samples,
+    int sample_rate,
+    const std::string& reference_path,
+    const std::string& method,
+    double tolerance_cents,
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
     
-    return callPythonFunction(user_audio_path, reference_path, method, tolerance_cents, difficulty_mode);
+    return callPythonPcmFunction(samples, num_samples, sample_rate, reference_path, method, tolerance_cents,
+                                 difficulty_mode, start, end);
 }
 
 std::map<std::string, double> KaraokeScorer::score(
+    const float* samples,
+    size_t num_samples,
+    int sample_rate,
+    const std::string& reference_path,
+    const std::string& method,
+    double tolerance_cents,
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
+    
+    std::string json_result = callPythonPcmFunction(samples, num_samples, sample_rate, reference_path, method,
+                                                    tolerance_cents, difficulty_mode, start, end);
+    return parseSimpleJson(json_result);
+}
+
+std::map<std::string, double> KaraokeScorer::scoreWithContours(
     const std::string& user_audio_path,
     const std::string& reference_path,
+    const std::string& contour_output_path,
     const std::string& method,
     double tolerance_cents,
-    const std::string& difficulty_mode) {
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
     
-    std::string json_result = callPythonFunction(user_audio_path, reference_path, method, tolerance_cents, difficulty_mode);
+    std::string json_result = callPythonFunction(user_audio_path, reference_path, method, tolerance_cents,
+                                                 difficulty_mode, contour_output_path, start, end);
     return parseSimpleJson(json_result);
 }
 
+bool KaraokeScorer::loadContours(const std::string& path, std::vector<char>& buffer,
+                                 KaraokeContourView& view) {
+    std::ifstream file(path.c_str(), std::ios::binary | std::ios::ate);
+    if (!file) {
+        setLastError("Cannot open contour file: " + path);
+        return false;
+    }
+    std::streamsize size = file.tellg();
+    file.seekg(0, std::ios::beg);
+    buffer.resize(static_cast<size_t>(size));
+    if (size > 0 && !file.read(buffer.data(), size)) {
+        setLastError("Cannot read contour file: " + path);
+        return false;
+    }
+    
+    std::string error;
+    if (!mapContours(buffer.data(), buffer.size(), view, &error)) {
+        setLastError(error);
+        return false;
+    }
+    return true;
+}
+
+std::future<std::map<std::string, double> > KaraokeScorer::scoreAsync(
+    const std::string& user_audio_path,
+    const std::string& reference_path,
+    const std::string& method,
+    double tolerance_cents,
+    const std::string& difficulty_mode,
+    double start,
+    double end) {
+    
+    // Copy tham số vào lambda vì caller có thể hủy chuỗi trước khi thread chạy
+    return std::async(std::launch::async,
+        [this, user_audio_path, reference_path, method, tolerance_cents, difficulty_mode, start, end]() {
+            return this->score(user_audio_path, reference_path, method, tolerance_cents, difficulty_mode,
+                               start, end);
+        });
+}
+
+std::string KaraokeScorer::getMetrics() {
+    if (!isInitialized()) {
+        setLastError("Python interpreter not initialized");
+        return "";
+    }
+    
+    PyGILState_STATE gstate = PyGILState_Ensure();
+    if (!ensureFunction()) {
+        PyGILState_Release(gstate);
+        return "";
+    }
+    
+    PyObject* func = PyObject_GetAttrString(pModule, "get_metrics_text");
+    if (!func || !PyCallable_Check(func)) {
+        Py_XDECREF(func);
+        PyErr_Print();
+        PyGILState_Release(gstate);
+        setLastError("Function get_metrics_text not found");
+        return "";
+    }
+    std::string result = invokeCached(func, PyTuple_New(0));
+    Py_DECREF(func);
+    PyGILState_Release(gstate);
+    return result;
+}
+
 std::map<std::string, double> KaraokeScorer::parseJsonResult(const std::string& json_str) {
     return parseSimpleJson(json_str);
 }
@@ -3,6 +3,15 @@
 
 #include <string>
 #include <map>
+#include <cstddef>
+#include <future>
+#include <mutex>
+#include <vector>
+
+#include "KaraokeContour.h"
+
+// Khai báo trước kiểu PyObject để header không phụ thuộc Python.h
+struct _object;
 
 /**
  * @class KaraokeScorer
@@ -10,6 +19,11 @@
  * 
  * Class này cung cấp interface C++ thuận tiện để gọi thư viện Python
  * mà không cần trực tiếp làm việc với Python C API.
+ *
+ * Thread-safety: có thể gọi score()/scoreAsJson()/scoreAsync() đồng thời từ
+ * nhiều thread. Mỗi lần gọi tự lấy GIL bằng PyGILState_Ensure và trả lại ngay
+ * sau khi Python trả kết quả; module và hàm Python chỉ được import/tra cứu
+ * một lần rồi cache lại. Nên tạo và hủy KaraokeScorer trên cùng một thread.
  */
 class KaraokeScorer {
 public:
@@ -23,6 +37,10 @@ public:
      */
     ~KaraokeScorer();
     
+    // Giữ tham chiếu tới object Python nên không cho phép copy
+    KaraokeScorer(const KaraokeScorer&) = delete;
+    KaraokeScorer& operator=(const KaraokeScorer&) = delete;
+    
     /**
      * @brief Chấm điểm karaoke từ 2 file audio
      * 
@@ -31,6 +49,9 @@ public:
      * @param method Phương pháp trích xuất pitch: "crepe" hoặc "basic_pitch" (mặc định: "crepe")
      * @param tolerance_cents Độ lệch cho phép tính bằng cents (mặc định: 200.0)
      * @param difficulty_mode Độ khó: "easy", "normal", "hard" (mặc định: "easy")
+     * @param start Chỉ chấm từ giây này của bài (âm = từ đầu bài, mặc định)
+     * @param end Chỉ chấm tới giây này của bài (âm = tới hết bài, mặc định).
+     *            Chỉ đoạn [start, end] của hai file được decode và trích xuất pitch
      * @return std::map<std::string, double> Map chứa kết quả chấm điểm
      * 
      * Kết quả trả về bao gồm:
@@ -50,7 +71,9 @@ public:
         const std::string& reference_path,
         const std::string& method = "crepe",
         double tolerance_cents = 200.0,
-        const std::string& difficulty_mode = "easy"
+        const std::string& difficulty_mode = "easy",
+        double start = -1.0,
+        double end = -1.0
     );
     
     /**
@@ -61,6 +84,7 @@ public:
      * @param method Phương pháp trích xuất pitch
      * @param tolerance_cents Độ lệch cho phép (cents)
      * @param difficulty_mode Độ khó
+     * @param start, end Đoạn cần chấm (giây, âm = không giới hạn), như score()
      * @return std::string JSON string chứa kết quả
      */
     std::string scoreAsJson(
@@ -68,9 +92,119 @@ public:
         const std::string& reference_path,
         const std::string& method = "crepe",
         double tolerance_cents = 200.0,
-        const std::string& difficulty_mode = "easy"
+        const std::string& difficulty_mode = "easy",
+        double start = -1.0,
+        double end = -1.0
+    );
+    
+    /**
+     * @brief Chấm điểm từ PCM trong bộ nhớ (không cần ghi file WAV tạm)
+     * 
+     * Buffer được bọc zero-copy phía Python (memoryview + np.frombuffer) nên
+     * phải còn hợp lệ cho tới khi hàm trả về.
+     * 
+     * @param samples Mảng sample float32 mono trong khoảng [-1, 1]
+     * @param num_samples Số sample
+     * @param sample_rate Sample rate của PCM (Hz)
+     * @param reference_path Đường dẫn file audio/MIDI tham chiếu
+     * @param method Phương pháp trích xuất pitch (mặc định: "crepe")
+     * @param tolerance_cents Độ lệch cho phép (mặc định: 200.0)
+     * @param difficulty_mode Độ khó (mặc định: "easy")
+     * @param start, end Đoạn cần chấm (giây trên timeline của bài, âm = không giới hạn),
+     *                   như score() với file. PCM được coi là bắt đầu từ giây 0 của bài
+     * @return std::map<std::string, double> Map kết quả (giống score() với file)
+     */
+    std::map<std::string, double> score(
+        const float* samples,
+        size_t num_samples,
+        int sample_rate,
+        const std::string& reference_path,
+        const std::string& method = "crepe",
+        double tolerance_cents = 200.0,
+        const std::string& difficulty_mode = "easy",
+        double start = -1.0,
+        double end = -1.0
+    );
+    
+    /**
+     * @brief Chấm điểm từ PCM trong bộ nhớ và trả về JSON string (raw)
+     * 
+     * @param start, end Đoạn cần chấm (giây, âm = không giới hạn), như score()
+     */
+    std::string scoreAsJson(
+        const float* samples,
+        size_t num_samples,
+        int sample_rate,
+        const std::string& reference_path,
+        const std::string& method = "crepe",
+        double tolerance_cents = 200.0,
+        const std::string& difficulty_mode = "easy",
+        double start = -1.0,
+        double end = -1.0
+    );
+    
+    /**
+     * @brief Chấm điểm và ghi contour + deviation từng frame ra file nhị phân KSPC
+     * 
+     * Kết quả vô hướng vẫn trả về qua map như score(); contour được ghi vào
+     * contour_output_path và đọc lại bằng loadContours() hoặc mapContours()
+     * (ví dụ trên vùng mmap) mà không cần parse.
+     * 
+     * @param contour_output_path Đường dẫn file .kspc sẽ được ghi
+     * @param start, end Đoạn cần chấm (giây, âm = không giới hạn), như score()
+     * @return std::map<std::string, double> Map kết quả, thêm "contours_frames"
+     */
+    std::map<std::string, double> scoreWithContours(
+        const std::string& user_audio_path,
+        const std::string& reference_path,
+        const std::string& contour_output_path,
+        const std::string& method = "crepe",
+        double tolerance_cents = 200.0,
+        const std::string& difficulty_mode = "easy",
+        double start = -1.0,
+        double end = -1.0
+    );
+    
+    /**
+     * @brief Đọc file KSPC vào buffer và map thành KaraokeContourView
+     * 
+     * @param path Đường dẫn file .kspc
+     * @param buffer Buffer giữ dữ liệu file (view trỏ vào buffer này)
+     * @param view Kết quả
+     * @return true nếu thành công, false nếu lỗi (xem getLastError())
+     */
+    bool loadContours(const std::string& path, std::vector<char>& buffer, KaraokeContourView& view);
+    
+    /**
+     * @brief Chấm điểm bất đồng bộ trên một thread riêng
+     * 
+     * Các tham số giống score(). Thread gọi không giữ GIL trong lúc chờ
+     * std::future, nên có thể chấm nhiều bài song song.
+     * 
+     * @return std::future chứa map kết quả (giống score())
+     */
+    std::future<std::map<std::string, double> > scoreAsync(
+        const std::string& user_audio_path,
+        const std::string& reference_path,
+        const std::string& method = "crepe",
+        double tolerance_cents = 200.0,
+        const std::string& difficulty_mode = "easy",
+        double start = -1.0,
+        double end = -1.0
     );
     
+    /**
+     * @brief Số liệu của process ở định dạng text Prometheus
+     * 
+     * Gồm số bài đã chấm, lỗi theo loại, cache hit/miss, histogram độ trễ
+     * từng stage và cả lần chấm, thời gian load model. Host có thể phục vụ
+     * chuỗi này qua endpoint /metrics của mình, hoặc đặt biến môi trường
+     * KARAOKE_METRICS_FILE để Python tự ghi ra file định kỳ.
+     * 
+     * @return std::string Text Prometheus (khi lỗi xem getLastError())
+     */
+    std::string getMetrics();
+    
     /**
      * @brief Kiểm tra xem Python interpreter đã được khởi tạo chưa
      * @return true nếu đã khởi tạo, false nếu chưa
@@ -86,6 +220,26 @@ public:
 private:
     bool initialized;
     std::string lastError;
+    mutable std::mutex errorMutex;
+    
+    // Interpreter do instance này khởi tạo (GIL được nhả sau constructor)
+    bool ownsInterpreter;
+    void* mainThreadState;
+    
+    // Cache module library_interface, hàm score_karaoke_and_get_json và
+    // score_karaoke_pcm_and_get_json (chỉ đọc/ghi khi đang giữ GIL)
+    _object* pModule;
+    _object* pFunc;
+    _object* pPcmFunc;
+    
+    // Import module và tra cứu hàm một lần (gọi khi đang giữ GIL)
+    bool ensureFunction();
+    
+    // Gọi hàm Python đã cache với tuple tham số và dict keyword (có thể NULL)
+    // (nhận ownership của pArgs và pKwargs, cần giữ GIL)
+    std::string invokeCached(_object* func, _object* pArgs, _object* pKwargs = NULL);
+    
+    void setLastError(const std::string& error);
     
     // Helper function để gọi Python
     std::string callPythonFunction(
@@ -93,7 +247,23 @@ private:
         const std::string& reference_path,
         const std::string& method,
         double tolerance_cents,
-        const std::string& difficulty_mode
+        const std::string& difficulty_mode,
+        const std::string& contour_output_path = "",
+        double start = -1.0,
+        double end = -1.0
+    );
+    
+    // Helper function để gọi Python với PCM trong bộ nhớ
+    std::string callPythonPcmFunction(
+        const float* samples,
+        size_t num_samples,
+        int sample_rate,
+        const std::string& reference_path,
+        const std::string& method,
+        double tolerance_cents,
+        const std::string& difficulty_mode,
+        double start = -1.0,
+        double end = -1.0
     );
     
     // Helper function để parse JSON
@@ -0,0 +1,173 @@
+"""
+Cache activation thô của CREPE để đổi ngưỡng confidence / bật Viterbi mà không chạy lại model
+
+Mạng CREPE chiếm gần hết thời gian trích xuất; chọn đỉnh (local average), Viterbi
+và ngưỡng confidence chỉ là bước giải mã ma trận activation (n_frames, 360).
+ActivationCache giữ ma trận này ở float16 trong bộ nhớ và, nếu có thư mục, ghi ra
+file .npz nén để lần chạy sau (hoặc process khác) dùng lại. Khi cache hit, audio
+không phải decode và model không phải chạy, giải mã lại chỉ mất vài ms.
+
+Khóa cache gồm nguồn audio (file: đường dẫn + mtime + kích thước; PCM: hash nội
+dung), model capacity, step size, normalize và đoạn audio được decode.
+
+Ví dụ:
+    extractor = PitchExtractor(activation_cache=ActivationCache('cache/activations'))
+    extractor.extract_pitch('take.wav', confidence_threshold=0.4)
+    extractor.extract_pitch('take.wav', confidence_threshold=0.6, use_viterbi=True)  # không suy luận lại
+"""
+import functools
+import hashlib
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from metrics import record_cache
+
+# Số ma trận activation giữ trong bộ nhớ (bài 5 phút, bước 10ms ~ 21MB float16 mỗi ma trận)
+MEMORY_ENTRIES = 8
+
+# Kích thước khối đọc khi băm nội dung file audio
+HASH_CHUNK_BYTES = 1 << 20
+
+# Kiểu lưu activation (giá trị sigmoid trong [0, 1], sai số float16 < 5e-4)
+STORAGE_DTYPE = np.float16
+
+
+def audio_digest(audio_source, sample_rate: Optional[int] = None, dtype: str = 'float32',
+                 file_content: bool = True):
+    """
+    Hash BLAKE2b (128-bit) của một nguồn audio, dùng chung cho các khóa cache
+
+    Args:
+        audio_source: Đường dẫn file hoặc PCM trong bộ nhớ
+        sample_rate, dtype: Định dạng của PCM (bỏ qua với file); cùng sample nhưng
+                            khác định dạng cho hash khác nhau
+        file_content: True = băm nội dung file theo từng khối (không phụ thuộc tên file),
+                      False = chỉ băm đường dẫn + mtime + kích thước (không đọc file)
+
+    Returns:
+        Đối tượng hash để caller thêm tham số trước khi lấy hexdigest()
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(audio_source, (str, os.PathLike)):
+        if file_content:
+            with open(audio_source, 'rb') as f:
+                for chunk in iter(functools.partial(f.read, HASH_CHUNK_BYTES), b''):
+                    digest.update(chunk)
+        else:
+            stat = os.stat(audio_source)
+            digest.update(repr(('file', os.path.abspath(audio_source), stat.st_mtime_ns, stat.st_size)).encode())
+        return digest
+    if isinstance(audio_source, np.ndarray):
+        digest.update(f'{audio_source.dtype.str}{audio_source.shape}'.encode())
+        audio_source = np.ascontiguousarray(audio_source)
+    else:
+        digest.update(str(dtype).encode())
+    digest.update(f'@{sample_rate}'.encode())
+    digest.update(memoryview(audio_source).cast('B'))
+    return digest
+
+
+def activation_key(audio_source, sample_rate: Optional[int] = None, dtype: str = 'float32',
+                   **settings) -> str:
+    """
+    Khóa cache cho activation của một nguồn audio với một bộ tham số suy luận
+
+    Args:
+        audio_source: Đường dẫn file hoặc PCM trong bộ nhớ
+        sample_rate, dtype: Định dạng của PCM (bỏ qua với file)
+        **settings: Tham số ảnh hưởng tới activation (model_capacity, step_size, ...)
+
+    Returns:
+        Hex digest (BLAKE2b, 128-bit)
+    """
+    digest = audio_digest(audio_source, sample_rate, dtype, file_content=False)
+    digest.update(repr(sorted(settings.items())).encode())
+    return digest.hexdigest()
+
+
+class ActivationCache:
+    """
+    Activation CREPE (float16) theo khóa activation_key: LRU trong bộ nhớ + file .npz nén
+
+    An toàn giữa các thread. File được ghi qua file tạm rồi đổi tên nên nhiều
+    process có thể dùng chung một thư mục.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = MEMORY_ENTRIES):
+        """
+        Args:
+            directory: Thư mục lưu file .npz (None = chỉ giữ trong bộ nhớ)
+            max_entries: Số ma trận giữ trong bộ nhớ
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def _remember(self, key: str, activation: np.ndarray):
+        with self._lock:
+            self._entries[key] = activation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Ma trận activation (float16, chỉ đọc) hoặc None nếu chưa có"""
+        with self._lock:
+            activation = self._entries.get(key)
+            if activation is not None:
+                self._entries.move_to_end(key)
+        if activation is None and self.directory and os.path.exists(self._path(key)):
+            try:
+                with np.load(self._path(key)) as data:
+                    activation = data['activation']
+                activation.setflags(write=False)
+                self._remember(key, activation)
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                print(f"⚠️ Bỏ qua file activation hỏng {self._path(key)}: {e}")
+                activation = None
+        with self._lock:
+            if activation is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        record_cache('activation', hit=activation is not None)
+        return activation
+
+    def put(self, key: str, activation: np.ndarray) -> np.ndarray:
+        """Lưu activation (chuyển sang float16), trả về bản đã lưu"""
+        activation = np.ascontiguousarray(activation, dtype=STORAGE_DTYPE)
+        activation.setflags(write=False)
+        self._remember(key, activation)
+        if self.directory:
+            tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez_compressed(f, activation=activation)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                print(f"⚠️ Không ghi được activation ra {self._path(key)}: {e}")
+        return activation
+
+    def clear(self):
+        """Xóa các ma trận trong bộ nhớ (file trên đĩa giữ nguyên)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Số lần hit / miss và số ma trận trong bộ nhớ"""
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'size': len(self._entries),
+                    'max_entries': self.max_entries, 'directory': self.directory}
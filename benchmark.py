@@ -0,0 +1,388 @@
+"""
+Benchmark pipeline chấm điểm với audio tổng hợp (chạy offline, chỉ cần CPU)
+
+Tạo reference và bản "người hát" từ các tín hiệu tổng hợp:
+    - sine:    giai điệu gồm các nốt giữ nguyên cao độ
+    - vibrato: cùng giai điệu, thêm vibrato 5.5 Hz ±40 cents
+    - glide:   cao độ trượt liên tục giữa các nốt
+Mỗi reference có hai bản người hát: detuned (lệch +35 cents) và time_shifted
+(trễ 0.3 giây). Audio được ghi ra WAV 22.05 kHz để đo cả bước decode và resample.
+
+Backend:
+    - contour:     bỏ qua model, dùng pitch gốc của tín hiệu tổng hợp (luôn chạy được)
+    - crepe:       cần crepe + tensorflow
+    - basic_pitch: cần basic-pitch
+Backend chưa cài được bỏ qua.
+
+Thời gian từng stage lấy từ instrumentation (median qua --repeat lần chạy) và ghi
+ra JSON. Với --baseline, benchmark trả exit code 1 nếu stage nào chậm hơn baseline
+quá --threshold (tương đối) và --min-delta (tuyệt đối).
+
+Với --profile-memory, mỗi case chạy thêm một lần có tracemalloc + lấy mẫu RSS (không
+tính vào thời gian) và ghi bộ nhớ từng stage vào "memory". --memory-budget STAGE=MB
+và --rss-budget MB làm benchmark thất bại khi vượt ngân sách bộ nhớ.
+
+Chạy:
+    python benchmark.py --output bench.json --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --durations 10 180
+    python benchmark.py --profile-memory --memory-budget match.dtw=200 --rss-budget 2048
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import collect_timings, stage
+from library_interface import KaraokeSession
+from pitch_advisor import PitchAdvisor
+from pitch_extractor import PitchExtractor
+
+SIGNALS = ('sine', 'vibrato', 'glide')
+VARIANTS = ('detuned', 'time_shifted')
+BACKENDS = ('contour', 'crepe', 'basic_pitch')
+DEFAULT_DURATIONS = (10.0, 180.0, 1800.0)
+
+AUDIO_SR = 22050
+CONTOUR_RATE = 100  # frame/giây của pitch gốc (giống CREPE step 10ms)
+NOTE_SECONDS = 0.5
+DETUNE_CENTS = 35.0
+TIME_SHIFT_SECONDS = 0.3
+_CHUNK_SECONDS = 10.0
+
+_BACKEND_MODULES = {'crepe': 'crepe', 'basic_pitch': 'basic_pitch'}
+
+
+def backend_available(backend: str) -> bool:
+    """Backend có chạy được trên máy này không"""
+    module = _BACKEND_MODULES.get(backend)
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def _note_cents(duration: float, seed: int = 7) -> np.ndarray:
+    """Cao độ (cents so với A4) của từng nốt, trong khoảng G3..E5"""
+    rng = np.random.default_rng(seed)
+    n_notes = int(np.ceil(duration / NOTE_SECONDS)) + 2
+    return rng.integers(-14, 8, n_notes) * 100.0
+
+
+def pitch_curve(signal: str, t: np.ndarray, notes: np.ndarray) -> np.ndarray:
+    """
+    Cao độ (Hz) của tín hiệu tại các thời điểm t
+
+    Args:
+        signal: 'sine', 'vibrato' hoặc 'glide'
+        t: Thời điểm (giây)
+        notes: Cao độ từng nốt (cents), mỗi nốt dài NOTE_SECONDS
+    """
+    position = t / NOTE_SECONDS
+    index = np.minimum(position.astype(np.int64), len(notes) - 2)
+    if signal == 'glide':
+        frac = position - index
+        cents = notes[index] + (notes[index + 1] - notes[index]) * frac
+    else:
+        cents = notes[index]
+        if signal == 'vibrato':
+            cents = cents + 40.0 * np.sin(2 * np.pi * 5.5 * t)
+    return 440.0 * np.power(2.0, cents / 1200.0)
+
+
+def synthesize(path: str, signal: str, duration: float, cents_offset: float = 0.0,
+               delay: float = 0.0, sample_rate: int = AUDIO_SR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ghi tín hiệu tổng hợp ra WAV (theo từng đoạn để bản 30 phút không tốn nhiều RAM)
+
+    Returns:
+        (time, frequency): Pitch gốc ở CONTOUR_RATE frame/giây (chỉ các frame có giọng)
+    """
+    import soundfile as sf
+
+    notes = _note_cents(duration)
+    scale = np.power(2.0, cents_offset / 1200.0)
+    phase = 0.0
+    chunk = int(_CHUNK_SECONDS * sample_rate)
+    total = int(duration * sample_rate)
+    with sf.SoundFile(path, 'w', samplerate=sample_rate, channels=1, subtype='PCM_16') as f:
+        for start in range(0, total, chunk):
+            t = np.arange(start, min(start + chunk, total)) / sample_rate - delay
+            freq = pitch_curve(signal, np.maximum(t, 0.0), notes) * scale
+            phases = phase + 2 * np.pi * np.cumsum(freq) / sample_rate
+            phase = float(phases[-1] % (2 * np.pi))
+            # Thêm hai họa âm cho giống giọng hát hơn một sóng sin thuần
+            audio = 0.5 * np.sin(phases) + 0.15 * np.sin(2 * phases) + 0.05 * np.sin(3 * phases)
+            audio[t < 0] = 0.0
+            f.write(audio.astype(np.float32))
+
+    frame_time = np.arange(0, duration, 1.0 / CONTOUR_RATE)
+    voiced = frame_time >= delay
+    frame_time = frame_time[voiced]
+    frame_freq = pitch_curve(signal, frame_time - delay, notes) * scale
+    return frame_time, frame_freq
+
+
+class _ContourBackend:
+    """Backend không dùng model: decode audio rồi trả về pitch gốc đã biết"""
+
+    def __init__(self):
+        self.extractor = PitchExtractor(method='crepe')
+        self.session = KaraokeSession(method='crepe')
+
+    def score(self, user_path: str, reference_path: str,
+              user_contour, reference_contour, profile_memory: bool = False) -> Dict:
+        with collect_timings(profile_memory) as timings:
+            start = time.perf_counter()
+            with stage('extract_user') as record:
+                self.extractor.load_audio(user_path)
+                record.frames = len(user_contour[0])
+            with stage('reference') as record:
+                self.extractor.load_audio(reference_path)
+                record.frames = len(reference_contour[0])
+            with stage('match'):
+                matcher = self.session.get_matcher()
+                aligned = matcher.align_cents(*user_contour, *reference_contour)
+                results = matcher.score_aligned(*aligned)
+            with stage('advice'):
+                PitchAdvisor().analyze_pitch_contour(*user_contour, *reference_contour)
+        results['timings'] = timings.as_dict()
+        results['timings']['total'] = {'seconds': time.perf_counter() - start,
+                                       'frames': None, 'calls': 1}
+        return results
+
+
+class _ModelBackend:
+    """Backend dùng KaraokeSession thật (CREPE / Basic Pitch)"""
+
+    def __init__(self, method: str):
+        self.session = KaraokeSession(method=method)
+        self.session.warm_up()
+
+    def score(self, user_path: str, reference_path: str,
+              user_contour, reference_contour, profile_memory: bool = False) -> Dict:
+        # Xóa cache để mỗi lần chạy đều đo cả bước trích xuất reference
+        self.session.clear_cache()
+        return self.session.score(user_path, reference_path, include_advice=True,
+                                  include_timings=True, profile_memory=profile_memory)
+
+
+def _make_backend(backend: str):
+    return _ContourBackend() if backend == 'contour' else _ModelBackend(backend)
+
+
+def _case_key(case: Dict) -> str:
+    return f"{case['backend']}/{case['signal']}/{case['variant']}/{case['duration']:g}s"
+
+
+def run_benchmark(backends: List[str], durations: List[float], signals: List[str] = SIGNALS,
+                  variants: List[str] = VARIANTS, repeat: int = 3,
+                  work_dir: Optional[str] = None, profile_memory: bool = False) -> Dict:
+    """
+    Chạy toàn bộ ma trận backend × độ dài × tín hiệu × biến thể
+
+    Returns:
+        Dictionary kết quả (JSON được): machine, cases[{backend, signal, variant,
+        duration, final_score, stages{tên: giây}[, memory{tên: {...}}]}], skipped_backends
+    """
+    report = {
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'repeat': repeat,
+        'cases': [],
+        'skipped_backends': [b for b in backends if not backend_available(b)],
+    }
+    active = [b for b in backends if backend_available(b)]
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        runners = {backend: _make_backend(backend) for backend in active}
+        # Chạy thử một lần để JIT (numba/librosa) và model không bị tính vào case đầu tiên
+        warm_ref = os.path.join(tmp_dir, 'warm_up_ref.wav')
+        warm_user = os.path.join(tmp_dir, 'warm_up_user.wav')
+        warm_contours = (synthesize(warm_user, 'sine', 2.0), synthesize(warm_ref, 'sine', 2.0))
+        for runner in runners.values():
+            runner.score(warm_user, warm_ref, *warm_contours)
+        
+        for duration in durations:
+            for signal in signals:
+                ref_path = os.path.join(tmp_dir, f'{signal}_{duration:g}_ref.wav')
+                ref_contour = synthesize(ref_path, signal, duration)
+                for variant in variants:
+                    user_path = os.path.join(tmp_dir, f'{signal}_{duration:g}_{variant}.wav')
+                    if variant == 'detuned':
+                        user_contour = synthesize(user_path, signal, duration, cents_offset=DETUNE_CENTS)
+                    else:
+                        user_contour = synthesize(user_path, signal, duration, delay=TIME_SHIFT_SECONDS)
+
+                    for backend in active:
+                        runs = [runners[backend].score(user_path, ref_path, user_contour, ref_contour)
+                                for _ in range(repeat)]
+                        if 'error' in runs[-1]:
+                            raise RuntimeError(f"{backend} lỗi: {runs[-1]['error']}")
+                        stage_names = set().union(*(run['timings'] for run in runs))
+                        case = {
+                            'backend': backend,
+                            'signal': signal,
+                            'variant': variant,
+                            'duration': duration,
+                            'final_score': runs[-1]['final_score'],
+                            'stages': {
+                                name: float(np.median([run['timings'].get(name, {}).get('seconds', 0.0)
+                                                       for run in runs]))
+                                for name in sorted(stage_names)
+                            },
+                        }
+                        if profile_memory:
+                            profiled = runners[backend].score(user_path, ref_path, user_contour,
+                                                              ref_contour, profile_memory=True)
+                            case['memory'] = {name: timing['memory']
+                                              for name, timing in profiled['timings'].items()
+                                              if 'memory' in timing}
+                        report['cases'].append(case)
+                        print(f"  {_case_key(case):<40} total {case['stages']['total']:8.3f}s  "
+                              f"điểm {case['final_score']:6.2f}")
+                    os.remove(user_path)
+                os.remove(ref_path)
+    return report
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, threshold: float = 0.25,
+                        min_delta: float = 0.005) -> List[Dict]:
+    """
+    So sánh với baseline, trả về các stage bị chậm đi
+
+    Một stage bị coi là regression khi chậm hơn baseline quá threshold (tỷ lệ)
+    và quá min_delta giây (để bỏ qua nhiễu ở các stage rất ngắn). Case hoặc
+    stage không có trong baseline được bỏ qua.
+    """
+    baseline_cases = {_case_key(case): case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in report['cases']:
+        base = baseline_cases.get(_case_key(case))
+        if base is None:
+            continue
+        for name, seconds in case['stages'].items():
+            base_seconds = base['stages'].get(name)
+            if base_seconds is None:
+                continue
+            if seconds > base_seconds * (1.0 + threshold) and seconds - base_seconds > min_delta:
+                regressions.append({
+                    'case': _case_key(case),
+                    'stage': name,
+                    'baseline': base_seconds,
+                    'current': seconds,
+                    'ratio': seconds / base_seconds if base_seconds > 0 else float('inf'),
+                })
+    return regressions
+
+
+def check_memory_budgets(report: Dict, stage_budgets: Dict[str, float],
+                         rss_budget: Optional[float] = None) -> List[Dict]:
+    """
+    Kiểm tra ngân sách bộ nhớ của các case đã profile
+
+    Args:
+        stage_budgets: {tên stage: MB} so với peak_bytes (tracemalloc) của stage
+        rss_budget: MB so với RSS đỉnh của cả process trong một lần chấm
+
+    Returns:
+        Danh sách các lần vượt ngân sách
+    """
+    violations = []
+    for case in report['cases']:
+        memory = case.get('memory', {})
+        checks = [(name, memory.get(name, {}).get('peak_bytes'), budget)
+                  for name, budget in stage_budgets.items()]
+        if rss_budget is not None:
+            peak_rss = max((m.get('peak_rss_bytes', 0) for m in memory.values()), default=None)
+            checks.append(('rss', peak_rss, rss_budget))
+        for name, peak, budget_mb in checks:
+            if peak is not None and peak > budget_mb * 2**20:
+                violations.append({'case': _case_key(case), 'stage': name,
+                                   'peak_mb': peak / 2**20, 'budget_mb': budget_mb})
+    return violations
+
+
+def _parse_budget(text: str) -> Tuple[str, float]:
+    name, _, value = text.partition('=')
+    if not name or not value:
+        raise argparse.ArgumentTypeError(f"Cần dạng STAGE=MB: {text}")
+    return name, float(value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark pipeline chấm điểm với audio tổng hợp')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS,
+                        help='Backend cần đo (default: tất cả, backend chưa cài sẽ bị bỏ qua)')
+    parser.add_argument('--durations', nargs='+', type=float, default=list(DEFAULT_DURATIONS),
+                        help='Độ dài audio (giây) (default: 10 180 1800)')
+    parser.add_argument('--signals', nargs='+', default=list(SIGNALS), choices=SIGNALS,
+                        help='Loại tín hiệu reference (default: tất cả)')
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=VARIANTS,
+                        help='Biến thể người hát (default: tất cả)')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần chạy mỗi case, lấy median (default: 3)')
+    parser.add_argument('--output', '-o', help='Ghi kết quả ra file JSON')
+    parser.add_argument('--baseline', help='File baseline JSON để kiểm tra regression')
+    parser.add_argument('--save-baseline', help='Ghi kết quả lần chạy này làm baseline mới')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Tỷ lệ chậm đi tối đa so với baseline (default: 0.25 = 25%%)')
+    parser.add_argument('--min-delta', type=float, default=0.005,
+                        help='Chênh lệch tuyệt đối tối thiểu để tính là regression (giây, default: 0.005)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Chạy thêm một lần mỗi case để đo bộ nhớ từng stage')
+    parser.add_argument('--memory-budget', type=_parse_budget, action='append', default=[],
+                        metavar='STAGE=MB', help='Ngân sách bộ nhớ đỉnh (tracemalloc) của một stage, lặp lại được')
+    parser.add_argument('--rss-budget', type=float, metavar='MB',
+                        help='Ngân sách RSS đỉnh của process trong một lần chấm')
+    args = parser.parse_args(argv)
+    profile_memory = args.profile_memory or bool(args.memory_budget) or args.rss_budget is not None
+
+    print("⏱️  Đang chạy benchmark...")
+    report = run_benchmark(args.backends, args.durations, args.signals, args.variants, args.repeat,
+                           profile_memory=profile_memory)
+    for backend in report['skipped_backends']:
+        print(f"⚠️ Bỏ qua backend {backend} (chưa cài đặt)")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['regressions'] = compare_to_baseline(report, baseline, args.threshold, args.min_delta)
+    if profile_memory:
+        report['memory_violations'] = check_memory_budgets(report, dict(args.memory_budget),
+                                                           args.rss_budget)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"💾 Đã lưu kết quả vào: {path}")
+
+    failed = False
+    regressions = report.get('regressions', [])
+    if regressions:
+        print(f"❌ {len(regressions)} stage chậm hơn baseline:")
+        for item in regressions:
+            print(f"   {item['case']} {item['stage']}: {item['baseline']:.4f}s → "
+                  f"{item['current']:.4f}s (x{item['ratio']:.2f})")
+        failed = True
+    elif args.baseline:
+        print("✅ Không có stage nào chậm hơn baseline")
+
+    violations = report.get('memory_violations', [])
+    if violations:
+        print(f"❌ {len(violations)} lần vượt ngân sách bộ nhớ:")
+        for item in violations:
+            print(f"   {item['case']} {item['stage']}: {item['peak_mb']:.1f} MB > {item['budget_mb']:g} MB")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
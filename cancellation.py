@@ -0,0 +1,58 @@
+"""
+Hủy giữa chừng và báo tiến độ cho các bước chấm điểm chạy lâu
+
+PitchExtractor / PitchMatcher / KaraokeSession nhận ``cancel_token`` và ``progress``
+(đều tùy chọn). Token được kiểm tra giữa các batch suy luận CREPE và định kỳ trong
+DTW, nên sau cancel() CPU được giải phóng trong khoảng thời gian của một batch.
+
+Ví dụ:
+    token = CancellationToken()
+    threading.Thread(target=session.score, args=(user, ref),
+                     kwargs={'cancel_token': token,
+                             'progress': lambda stage, fraction: print(stage, fraction)}).start()
+    ...
+    token.cancel()
+"""
+import threading
+from typing import Callable, Optional
+
+# progress(stage, fraction): fraction trong [0, 1] là tiến độ của riêng stage đó
+ProgressCallback = Callable[[str, float], None]
+
+
+class ScoringCancelled(Exception):
+    """Việc chấm điểm bị hủy qua CancellationToken"""
+
+    def __init__(self, message: str = 'Scoring cancelled'):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """Cờ hủy dùng chung giữa thread điều khiển (GUI) và thread đang chấm điểm"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Ném ScoringCancelled nếu đã bị hủy"""
+        if self._event.is_set():
+            raise ScoringCancelled()
+
+
+def check_cancelled(token: Optional[CancellationToken]):
+    """raise_if_cancelled() khi có token, không làm gì nếu token là None"""
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def report_progress(progress: Optional[ProgressCallback], stage: str, fraction: float):
+    """Gọi progress (nếu có), fraction bị kẹp về [0, 1]"""
+    if progress is not None:
+        progress(stage, min(max(float(fraction), 0.0), 1.0))
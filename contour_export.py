@@ -0,0 +1,147 @@
+"""
+Xuất pitch contour và kết quả từng frame ra file nhị phân gọn (định dạng KSPC)
+
+JSON chỉ chứa kết quả vô hướng; contour (hàng nghìn frame) được ghi riêng thành
+các cột little-endian để C++ có thể map thẳng vào bộ nhớ mà không cần parse.
+
+Bố cục file (tất cả little-endian, các cột căn theo 8 byte):
+    Header 40 byte:
+        magic        4s   b'KSPC'
+        version      u16  FORMAT_VERSION
+        header_size  u16  40
+        frame_count  u32  số frame N
+        flags        u32  dự phòng (0)
+        grid_rate    f32  tần số lấy mẫu của timeline (Hz)
+        time_offset  u32  offset cột time (float32[N], giây)
+        user_offset  u32  offset cột user cents (float32[N], NaN = không có pitch)
+        ref_offset   u32  offset cột reference cents (float32[N], NaN = không có pitch)
+        dev_offset   u32  offset cột deviation (int16[N], cents, DEVIATION_INVALID = bỏ qua)
+        reserved     u32  dự phòng (0)
+    Các cột dữ liệu theo offset trong header.
+"""
+import os
+import struct
+from typing import Dict, Union
+
+import numpy as np
+
+
+MAGIC = b'KSPC'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '<4sHHIIfIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Giá trị deviation cho frame thiếu pitch ở một trong hai bên
+DEVIATION_INVALID = -32768
+
+_ALIGN = 8
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _cents_column(cents: np.ndarray) -> np.ndarray:
+    """Chuyển cents sang float32, frame không có pitch (0 cents) thành NaN"""
+    column = np.asarray(cents, dtype='<f4').copy()
+    column[column == 0] = np.nan
+    return column
+
+
+def _deviation_column(cents_user: np.ndarray, cents_reference: np.ndarray) -> np.ndarray:
+    """Deviation (user - reference) làm tròn về int16, DEVIATION_INVALID nếu thiếu pitch"""
+    cents_user = np.asarray(cents_user, dtype=np.float64)
+    cents_reference = np.asarray(cents_reference, dtype=np.float64)
+    valid = (cents_user != 0) & (cents_reference != 0)
+    deviation = np.clip(np.rint(cents_user - cents_reference), DEVIATION_INVALID + 1, 32767)
+    return np.where(valid, deviation, DEVIATION_INVALID).astype('<i2')
+
+
+def pack_contours(time: np.ndarray, cents_user: np.ndarray,
+                  cents_reference: np.ndarray, grid_rate: float = 0.0) -> bytes:
+    """
+    Đóng gói contour đã căn chỉnh thành bytes định dạng KSPC
+
+    Args:
+        time: Timeline chung (giây)
+        cents_user: Pitch người hát (cents, 0 = không có pitch)
+        cents_reference: Pitch chuẩn (cents, 0 = không có pitch)
+        grid_rate: Tần số lấy mẫu timeline (Hz), 0 = không xác định
+
+    Returns:
+        bytes của file KSPC
+    """
+    frame_count = len(time)
+    if len(cents_user) != frame_count or len(cents_reference) != frame_count:
+        raise ValueError("time, cents_user and cents_reference must have the same length")
+
+    columns = [
+        np.asarray(time, dtype='<f4'),
+        _cents_column(cents_user),
+        _cents_column(cents_reference),
+        _deviation_column(cents_user, cents_reference),
+    ]
+
+    offsets = []
+    offset = _aligned(HEADER_SIZE)
+    for column in columns:
+        offsets.append(offset)
+        offset = _aligned(offset + column.nbytes)
+
+    buffer = bytearray(offset)
+    struct.pack_into(HEADER_FORMAT, buffer, 0, MAGIC, FORMAT_VERSION, HEADER_SIZE,
+                     frame_count, 0, float(grid_rate), *offsets, 0)
+    for column, column_offset in zip(columns, offsets):
+        buffer[column_offset:column_offset + column.nbytes] = column.tobytes()
+    return bytes(buffer)
+
+
+def unpack_contours(data: Union[bytes, bytearray, memoryview]) -> Dict:
+    """
+    Đọc bytes KSPC, các cột là view trỏ thẳng vào data (không copy)
+
+    Returns:
+        Dictionary: version, grid_rate, time, cents_user, cents_reference, deviation
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Contour data is too short")
+    (magic, version, header_size, frame_count, _flags, grid_rate,
+     time_offset, user_offset, ref_offset, dev_offset, _reserved) = \
+        struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a KSPC contour file")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported contour format version: {version}")
+
+    def column(offset, dtype):
+        return np.frombuffer(data, dtype=dtype, count=frame_count, offset=offset)
+
+    return {
+        'version': version,
+        'grid_rate': float(grid_rate),
+        'time': column(time_offset, '<f4'),
+        'cents_user': column(user_offset, '<f4'),
+        'cents_reference': column(ref_offset, '<f4'),
+        'deviation': column(dev_offset, '<i2'),
+    }
+
+
+def write_contours(path: str, time: np.ndarray, cents_user: np.ndarray,
+                   cents_reference: np.ndarray, grid_rate: float = 0.0) -> int:
+    """
+    Ghi file KSPC (ghi ra file tạm rồi đổi tên để không để lại file dở dang)
+
+    Returns:
+        Số frame đã ghi
+    """
+    data = pack_contours(time, cents_user, cents_reference, grid_rate)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(time)
+
+
+def read_contours(path: str) -> Dict:
+    """Đọc file KSPC (dùng np.memmap nên không load toàn bộ vào bộ nhớ)"""
+    return unpack_contours(memoryview(np.memmap(path, dtype=np.uint8, mode='r')))
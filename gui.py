@@ -5,12 +5,60 @@ Sử dụng tkinter với ttk để tạo giao diện đẹp và hiện đại
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
+import time
 import os
 from pathlib import Path
 import json
+from collections import OrderedDict
+import numpy as np
 from pitch_extractor import PitchExtractor
 from pitch_matcher import PitchMatcher
 from pitch_advisor import PitchAdvisor
+from contour_export import write_contours
+from plot_utils import DecimatedLine
+from cancellation import CancellationToken, ScoringCancelled, check_cancelled
+from live_scoring import (LIVE_SAMPLE_RATE, LiveScorer, RingBuffer, StreamingPitchTracker,
+                          pcm_stream_feed, run_live, simulate_realtime_feed)
+
+# Khoảng phần trăm của thanh tiến độ dành cho từng bước chấm điểm
+PROGRESS_RANGES = {
+    'user': (0, 45),
+    'reference': (45, 90),
+    'match': (90, 97),
+    'advice': (97, 100),
+}
+
+# Chế độ live: khoảng thời gian hiển thị trước / sau thời điểm hiện tại (giây)
+LIVE_WINDOW_SECONDS = 8.0
+LIVE_LOOKAHEAD_SECONDS = 4.0
+# Chu kỳ vẽ lại của chế độ live (ms)
+LIVE_FRAME_MS = 40
+# Bước nhảy tối đa giữa hai frame reference vẫn được nối liền (giây)
+LIVE_MAX_GAP_SECONDS = 0.25
+# Chờ người dùng ngừng thay đổi cài đặt bao lâu (ms) rồi mới trích xuất reference nền
+PREFETCH_DEBOUNCE_MS = 300
+# Số contour reference giữ trong bộ nhớ (theo file + cài đặt trích xuất)
+REFERENCE_CACHE_SIZE = 4
+
+
+def hz_to_note(freq):
+    """Hz -> số nốt MIDI (NaN khi không có pitch) để vẽ theo bán cung"""
+    freq = np.asarray(freq, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(freq > 0, 69 + 12 * np.log2(freq / 440.0), np.nan)
+
+
+class _ReferencePrefetch:
+    """Một lần trích xuất reference chạy nền (do prefetch_reference khởi động)"""
+    
+    def __init__(self, key, ref_path, settings):
+        self.key = key
+        self.ref_path = ref_path
+        self.settings = settings
+        self.cancel_token = CancellationToken()
+        self.done = threading.Event()
+        self.fraction = 0.0
+        self.error = None
 
 
 class KaraokeScorerGUI:
@@ -41,15 +89,28 @@ class KaraokeScorerGUI:
         self.midi_pitch_max_var = tk.DoubleVar(value=2000.0)
         self.use_pitch_filter_var = tk.BooleanVar(value=False)
         self.is_processing = False
+        self.cancel_token = None
+        
+        # Prefetch reference: contour đã trích xuất theo (file, cài đặt) và lần chạy nền hiện tại
+        self.reference_cache = OrderedDict()
+        self.reference_prefetch = None
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_after_id = None
         
         # Lưu pitch data để phân tích
         self.last_pitch_data = None  # (time_user, freq_user, time_ref, freq_ref)
+        self.last_pitch_paths = None  # (user_path, ref_path) ứng với last_pitch_data
         
         # Tạo giao diện
         self.create_widgets()
         
         # Style
         self.setup_styles()
+        
+        # Chọn reference hoặc đổi cài đặt trích xuất -> trích xuất lại reference trong nền
+        for var in (self.reference_path, self.method_var, self.normalize_audio_var, self.midi_track_var,
+                    self.use_pitch_filter_var, self.midi_pitch_min_var, self.midi_pitch_max_var):
+            var.trace_add('write', self.schedule_reference_prefetch)
     
     def setup_styles(self):
         """Thiết lập style cho giao diện"""
@@ -229,6 +290,20 @@ class KaraokeScorerGUI:
         )
         self.run_button.pack(side=tk.LEFT, padx=5)
         
+        self.cancel_button = ttk.Button(
+            button_frame,
+            text="⏹️ Hủy",
+            command=self.cancel_scoring,
+            state='disabled'
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Button(
+            button_frame,
+            text="🎙️ Live",
+            command=self.open_live_mode
+        ).pack(side=tk.LEFT, padx=5)
+        
         ttk.Button(
             button_frame,
             text="📊 Xem Pitch Contour",
@@ -256,7 +331,8 @@ class KaraokeScorerGUI:
         
         self.progress_bar = ttk.Progressbar(
             self.progress_frame,
-            mode='indeterminate',
+            mode='determinate',
+            maximum=100,
             length=400
         )
         self.progress_bar.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -344,6 +420,7 @@ class KaraokeScorerGUI:
         
         # Lưu kết quả
         self.current_results = None
+        self.last_contours = None
     
     def browse_user_audio(self):
         """Chọn file audio người hát"""
@@ -401,14 +478,198 @@ class KaraokeScorerGUI:
             return
         
         # Chạy trong thread riêng để không block GUI
-        thread = threading.Thread(target=self.scoring_worker, daemon=True)
+        ref_settings = self.reference_settings()
+        if ref_settings is None:
+            messagebox.showerror("Lỗi", "Cài đặt MIDI không hợp lệ!")
+            return
+        self.cancel_token = CancellationToken()
+        thread = threading.Thread(target=self.scoring_worker, args=(ref_settings,), daemon=True)
         thread.start()
     
-    def scoring_worker(self):
+    def cancel_scoring(self):
+        """Hủy lần chấm đang chạy (dừng sau batch suy luận hiện tại)"""
+        if self.is_processing and self.cancel_token is not None:
+            self.cancel_token.cancel()
+            self.cancel_button.config(state='disabled')
+            self.progress_var.set("⏳ Đang hủy...")
+    
+    def set_progress(self, step, fraction):
+        """Đặt thanh tiến độ theo tiến độ (0-1) của một bước trong PROGRESS_RANGES"""
+        start, end = PROGRESS_RANGES[step]
+        value = start + (end - start) * fraction
+        self.root.after(0, lambda: self.progress_bar.config(value=value))
+    
+    def extraction_progress(self, step):
+        """Callback progress cho PitchExtractor: tiến độ suy luận của model ứng với bước step"""
+        def callback(stage_name, fraction):
+            if stage_name.endswith('_inference'):
+                self.set_progress(step, fraction)
+        return callback
+    
+    def reference_settings(self):
+        """
+        Cài đặt ảnh hưởng tới contour reference (đọc trên thread GUI)
+        
+        Returns:
+            dict, hoặc None nếu ô nhập đang có giá trị không hợp lệ
+        """
+        try:
+            ref_path = self.reference_path.get()
+            if Path(ref_path).suffix.lower() in ['.mid', '.midi']:
+                track_filter_value = self.midi_track_var.get()
+                if track_filter_value and track_filter_value != "None" and track_filter_value != "auto":
+                    track_filter = track_filter_value
+                elif track_filter_value == "auto":
+                    track_filter = "auto"
+                else:
+                    track_filter = None
+                pitch_range = None
+                if self.use_pitch_filter_var.get():
+                    pitch_range = (self.midi_pitch_min_var.get(), self.midi_pitch_max_var.get())
+                return {'track_filter': track_filter, 'pitch_range': pitch_range}
+            return {'method': self.method_var.get(), 'normalize_audio': self.normalize_audio_var.get()}
+        except tk.TclError:
+            return None
+    
+    @staticmethod
+    def reference_key(ref_path, settings):
+        """Khóa cache: file (đường dẫn, mtime, kích thước) + cài đặt trích xuất"""
+        stat = os.stat(ref_path)
+        return (os.path.abspath(ref_path), stat.st_mtime_ns, stat.st_size, tuple(sorted(settings.items())))
+    
+    def extract_reference_contour(self, ref_path, settings, cancel_token=None, progress=None, show_progress=True):
+        """
+        Trích xuất contour reference (audio hoặc MIDI) theo settings của reference_settings()
+        
+        Args:
+            show_progress: Ghi thông báo lên nhãn tiến trình (False khi chạy nền)
+        
+        Returns:
+            (time, frequency)
+        """
+        ref_ext = Path(ref_path).suffix.lower()
+        if ref_ext in ['.mid', '.midi']:
+            # Vẫn hỗ trợ MIDI nếu cần
+            if show_progress:
+                self.update_progress("⏳ Đang đọc file MIDI...")
+            extractor = PitchExtractor(method='crepe', model_capacity='tiny')
+            return extractor.extract_pitch_from_midi(
+                ref_path,
+                track_filter=settings['track_filter'],
+                pitch_range=settings['pitch_range']
+            )
+        
+        # Xử lý audio reference (ca sĩ mẫu) - sử dụng cùng settings với user audio để công bằng
+        if show_progress:
+            self.update_progress("⏳ Đang trích xuất pitch từ audio ca sĩ mẫu...")
+        method = settings['method']
+        extractor = PitchExtractor(method=method, model_capacity='tiny', normalize_audio=settings['normalize_audio'])
+        control = {'cancel_token': cancel_token, 'progress': progress}
+        # Sử dụng cùng settings với user audio (step_size, viterbi) để đảm bảo công bằng
+        if method == 'crepe':
+            return extractor.extract_pitch(ref_path, step_size=50, use_viterbi=False, **control)
+        return extractor.extract_pitch(ref_path, **control)
+    
+    def _cache_reference(self, key, contour):
+        with self._prefetch_lock:
+            self.reference_cache[key] = contour
+            self.reference_cache.move_to_end(key)
+            while len(self.reference_cache) > REFERENCE_CACHE_SIZE:
+                self.reference_cache.popitem(last=False)
+    
+    def schedule_reference_prefetch(self, *_):
+        """Trace callback: gộp các thay đổi liên tiếp (gõ số, đổi nhiều tùy chọn) rồi mới prefetch"""
+        if self._prefetch_after_id is not None:
+            self.root.after_cancel(self._prefetch_after_id)
+        self._prefetch_after_id = self.root.after(PREFETCH_DEBOUNCE_MS, self.prefetch_reference)
+    
+    def prefetch_reference(self):
+        """
+        Trích xuất contour reference trong nền ngay khi biết file và cài đặt
+        
+        Lần prefetch cũ (khác file / cài đặt) bị hủy. Khi bấm chấm điểm, get_reference_contour
+        lấy kết quả từ cache hoặc chờ lần prefetch đang chạy thay vì trích xuất lại.
+        """
+        self._prefetch_after_id = None
+        ref_path = self.reference_path.get()
+        settings = self.reference_settings()
+        try:
+            key = self.reference_key(ref_path, settings) if ref_path and settings is not None else None
+        except OSError:
+            key = None
+        
+        with self._prefetch_lock:
+            current = self.reference_prefetch
+            if key is not None and (key in self.reference_cache
+                                    or (current is not None and current.key == key)):
+                return
+            if current is not None and not current.done.is_set():
+                current.cancel_token.cancel()
+            self.reference_prefetch = None
+            if key is None:
+                return
+            prefetch = _ReferencePrefetch(key, ref_path, settings)
+            self.reference_prefetch = prefetch
+        threading.Thread(target=self.prefetch_worker, args=(prefetch,), daemon=True).start()
+    
+    def prefetch_worker(self, prefetch):
+        """Thread prefetch: trích xuất reference, lưu vào cache, không chạm vào thanh tiến độ chính"""
+        def progress(stage_name, fraction):
+            if stage_name.endswith('_inference'):
+                prefetch.fraction = fraction
+        
+        try:
+            contour = self.extract_reference_contour(prefetch.ref_path, prefetch.settings,
+                                                     cancel_token=prefetch.cancel_token,
+                                                     progress=progress, show_progress=False)
+            self._cache_reference(prefetch.key, contour)
+        except ScoringCancelled as e:
+            prefetch.error = e
+        except Exception as e:
+            # Lỗi được báo lại khi bấm chấm điểm (trích xuất lại trực tiếp)
+            prefetch.error = e
+            print(f"⚠️ Prefetch reference thất bại: {e}")
+        finally:
+            prefetch.fraction = 1.0
+            prefetch.done.set()
+    
+    def get_reference_contour(self, ref_path, settings, cancel_token=None, progress=None, on_wait=None):
+        """
+        Contour reference cho lần chấm: cache -> chờ prefetch đang chạy -> trích xuất trực tiếp
+        
+        Args:
+            on_wait: on_wait(fraction) được gọi định kỳ khi đang chờ prefetch
+        
+        Returns:
+            (time, frequency)
+        """
+        key = self.reference_key(ref_path, settings)
+        with self._prefetch_lock:
+            if key in self.reference_cache:
+                self.reference_cache.move_to_end(key)
+                return self.reference_cache[key]
+            prefetch = self.reference_prefetch
+        
+        if prefetch is not None and prefetch.key == key:
+            while not prefetch.done.wait(0.1):
+                check_cancelled(cancel_token)
+                if on_wait is not None:
+                    on_wait(prefetch.fraction)
+            with self._prefetch_lock:
+                if key in self.reference_cache:
+                    return self.reference_cache[key]
+        
+        contour = self.extract_reference_contour(ref_path, settings, cancel_token=cancel_token, progress=progress)
+        self._cache_reference(key, contour)
+        return contour
+    
+    def scoring_worker(self, ref_settings):
         """Worker thread để chấm điểm"""
         self.is_processing = True
+        cancel_token = self.cancel_token
         self.run_button.config(state='disabled')
-        self.progress_bar.start()
+        self.root.after(0, lambda: self.cancel_button.config(state='normal'))
+        self.set_progress('user', 0.0)
         
         try:
             user_path = self.user_audio_path.get()
@@ -422,53 +683,42 @@ class KaraokeScorerGUI:
             # Sử dụng tiny model và không dùng viterbi để tăng tốc độ (~10s cho bài hát)
             self.update_progress("⏳ Đang trích xuất pitch từ audio người hát...")
             extractor_user = PitchExtractor(method=method, model_capacity='tiny', normalize_audio=normalize_audio)
+            control = {'cancel_token': cancel_token, 'progress': self.extraction_progress('user')}
             if method == 'crepe':
-                time_user, freq_user = extractor_user.extract_pitch(user_path, step_size=50, use_viterbi=False)
+                time_user, freq_user = extractor_user.extract_pitch(user_path, step_size=50, use_viterbi=False,
+                                                                    **control)
             else:
-                time_user, freq_user = extractor_user.extract_pitch(user_path)
+                time_user, freq_user = extractor_user.extract_pitch(user_path, **control)
+            self.set_progress('user', 1.0)
             
-            # Trích xuất pitch từ reference audio (ca sĩ mẫu)
-            ref_ext = Path(ref_path).suffix.lower()
-            if ref_ext in ['.mid', '.midi']:
-                # Vẫn hỗ trợ MIDI nếu cần
-                self.update_progress("⏳ Đang đọc file MIDI...")
-                track_filter_value = self.midi_track_var.get()
-                if track_filter_value and track_filter_value != "None" and track_filter_value != "auto":
-                    track_filter = track_filter_value
-                elif track_filter_value == "auto":
-                    track_filter = "auto"
-                else:
-                    track_filter = None
-                pitch_range = None
-                if self.use_pitch_filter_var.get():
-                    pitch_range = (self.midi_pitch_min_var.get(), self.midi_pitch_max_var.get())
-                time_ref, freq_ref = extractor_user.extract_pitch_from_midi(
-                    ref_path,
-                    track_filter=track_filter,
-                    pitch_range=pitch_range
-                )
-            else:
-                # Xử lý audio reference (ca sĩ mẫu) - sử dụng cùng settings với user audio để công bằng
-                self.update_progress("⏳ Đang trích xuất pitch từ audio ca sĩ mẫu...")
-                extractor_ref = PitchExtractor(method=method, model_capacity='tiny', normalize_audio=normalize_audio)
-                # Sử dụng cùng settings với user audio (step_size, viterbi) để đảm bảo công bằng
-                if method == 'crepe':
-                    time_ref, freq_ref = extractor_ref.extract_pitch(ref_path, step_size=50, use_viterbi=False)
-                else:
-                    time_ref, freq_ref = extractor_ref.extract_pitch(ref_path)
+            # Trích xuất pitch từ reference audio (ca sĩ mẫu), thường đã có sẵn nhờ prefetch
+            def wait_for_prefetch(fraction):
+                self.update_progress("⏳ Đang chờ trích xuất reference (chạy nền)...")
+                self.set_progress('reference', fraction)
+            
+            time_ref, freq_ref = self.get_reference_contour(
+                ref_path, ref_settings, cancel_token=cancel_token,
+                progress=self.extraction_progress('reference'), on_wait=wait_for_prefetch)
+            self.set_progress('reference', 1.0)
             
             # So khớp và tính điểm
             self.update_progress("⏳ Đang so khớp pitch và tính điểm...")
             matcher = PitchMatcher(tolerance_cents=tolerance, difficulty_mode=difficulty)
-            results = matcher.calculate_score(
+            aligned_time, cents_user, cents_ref = matcher.align_cents(
                 time_user, freq_user,
-                time_ref, freq_ref
+                time_ref, freq_ref,
+                cancel_token=cancel_token
             )
+            results = matcher.score_aligned(aligned_time, cents_user, cents_ref, cancel_token=cancel_token)
+            self.set_progress('match', 1.0)
             
-            # Lưu pitch data để phân tích
+            # Lưu pitch data để phân tích và contour đã căn chỉnh để xuất file
             self.last_pitch_data = (time_user, freq_user, time_ref, freq_ref)
+            self.last_pitch_paths = (user_path, ref_path)
+            self.last_contours = (aligned_time, cents_user, cents_ref)
             
             # Phân tích và đưa ra lời khuyên
+            cancel_token.raise_if_cancelled()
             self.update_progress("⏳ Đang phân tích và tạo lời khuyên...")
             try:
                 advisor = PitchAdvisor(tolerance_cents=tolerance)
@@ -485,17 +735,21 @@ class KaraokeScorerGUI:
                 results['advice'] = None
             
             # Cập nhật kết quả lên GUI
+            self.set_progress('advice', 1.0)
             self.root.after(0, self.display_results, results)
             self.update_progress("✅ Hoàn thành!")
             
+        except ScoringCancelled:
+            self.update_progress("⏹️ Đã hủy chấm điểm")
         except Exception as e:
             error_msg = f"Lỗi: {str(e)}"
             self.root.after(0, lambda: messagebox.showerror("Lỗi", error_msg))
             self.update_progress("❌ Có lỗi xảy ra!")
         finally:
-            self.progress_bar.stop()
             self.is_processing = False
             self.run_button.config(state='normal')
+            self.root.after(0, lambda: self.cancel_button.config(state='disabled'))
+            self.root.after(0, lambda: self.progress_bar.config(value=0))
             self.root.after(0, lambda: self.progress_var.set(""))
     
     def update_progress(self, message):
@@ -578,6 +832,14 @@ class KaraokeScorerGUI:
                 lines.append(f"   • {issue}")
             lines.append("")
         
+        if advice_result.get('problem_regions'):
+            lines.append("🎯 ĐOẠN CẦN TẬP:")
+            for region in advice_result['problem_regions']:
+                direction_text = 'cao' if region['direction'] == 'sharp' else 'thấp'
+                lines.append(f"   • {self.format_time(region['start'])} - {self.format_time(region['end'])}: "
+                             f"lệch {direction_text} {region['mean_deviation_cents']:.0f} cents")
+            lines.append("")
+        
         if advice_result.get('advices'):
             lines.append("💡 LỜI KHUYÊN:")
             for advice in advice_result['advices']:
@@ -588,6 +850,11 @@ class KaraokeScorerGUI:
         
         return "\n".join(lines)
     
+    def format_time(self, seconds: float) -> str:
+        """Format thời gian dạng mm:ss.s"""
+        minutes = int(seconds // 60)
+        return f"{minutes:02d}:{seconds - minutes * 60:04.1f}"
+    
     def get_score_color(self, score):
         """Lấy màu dựa trên điểm số"""
         if score >= 80:
@@ -597,6 +864,18 @@ class KaraokeScorerGUI:
         else:
             return '#C62828'  # Đỏ
     
+    def open_live_mode(self):
+        """Mở cửa sổ chấm điểm live"""
+        try:
+            import matplotlib  # noqa: F401
+        except ImportError:
+            messagebox.showerror(
+                "Lỗi", 
+                "Cần cài đặt matplotlib để dùng chế độ live:\npip install matplotlib"
+            )
+            return
+        LiveScoringWindow(self)
+    
     def show_pitch_contour(self):
         """Hiển thị biểu đồ pitch contour"""
         if not self.user_audio_path.get() or not self.reference_path.get():
@@ -605,7 +884,7 @@ class KaraokeScorerGUI:
         
         try:
             import matplotlib.pyplot as plt
-            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
         except ImportError:
             messagebox.showerror(
                 "Lỗi", 
@@ -613,51 +892,25 @@ class KaraokeScorerGUI:
             )
             return
         
+        # Dùng lại contour đã tính khi chấm điểm, không trích xuất pitch lại
+        if self.last_pitch_data is None:
+            messagebox.showwarning("Cảnh báo", "Vui lòng chạy chấm điểm trước!")
+            return
+        if self.last_pitch_paths != (self.user_audio_path.get(), self.reference_path.get()):
+            messagebox.showwarning("Cảnh báo", "File đã thay đổi, vui lòng chạy chấm điểm lại!")
+            return
+        time_user, freq_user, time_ref, freq_ref = self.last_pitch_data
+        
         # Tạo cửa sổ mới
         plot_window = tk.Toplevel(self.root)
         plot_window.title("📊 Pitch Contour Visualization")
         plot_window.geometry("1000x600")
         
         try:
-            # Trích xuất pitch
-            method = self.method_var.get()
-            normalize_audio = self.normalize_audio_var.get()
-            # Sử dụng tiny model để tăng tốc độ
-            extractor_user = PitchExtractor(method=method, model_capacity='tiny', normalize_audio=normalize_audio)
-            if method == 'crepe':
-                time_user, freq_user = extractor_user.extract_pitch(self.user_audio_path.get(), step_size=50, use_viterbi=False)
-            else:
-                time_user, freq_user = extractor_user.extract_pitch(self.user_audio_path.get())
-            
-            ref_path = self.reference_path.get()
-            ref_ext = Path(ref_path).suffix.lower()
-            if ref_ext in ['.mid', '.midi']:
-                track_filter_value = self.midi_track_var.get()
-                if track_filter_value and track_filter_value != "None" and track_filter_value != "auto":
-                    track_filter = track_filter_value
-                elif track_filter_value == "auto":
-                    track_filter = "auto"
-                else:
-                    track_filter = None
-                pitch_range = None
-                if self.use_pitch_filter_var.get():
-                    pitch_range = (self.midi_pitch_min_var.get(), self.midi_pitch_max_var.get())
-                time_ref, freq_ref = extractor_user.extract_pitch_from_midi(
-                    ref_path,
-                    track_filter=track_filter,
-                    pitch_range=pitch_range
-                )
-            else:
-                extractor_ref = PitchExtractor(method=method, model_capacity='tiny', normalize_audio=normalize_audio)
-                if method == 'crepe':
-                    time_ref, freq_ref = extractor_ref.extract_pitch(ref_path, step_size=50, use_viterbi=False)
-                else:
-                    time_ref, freq_ref = extractor_ref.extract_pitch(ref_path)
-            
-            # Vẽ biểu đồ
+            # Vẽ biểu đồ: chỉ vẽ min/max theo từng cột pixel, tính lại khi zoom nên bài dài vẫn mượt
             fig, ax = plt.subplots(figsize=(10, 6))
-            ax.plot(time_user, freq_user, label='Người hát', alpha=0.7, linewidth=1.5, color='#FF3333')
-            ax.plot(time_ref, freq_ref, label='Reference', alpha=0.7, linewidth=1.5, color='#009900')
+            DecimatedLine(ax, time_user, freq_user, label='Người hát', alpha=0.7, linewidth=1.5, color='#FF3333')
+            DecimatedLine(ax, time_ref, freq_ref, label='Reference', alpha=0.7, linewidth=1.5, color='#009900')
             ax.set_xlabel('Thời gian (s)', fontsize=12)
             ax.set_ylabel('Tần số (Hz)', fontsize=12)
             ax.set_title('Pitch Contour Comparison', fontsize=14, fontweight='bold')
@@ -667,15 +920,19 @@ class KaraokeScorerGUI:
             
             # Hiển thị trong tkinter
             canvas = FigureCanvasTkAgg(fig, plot_window)
+            toolbar = NavigationToolbar2Tk(canvas, plot_window)
+            toolbar.update()
             canvas.draw()
             canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+            # Đóng figure khi đóng cửa sổ để pyplot không giữ lại contour
+            plot_window.protocol("WM_DELETE_WINDOW", lambda: (plt.close(fig), plot_window.destroy()))
             
         except Exception as e:
             messagebox.showerror("Lỗi", f"Không thể vẽ biểu đồ: {str(e)}")
             plot_window.destroy()
     
     def save_results(self):
-        """Lưu kết quả vào file JSON"""
+        """Lưu kết quả vào file JSON, contour được ghi kèm file nhị phân .kspc cùng tên"""
         if not self.current_results:
             messagebox.showwarning("Cảnh báo", "Chưa có kết quả để lưu!")
             return
@@ -688,13 +945,286 @@ class KaraokeScorerGUI:
         
         if filename:
             try:
+                results = dict(self.current_results)
+                message = f"Đã lưu kết quả vào:\n{filename}"
+                if self.last_contours is not None:
+                    contours_path = str(Path(filename).with_suffix('.kspc'))
+                    results['contours_path'] = os.path.basename(contours_path)
+                    results['contours_frames'] = write_contours(contours_path, *self.last_contours)
+                    message += f"\nContour: {contours_path}"
                 with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(self.current_results, f, indent=2, ensure_ascii=False)
-                messagebox.showinfo("Thành công", f"Đã lưu kết quả vào:\n{filename}")
+                    json.dump(results, f, indent=2, ensure_ascii=False)
+                messagebox.showinfo("Thành công", message)
             except Exception as e:
                 messagebox.showerror("Lỗi", f"Không thể lưu file: {str(e)}")
 
 
+class LiveScoringWindow:
+    """
+    Cửa sổ chấm điểm live: contour người hát chạy cùng contour reference và điểm tạm tính
+    
+    Audio người hát lấy từ file (phát giả lập theo thời gian thực, không cần thiết bị
+    âm thanh) hoặc từ PCM stream (file / FIFO PCM thô). Trục x tính theo giây so với
+    thời điểm hiện tại nên trục không đổi và có thể vẽ bằng blitting: mỗi frame chỉ
+    khôi phục nền đã lưu và vẽ lại hai line cùng dòng điểm. Contour người hát nằm
+    trong RingBuffer kích thước cố định nên chi phí vẽ không tăng theo độ dài bài.
+    """
+    
+    def __init__(self, app):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        
+        self.app = app
+        self.window = tk.Toplevel(app.root)
+        self.window.title("🎙️ Live Scoring")
+        self.window.geometry("1000x650")
+        
+        self.source_var = tk.StringVar(value='file')
+        self.pcm_path_var = tk.StringVar()
+        self.pcm_rate_var = tk.IntVar(value=LIVE_SAMPLE_RATE)
+        self.pcm_dtype_var = tk.StringVar(value='float32')
+        self.speed_var = tk.DoubleVar(value=1.0)
+        self.tracker_var = tk.StringVar(value='crepe' if app.method_var.get() == 'crepe' else 'yin')
+        self.status_var = tk.StringVar(value="")
+        
+        self.cancel_token = None
+        self.running = False
+        self.user_ring = None
+        self.reference = (np.zeros(0), np.zeros(0))  # (time, nốt MIDI)
+        self.accuracy = 0.0
+        self.last_time = 0.0
+        self.last_wall = time.perf_counter()
+        self.speed = 1.0
+        self.background = None
+        
+        self.create_widgets()
+        
+        # Đồ thị: trục x là thời gian so với hiện tại, trục y là nốt MIDI
+        self.figure = Figure(figsize=(10, 5))
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_xlim(-LIVE_WINDOW_SECONDS, LIVE_LOOKAHEAD_SECONDS)
+        self.ax.set_ylim(45, 80)
+        self.ax.set_xlabel('Thời gian so với hiện tại (s)')
+        self.ax.set_ylabel('Nốt (MIDI)')
+        self.ax.grid(True, alpha=0.3)
+        self.ax.axvline(0.0, color='#888888', linestyle='--', linewidth=1)
+        self.reference_line, = self.ax.plot([], [], color='#009900', linewidth=3, alpha=0.5,
+                                            label='Reference', animated=True)
+        self.user_line, = self.ax.plot([], [], color='#FF3333', linewidth=1.5,
+                                       label='Người hát', animated=True)
+        self.score_text = self.ax.text(0.02, 0.95, '', transform=self.ax.transAxes,
+                                       fontsize=13, fontweight='bold', va='top', animated=True)
+        self.ax.legend(loc='upper right')
+        self.figure.tight_layout()
+        
+        self.canvas = FigureCanvasTkAgg(self.figure, self.window)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # Lưu lại nền mỗi khi vẽ đầy đủ (mở cửa sổ, đổi kích thước, đổi trục y)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.draw()
+        
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+    
+    def create_widgets(self):
+        """Tạo các điều khiển nguồn audio và nút Start / Stop"""
+        controls = ttk.Frame(self.window, padding="10")
+        controls.pack(fill=tk.X)
+        
+        ttk.Radiobutton(controls, text="File người hát (giả lập thời gian thực)",
+                        variable=self.source_var, value='file').grid(row=0, column=0, sticky=tk.W)
+        ttk.Label(controls, text="Tốc độ:").grid(row=0, column=1, sticky=tk.E, padx=(15, 5))
+        ttk.Spinbox(controls, from_=0.25, to=8.0, increment=0.25, width=6,
+                    textvariable=self.speed_var).grid(row=0, column=2, sticky=tk.W)
+        
+        ttk.Radiobutton(controls, text="PCM stream:", variable=self.source_var,
+                        value='pcm').grid(row=1, column=0, sticky=tk.W)
+        ttk.Entry(controls, textvariable=self.pcm_path_var, width=40).grid(row=1, column=1, columnspan=2,
+                                                                          sticky=(tk.W, tk.E), padx=5)
+        ttk.Button(controls, text="📁", width=3,
+                   command=self.browse_pcm).grid(row=1, column=3, padx=5)
+        ttk.Label(controls, text="Sample rate:").grid(row=1, column=4, sticky=tk.E, padx=(10, 5))
+        ttk.Entry(controls, textvariable=self.pcm_rate_var, width=7).grid(row=1, column=5, sticky=tk.W)
+        ttk.Combobox(controls, textvariable=self.pcm_dtype_var, values=['float32', 'int16', 'int32'],
+                     width=8, state='readonly').grid(row=1, column=6, padx=5)
+        
+        ttk.Label(controls, text="Pitch tracker:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Combobox(controls, textvariable=self.tracker_var, values=['crepe', 'yin'],
+                     width=8, state='readonly').grid(row=2, column=1, sticky=tk.W, pady=(5, 0))
+        
+        self.start_button = ttk.Button(controls, text="▶️ Bắt đầu", command=self.start)
+        self.start_button.grid(row=2, column=2, pady=(5, 0))
+        self.stop_button = ttk.Button(controls, text="⏹️ Dừng", command=self.stop, state='disabled')
+        self.stop_button.grid(row=2, column=3, columnspan=2, pady=(5, 0))
+        ttk.Label(controls, textvariable=self.status_var).grid(row=3, column=0, columnspan=7,
+                                                               sticky=tk.W, pady=(5, 0))
+    
+    def browse_pcm(self):
+        filename = filedialog.askopenfilename(title="Chọn PCM stream (file / FIFO PCM thô)")
+        if filename:
+            self.pcm_path_var.set(filename)
+    
+    def set_status(self, message):
+        self.app.root.after(0, lambda: self.status_var.set(message))
+    
+    def start(self):
+        """Đọc cài đặt (trên thread GUI) và chạy vòng live trong thread riêng"""
+        if self.running:
+            return
+        ref_path = self.app.reference_path.get()
+        if not ref_path or not os.path.exists(ref_path):
+            messagebox.showerror("Lỗi", "Vui lòng chọn file audio ca sĩ mẫu!", parent=self.window)
+            return
+        settings = {
+            'ref_path': ref_path,
+            'source': self.source_var.get(),
+            'user_path': self.app.user_audio_path.get(),
+            'pcm_path': self.pcm_path_var.get(),
+            'pcm_rate': self.pcm_rate_var.get(),
+            'pcm_dtype': self.pcm_dtype_var.get(),
+            'speed': self.speed_var.get(),
+            'tracker': self.tracker_var.get(),
+            'tolerance': self.app.tolerance_var.get(),
+            'difficulty': self.app.difficulty_var.get(),
+            'ref_settings': self.app.reference_settings(),
+        }
+        if settings['ref_settings'] is None:
+            messagebox.showerror("Lỗi", "Cài đặt MIDI không hợp lệ!", parent=self.window)
+            return
+        input_path = settings['user_path'] if settings['source'] == 'file' else settings['pcm_path']
+        if not input_path or not os.path.exists(input_path):
+            messagebox.showerror("Lỗi", "Không tìm thấy audio người hát / PCM stream!", parent=self.window)
+            return
+        
+        self.cancel_token = CancellationToken()
+        self.running = True
+        self.start_button.config(state='disabled')
+        self.stop_button.config(state='normal')
+        threading.Thread(target=self.live_worker, args=(settings, self.cancel_token), daemon=True).start()
+    
+    def stop(self):
+        if self.cancel_token is not None:
+            self.cancel_token.cancel()
+    
+    def close(self):
+        self.stop()
+        self.running = False
+        self.window.destroy()
+    
+    def live_worker(self, settings, cancel_token):
+        """Thread live: chuẩn bị reference, mở nguồn audio và chạy run_live"""
+        stream = None
+        try:
+            self.set_status("⏳ Đang chuẩn bị contour reference...")
+            time_ref, freq_ref = self.app.get_reference_contour(settings['ref_path'], settings['ref_settings'],
+                                                                cancel_token=cancel_token)
+            if len(time_ref) == 0:
+                raise ValueError("Không phát hiện pitch trong reference")
+            
+            extractor = None
+            if settings['tracker'] == 'crepe':
+                extractor = PitchExtractor(method='crepe', model_capacity='tiny')
+                extractor.warm_up()
+            tracker = StreamingPitchTracker(extractor, method=settings['tracker'])
+            scorer = LiveScorer(time_ref, freq_ref, tolerance_cents=settings['tolerance'],
+                                difficulty_mode=settings['difficulty'])
+            
+            if settings['source'] == 'file':
+                audio, _ = PitchExtractor(method='crepe').load_audio(settings['user_path'],
+                                                                     target_sr=LIVE_SAMPLE_RATE)
+                self.speed = max(settings['speed'], 0.25)
+                feed = simulate_realtime_feed(audio, speed=self.speed)
+            else:
+                stream = open(settings['pcm_path'], 'rb')
+                self.speed = 1.0
+                feed = pcm_stream_feed(stream, sample_rate=settings['pcm_rate'], dtype=settings['pcm_dtype'])
+            
+            # Số điểm của contour người hát trong khung hiển thị
+            capacity = int(LIVE_WINDOW_SECONDS * 1000 / tracker.step_size) + 16
+            self.user_ring = RingBuffer(capacity)
+            self.accuracy = 0.0
+            self.last_time = 0.0
+            self.last_wall = time.perf_counter()
+            self.app.root.after(0, self.begin_plot, time_ref, freq_ref)
+            self.set_status("🎙️ Đang chấm điểm live...")
+            
+            results = run_live(feed, tracker, scorer, on_frames=self.on_frames, cancel_token=cancel_token)
+            self.app.root.after(0, self.finish, results, None)
+        except ScoringCancelled:
+            self.app.root.after(0, self.finish, None, None)
+        except Exception as e:
+            self.app.root.after(0, self.finish, None, e)
+        finally:
+            if stream is not None:
+                stream.close()
+    
+    def on_frames(self, times, frequency, accuracy):
+        """Gọi từ thread live khi có frame mới"""
+        self.user_ring.extend(times, hz_to_note(frequency))
+        self.accuracy = accuracy
+        self.last_time = float(times[-1])
+        self.last_wall = time.perf_counter()
+    
+    def begin_plot(self, time_ref, freq_ref):
+        """Chuẩn bị contour reference (ngắt line ở chỗ nghỉ), đặt trục y và bắt đầu vẽ"""
+        if not self.window.winfo_exists():
+            return
+        notes = hz_to_note(freq_ref)
+        gaps = np.flatnonzero(np.diff(time_ref) > LIVE_MAX_GAP_SECONDS) + 1
+        time_ref = np.insert(np.asarray(time_ref, dtype=np.float64), gaps, np.nan)
+        notes = np.insert(notes, gaps, np.nan)
+        # searchsorted cần thời gian tăng dần: điểm NaN lấy thời gian của điểm ngay sau
+        self.reference = (np.where(np.isnan(time_ref), np.roll(time_ref, -1), time_ref), notes)
+        if np.any(np.isfinite(notes)):
+            self.ax.set_ylim(np.nanmin(notes) - 3, np.nanmax(notes) + 3)
+        self.canvas.draw()
+        self.tick()
+    
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_animated()
+    
+    def draw_animated(self):
+        for artist in (self.reference_line, self.user_line, self.score_text):
+            self.ax.draw_artist(artist)
+    
+    def tick(self):
+        """Vẽ một frame bằng blitting"""
+        if self.background is None or self.user_ring is None or not self.window.winfo_exists():
+            return
+        # Nội suy thời điểm hiện tại giữa hai lần nhận frame để contour chạy mượt
+        now = self.last_time + min(time.perf_counter() - self.last_wall, 0.25) * self.speed
+        
+        user_time, user_notes = self.user_ring.view()
+        self.user_line.set_data(user_time - now, user_notes)
+        ref_time, ref_notes = self.reference
+        start = np.searchsorted(ref_time, now - LIVE_WINDOW_SECONDS)
+        stop = np.searchsorted(ref_time, now + LIVE_LOOKAHEAD_SECONDS, side='right')
+        self.reference_line.set_data(ref_time[start:stop] - now, ref_notes[start:stop])
+        self.score_text.set_text(f"Độ chính xác tạm tính: {self.accuracy:.1f}%")
+        
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.ax.bbox)
+        if self.running:
+            self.window.after(LIVE_FRAME_MS, self.tick)
+    
+    def finish(self, results, error):
+        """Kết thúc vòng live (trên thread GUI)"""
+        self.running = False
+        if not self.window.winfo_exists():
+            return
+        self.start_button.config(state='normal')
+        self.stop_button.config(state='disabled')
+        if error is not None:
+            self.status_var.set("❌ Có lỗi xảy ra!")
+            messagebox.showerror("Lỗi", f"Lỗi: {str(error)}", parent=self.window)
+        elif results is None:
+            self.status_var.set("⏹️ Đã dừng")
+        else:
+            self.status_var.set(f"✅ Điểm: {results['final_score']:.2f}/100 "
+                                f"(độ chính xác {results['accuracy']:.2f}%)")
+
+
 def main():
     """Hàm main để chạy GUI"""
     root = tk.Tk()
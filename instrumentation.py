@@ -0,0 +1,271 @@
+"""
+Đo thời gian từng stage của pipeline chấm điểm (decode, resample, CREPE, DTW, ...)
+
+Các module bọc từng bước bằng ``with stage('tên'):``. Khi không có ai thu thập
+(không có collect_timings() đang mở và không có hook) stage() gần như không tốn gì.
+
+Stage lồng nhau được đặt tên theo dạng "cha.con", ví dụ "extract_user.crepe_inference".
+Collector được giữ trong contextvars nên mỗi thread / asyncio task có bộ đếm riêng.
+
+Với collect_timings(profile_memory=True), mỗi stage có thêm bộ nhớ đỉnh và bộ nhớ
+còn giữ lại sau stage (tracemalloc, chỉ thấy bộ nhớ cấp phát qua Python/NumPy) và
+RSS của process (lấy mẫu bằng thread nền, thấy cả bộ nhớ TensorFlow cấp phát).
+tracemalloc và RSS là số liệu của cả process, nên chỉ chính xác khi mỗi lúc có
+một lần chấm được profile.
+
+Ví dụ:
+    with collect_timings() as timings:
+        session.score(...)
+    print(timings.as_dict())
+
+    # Chuyển số liệu sang hệ thống metrics của ứng dụng
+    add_timing_hook(lambda name, seconds, frames: statsd.timing(name, seconds))
+"""
+import contextvars
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Hook nhận (tên stage, số giây, số frame hoặc None)
+TimingHook = Callable[[str, float, Optional[int]], None]
+
+_collector = contextvars.ContextVar('karaoke_timing_collector', default=None)
+_stage_path = contextvars.ContextVar('karaoke_stage_path', default=())
+
+_hooks: List[TimingHook] = []
+_hooks_lock = threading.Lock()
+
+# Chu kỳ lấy mẫu RSS khi profile bộ nhớ (giây)
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+def get_rss_bytes() -> Optional[int]:
+    """RSS hiện tại của process (byte), None nếu không đọc được trên nền tảng này"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class _MemoryFrame:
+    """Trạng thái bộ nhớ của một stage đang chạy"""
+    __slots__ = ('start_traced', 'peak_traced', 'start_rss', 'peak_rss')
+
+    def __init__(self, start_traced: int, start_rss: Optional[int]):
+        self.start_traced = start_traced
+        self.peak_traced = start_traced
+        self.start_rss = start_rss
+        self.peak_rss = start_rss
+
+
+class MemoryProfiler:
+    """
+    Đo bộ nhớ đỉnh / còn giữ lại theo stage bằng tracemalloc và lấy mẫu RSS
+
+    tracemalloc chỉ có một bộ đếm đỉnh cho cả process, nên mỗi khi vào stage con
+    đỉnh hiện tại được cộng vào các stage cha trước khi reset.
+    """
+
+    def __init__(self, rss_interval: float = RSS_SAMPLE_INTERVAL):
+        self.rss_interval = rss_interval
+        self._stack: List[_MemoryFrame] = []
+        self._started_tracemalloc = False
+        self._rss_peak = None
+        self._rss_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._rss_peak = get_rss_bytes()
+        if self._rss_peak is not None:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _sample_rss(self):
+        while not self._stop.wait(self.rss_interval):
+            rss = get_rss_bytes()
+            with self._rss_lock:
+                if rss is not None and (self._rss_peak is None or rss > self._rss_peak):
+                    self._rss_peak = rss
+
+    def _take_peaks(self, reset: bool):
+        """Đọc đỉnh từ lần reset trước, cộng vào mọi stage đang mở rồi reset (nếu cần)"""
+        current, peak = tracemalloc.get_traced_memory()
+        rss = get_rss_bytes()
+        with self._rss_lock:
+            rss_peak = max(filter(None, (self._rss_peak, rss)), default=None)
+            if reset:
+                self._rss_peak = rss
+        if reset:
+            tracemalloc.reset_peak()
+        for frame in self._stack:
+            frame.peak_traced = max(frame.peak_traced, peak)
+            if rss_peak is not None and frame.peak_rss is not None:
+                frame.peak_rss = max(frame.peak_rss, rss_peak)
+        return current, rss
+
+    def enter(self):
+        current, rss = self._take_peaks(reset=True)
+        self._stack.append(_MemoryFrame(current, rss))
+
+    def exit(self) -> Dict:
+        current, rss = self._take_peaks(reset=False)
+        frame = self._stack.pop()
+        memory = {
+            'peak_bytes': frame.peak_traced - frame.start_traced,
+            'retained_bytes': current - frame.start_traced,
+        }
+        if frame.start_rss is not None and rss is not None:
+            memory['peak_rss_bytes'] = frame.peak_rss
+            memory['rss_delta_bytes'] = rss - frame.start_rss
+        return memory
+
+
+class StageTimings:
+    """Tổng hợp thời gian, số frame và số lần gọi (và bộ nhớ nếu có) theo từng stage"""
+
+    def __init__(self, memory: Optional[MemoryProfiler] = None):
+        self._stages: Dict[str, Dict] = {}
+        self.memory = memory
+
+    def add(self, name: str, seconds: float, frames: Optional[int] = None,
+            memory: Optional[Dict] = None):
+        """Cộng dồn một lần đo vào stage (đỉnh bộ nhớ lấy max, phần giữ lại cộng dồn)"""
+        entry = self._stages.get(name)
+        if entry is None:
+            entry = self._stages[name] = {'seconds': 0.0, 'frames': None, 'calls': 0}
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        if frames is not None:
+            entry['frames'] = (entry['frames'] or 0) + int(frames)
+        if memory is not None:
+            total = entry.setdefault('memory', {})
+            for key, value in memory.items():
+                if key.startswith('peak'):
+                    total[key] = max(total.get(key, value), value)
+                else:
+                    total[key] = total.get(key, 0) + value
+
+    def as_dict(self) -> Dict[str, Dict]:
+        """Bản copy dạng {stage: {'seconds', 'frames', 'calls'[, 'memory']}} (JSON được)"""
+        result = {}
+        for name, entry in self._stages.items():
+            result[name] = dict(entry)
+            if 'memory' in entry:
+                result[name]['memory'] = dict(entry['memory'])
+        return result
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stages
+
+    def __getitem__(self, name: str) -> Dict:
+        return self._stages[name]
+
+
+class _StageRecord:
+    """Đối tượng trả về bởi stage(), cho phép gán số frame sau khi tính xong"""
+    __slots__ = ('frames',)
+
+    def __init__(self, frames: Optional[int]):
+        self.frames = frames
+
+
+@contextmanager
+def stage(name: str, frames: Optional[int] = None):
+    """
+    Đo thời gian một stage (time.perf_counter, đơn điệu)
+
+    Args:
+        name: Tên stage
+        frames: Số frame xử lý (có thể gán sau qua ``record.frames``)
+    """
+    record = _StageRecord(frames)
+    collector = _collector.get()
+    if collector is None and not _hooks:
+        yield record
+        return
+
+    path = _stage_path.get() + (name,)
+    token = _stage_path.set(path)
+    profiler = collector.memory if collector is not None else None
+    if profiler is not None:
+        profiler.enter()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        memory = profiler.exit() if profiler is not None else None
+        _stage_path.reset(token)
+        full_name = '.'.join(path)
+        if collector is not None:
+            collector.add(full_name, seconds, record.frames, memory)
+        _emit(full_name, seconds, record.frames)
+
+
+@contextmanager
+def collect_timings(profile_memory: bool = False):
+    """
+    Thu thập các stage chạy trong khối with (kể cả stage lồng nhau) vào StageTimings
+
+    Args:
+        profile_memory: Đo thêm bộ nhớ đỉnh / còn giữ lại từng stage (chậm hơn
+                        đáng kể vì tracemalloc theo dõi mọi lần cấp phát)
+    """
+    profiler = MemoryProfiler() if profile_memory else None
+    timings = StageTimings(memory=profiler)
+    collector_token = _collector.set(timings)
+    path_token = _stage_path.set(())
+    if profiler is not None:
+        profiler.start()
+    try:
+        yield timings
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        _stage_path.reset(path_token)
+        _collector.reset(collector_token)
+
+
+def add_timing_hook(hook: TimingHook):
+    """Đăng ký hook được gọi sau mỗi stage (từ thread đang chạy stage đó)"""
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_timing_hook(hook: TimingHook):
+    """Gỡ hook đã đăng ký"""
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def _emit(name: str, seconds: float, frames: Optional[int]):
+    for hook in list(_hooks):
+        try:
+            hook(name, seconds, frames)
+        except Exception as e:
+            # Lỗi ở hook của ứng dụng không được làm hỏng việc chấm điểm
+            print(f"⚠️ Timing hook lỗi ở stage {name}: {e}")
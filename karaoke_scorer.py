@@ -2,14 +2,242 @@
 Script chính để chấm điểm karaoke sử dụng Pitch Detection
 """
 import argparse
+import csv
+import json
+import multiprocessing
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
 from pathlib import Path
+from typing import Dict, List, Optional, Set
 from pitch_extractor import PitchExtractor
-from pitch_matcher import PitchMatcher
+from activation_cache import ActivationCache
+from pitch_matcher import PitchMatcher, segment_notes, window_contour, window_segments
+from instrumentation import collect_timings, stage
 import numpy as np
 
 
+# Session của từng worker process trong chế độ batch (tạo trong _init_batch_worker)
+_batch_session = None
+_batch_profile_memory = False
+_batch_scoring_mode = 'frames'
+
+
+def read_manifest(manifest_path: str) -> List[Dict]:
+    """
+    Đọc manifest CSV cho chế độ batch
+    
+    Cột bắt buộc: user, reference. Cột tùy chọn: id (mặc định "user|reference"),
+    tolerance, difficulty, start, end (giây, chỉ chấm đoạn đó). Đường dẫn tương đối
+    được tính từ thư mục chứa manifest.
+    
+    Returns:
+        List các dòng (dict) theo thứ tự trong file
+    """
+    rows = []
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = {'user', 'reference'} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Manifest thiếu cột: {', '.join(sorted(missing))}")
+        for row in reader:
+            if not row.get('user') or not row.get('reference'):
+                continue
+            row['id'] = row.get('id') or f"{row['user']}|{row['reference']}"
+            for column in ('user', 'reference'):
+                row[column] = os.path.join(base_dir, row[column])
+            rows.append(row)
+    return rows
+
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """
+    Lấy id các dòng đã chấm thành công trong file JSONL (để chạy tiếp sau khi dừng)
+    
+    Dòng lỗi không được tính là xong nên sẽ được chấm lại; dòng ghi dở (process
+    bị kill giữa chừng) được bỏ qua.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'id' in record and 'error' not in record:
+                completed.add(record['id'])
+    return completed
+
+
+def _init_batch_worker(session_kwargs: Dict, profile_memory: bool = False, scoring_mode: str = 'frames'):
+    """Khởi tạo worker: tạo KaraokeSession và load model một lần"""
+    global _batch_session, _batch_profile_memory, _batch_scoring_mode
+    from library_interface import KaraokeSession
+    _batch_session = KaraokeSession(**session_kwargs)
+    _batch_profile_memory = profile_memory
+    _batch_scoring_mode = scoring_mode
+    try:
+        _batch_session.warm_up()
+    except Exception as e:
+        # Reference MIDI vẫn chấm được, lỗi model sẽ được ghi theo từng dòng
+        print(f"⚠️ Worker {os.getpid()} không load được model: {e}")
+
+
+def _batch_error_record(row: Dict, error: Exception) -> Dict:
+    """Dòng JSONL lỗi cho một dòng manifest (sẽ được chấm lại ở lần chạy sau)"""
+    from library_interface import build_error_result
+    record = {'id': row['id'], 'user': row['user'], 'reference': row['reference']}
+    record.update(build_error_result(error))
+    return record
+
+
+def _score_batch_row(row: Dict) -> Dict:
+    """Chấm một dòng manifest trong worker, kèm thời gian từng stage (dòng hỏng -> bản ghi lỗi)"""
+    try:
+        tolerance = float(row['tolerance']) if row.get('tolerance') else None
+        start = float(row['start']) if row.get('start') else None
+        end = float(row['end']) if row.get('end') else None
+        results = _batch_session.score(row['user'], row['reference'],
+                                       tolerance_cents=tolerance,
+                                       difficulty_mode=row.get('difficulty') or None,
+                                       include_timings=True,
+                                       profile_memory=_batch_profile_memory,
+                                       scoring_mode=_batch_scoring_mode,
+                                       start=start, end=end)
+    except Exception as e:
+        return _batch_error_record(row, e)
+    record = {'id': row['id'], 'user': row['user'], 'reference': row['reference']}
+    record.update(results)
+    return record
+
+
+def run_batch(manifest_path: str, output_path: str, workers: int = 2,
+              session_kwargs: Optional[Dict] = None, profile_memory: bool = False,
+              scoring_mode: str = 'frames') -> Dict:
+    """
+    Chấm điểm hàng loạt theo manifest, ghi từng kết quả ra JSONL ngay khi xong
+    
+    Model chỉ được load một lần cho mỗi worker process. Các dòng đã có kết quả
+    thành công trong output_path sẽ được bỏ qua, nên có thể chạy lại sau khi bị dừng.
+    
+    Args:
+        manifest_path: File CSV (xem read_manifest)
+        output_path: File JSONL kết quả (ghi nối tiếp)
+        workers: Số worker process (0 = chạy trong process hiện tại)
+        session_kwargs: Cấu hình KaraokeSession (method, model_capacity, ...)
+        profile_memory: Ghi thêm bộ nhớ từng stage vào "timings" của mỗi dòng JSONL
+        scoring_mode: 'frames' hoặc 'notes' (xem KaraokeSession.score)
+    
+    Returns:
+        Dictionary thống kê: total, skipped, scored, failed, elapsed, takes_per_minute,
+        stage_totals, stage_peak_bytes (khi profile_memory)
+    """
+    session_kwargs = session_kwargs or {}
+    rows = read_manifest(manifest_path)
+    completed = load_completed_ids(output_path)
+    pending = [row for row in rows if row['id'] not in completed]
+    
+    stats = {
+        'total': len(rows),
+        'skipped': len(rows) - len(pending),
+        'scored': 0,
+        'failed': 0,
+        'stage_totals': {},
+        'stage_peak_bytes': {}
+    }
+    
+    start = time.perf_counter()
+    # Nếu lần chạy trước bị kill giữa một dòng, bắt đầu trên dòng mới
+    needs_newline = os.path.exists(output_path) and os.path.getsize(output_path) > 0
+    if needs_newline:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    
+    with open(output_path, 'a', encoding='utf-8') as out:
+        if needs_newline:
+            out.write('\n')
+        
+        def write_record(record):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            if 'error' in record:
+                stats['failed'] += 1
+                print(f"❌ {record['id']}: {record['error']}")
+            else:
+                stats['scored'] += 1
+            for stage, timing in record.get('timings', {}).items():
+                if stage != 'total':
+                    totals = stats['stage_totals']
+                    totals[stage] = totals.get(stage, 0.0) + timing['seconds']
+                if 'memory' in timing:
+                    peaks = stats['stage_peak_bytes']
+                    peaks[stage] = max(peaks.get(stage, 0), timing['memory']['peak_bytes'])
+        
+        if workers <= 0:
+            _init_batch_worker(session_kwargs, profile_memory, scoring_mode)
+            for row in pending:
+                write_record(_score_batch_row(row))
+        elif pending:
+            # spawn thay vì fork: TensorFlow không an toàn khi fork
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_batch_worker,
+                                     initargs=(session_kwargs, profile_memory, scoring_mode)) as pool:
+                futures = {pool.submit(_score_batch_row, row): row for row in pending}
+                for future in as_completed(futures):
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # Worker chết / kết quả không chuyển về được: chỉ dòng này lỗi
+                        record = _batch_error_record(futures[future], e)
+                    write_record(record)
+    
+    stats['elapsed'] = time.perf_counter() - start
+    done = stats['scored'] + stats['failed']
+    stats['takes_per_minute'] = done / stats['elapsed'] * 60.0 if stats['elapsed'] > 0 else 0.0
+    return stats
+
+
+def print_batch_summary(stats: Dict):
+    """In thống kê sau khi chạy batch"""
+    print()
+    print("=" * 50)
+    print("📊 KẾT QUẢ CHẤM HÀNG LOẠT")
+    print("=" * 50)
+    print(f"📁 Tổng số dòng: {stats['total']} (bỏ qua {stats['skipped']} dòng đã chấm)")
+    print(f"✅ Thành công: {stats['scored']}   ❌ Lỗi: {stats['failed']}")
+    print(f"⏱️  Thời gian: {stats['elapsed']:.1f} giây ({stats['takes_per_minute']:.1f} bài/phút)")
+    print("⏳ Tổng thời gian theo stage (cộng dồn các worker):")
+    for stage, seconds in sorted(stats['stage_totals'].items()):
+        print(f"   {stage:<34}{seconds:10.2f} giây")
+    if stats.get('stage_peak_bytes'):
+        print("💾 Bộ nhớ đỉnh lớn nhất theo stage (tracemalloc):")
+        for stage, peak in sorted(stats['stage_peak_bytes'].items()):
+            print(f"   {stage:<34}{peak / 2**20:10.1f} MB")
+    print("=" * 50)
+
+
+def print_memory_profile(timings: Dict):
+    """In bảng bộ nhớ đỉnh / còn giữ lại theo stage"""
+    print()
+    print("💾 BỘ NHỚ THEO STAGE (MB)")
+    print(f"   {'stage':<34}{'peak':>9}{'retained':>10}{'peak RSS':>10}{'giây':>8}")
+    for stage, timing in timings.items():
+        memory = timing.get('memory')
+        if memory is None:
+            continue
+        peak_rss = memory.get('peak_rss_bytes')
+        peak_rss = f"{peak_rss / 2**20:10.1f}" if peak_rss is not None else f"{'-':>10}"
+        print(f"   {stage:<34}{memory['peak_bytes'] / 2**20:9.1f}"
+              f"{memory['retained_bytes'] / 2**20:10.1f}{peak_rss}{timing['seconds']:8.2f}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Chấm điểm karaoke sử dụng Pitch Detection',
@@ -24,12 +252,15 @@ Ví dụ sử dụng:
   
   # Sử dụng Basic Pitch thay vì CREPE
   python karaoke_scorer.py --user audio_user.wav --reference reference_singer.wav --method basic_pitch
+  
+  # Chấm hàng loạt theo manifest CSV (cột user,reference[,id,tolerance,difficulty])
+  python karaoke_scorer.py --batch manifest.csv --output results.jsonl --workers 4
         """
     )
     
-    parser.add_argument('--user', '-u', required=True,
+    parser.add_argument('--user', '-u',
                        help='Đường dẫn file audio người hát (Vocal + Beat)')
-    parser.add_argument('--reference', '-r', required=True,
+    parser.add_argument('--reference', '-r',
                        help='Đường dẫn file audio reference (ca sĩ mẫu) - WAV, MP3, FLAC. Vẫn hỗ trợ MIDI nếu cần')
     parser.add_argument('--method', '-m', default='crepe',
                        choices=['crepe', 'basic_pitch'],
@@ -43,17 +274,77 @@ Ví dụ sử dụng:
                             'Giá trị nhỏ hơn (10-20ms) = chính xác hơn nhưng chậm hơn')
     parser.add_argument('--crepe-viterbi', action='store_true',
                        help='Bật Viterbi smoothing (tăng độ chính xác nhưng chậm hơn)')
+    parser.add_argument('--crepe-confidence', type=float, default=0.4,
+                       help='Ngưỡng confidence của CREPE (default: 0.4, thấp hơn = giữ nhiều frame hơn)')
+    parser.add_argument('--activation-cache', metavar='DIR',
+                       help='Lưu activation thô của CREPE (float16, .npz nén) vào thư mục này. Chạy lại '
+                            'với --crepe-confidence / --crepe-viterbi khác không phải suy luận lại')
     parser.add_argument('--tolerance', '-t', type=float, default=50.0,
                        help='Độ lệch cho phép tính bằng cents (default: 50)')
     parser.add_argument('--midi-track', type=str, default='auto',
                        help='Lọc track MIDI (auto/vocal/voice/melody hoặc tên track cụ thể, default: auto)')
     parser.add_argument('--midi-pitch-range', type=float, nargs=2, metavar=('MIN', 'MAX'),
                        help='Lọc pitch range cho MIDI (Hz), ví dụ: --midi-pitch-range 80 2000')
+    parser.add_argument('--precision', default='float64', choices=['float64', 'float32'],
+                       help='Kiểu số cho contour / cents / độ lệch (default: float64). '
+                            'float32 giảm một nửa bộ nhớ, điểm lệch < 0.05 so với float64')
+    parser.add_argument('--scoring-mode', default='frames', choices=['frames', 'notes'],
+                       help='frames: chấm từng frame với DTW (default). notes: chấm theo từng nốt '
+                            'của reference, không cần DTW')
+    parser.add_argument('--voiced-only', action='store_true',
+                       help='Chỉ chấm các đoạn cả người hát và reference cùng có pitch, '
+                            'không nội suy qua khoảng lặng (reference MIDI dùng các nốt)')
+    parser.add_argument('--start', type=float, metavar='SECONDS',
+                       help='Chỉ chấm từ giây này của bài (ví dụ đoạn điệp khúc). Chỉ đoạn được '
+                            'chọn mới được decode và trích xuất pitch')
+    parser.add_argument('--end', type=float, metavar='SECONDS',
+                       help='Chỉ chấm tới giây này của bài')
     parser.add_argument('--output', '-o',
-                       help='Lưu kết quả vào file JSON (tùy chọn)')
+                       help='Lưu kết quả vào file JSON (tùy chọn). Với --batch: file JSONL kết quả')
+    parser.add_argument('--batch', metavar='MANIFEST_CSV',
+                       help='Chấm hàng loạt theo manifest CSV, load model một lần cho mỗi worker. '
+                            'Chạy lại với cùng --output sẽ bỏ qua các dòng đã chấm')
+    parser.add_argument('--workers', type=int, default=2,
+                       help='Số worker process cho --batch (default: 2, 0 = chạy trong process chính)')
+    parser.add_argument('--profile-memory', action='store_true',
+                       help='Đo bộ nhớ đỉnh / còn giữ lại theo từng stage (tracemalloc + RSS, chậm hơn)')
     
     args = parser.parse_args()
     
+    if args.batch:
+        if not os.path.exists(args.batch):
+            print(f"❌ Không tìm thấy file: {args.batch}")
+            sys.exit(1)
+        output = args.output or str(Path(args.batch).with_suffix('.jsonl'))
+        session_kwargs = {
+            'method': args.method,
+            'model_capacity': args.crepe_capacity,
+            'tolerance_cents': args.tolerance,
+            'difficulty_mode': 'normal',  # giống chế độ chấm một bài
+            'step_size': args.crepe_step_size,
+            'use_viterbi': args.crepe_viterbi,
+            'confidence_threshold': args.crepe_confidence,
+            'activation_cache_dir': args.activation_cache,
+            'midi_track_filter': args.midi_track,
+            'precision': args.precision,
+            'voiced_only': args.voiced_only,
+        }
+        print(f"🎤 Chấm hàng loạt: {args.batch} → {output} ({args.workers} worker)")
+        try:
+            stats = run_batch(args.batch, output, workers=args.workers, session_kwargs=session_kwargs,
+                              profile_memory=args.profile_memory, scoring_mode=args.scoring_mode)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print_batch_summary(stats)
+        return
+    
+    if not args.user or not args.reference:
+        parser.error('cần --user và --reference (hoặc dùng --batch)')
+    if (args.start is not None and args.start < 0) or \
+            (args.end is not None and args.end <= (args.start or 0.0)):
+        parser.error('--start phải >= 0 và --end phải lớn hơn --start')
+    
     # Kiểm tra file tồn tại
     if not os.path.exists(args.user):
         print(f"❌ Không tìm thấy file: {args.user}")
@@ -69,20 +360,32 @@ Ví dụ sử dụng:
     print(f"🔧 Phương pháp: {args.method}")
     if args.method == 'crepe':
         print(f"⚙️  CREPE capacity: {args.crepe_capacity}, step size: {args.crepe_step_size}ms, viterbi: {args.crepe_viterbi}")
+    if args.start is not None or args.end is not None:
+        print(f"✂️  Chỉ chấm đoạn: {args.start or 0.0:.2f}s → "
+              f"{'hết bài' if args.end is None else f'{args.end:.2f}s'}")
     print()
     
+    # Profile bộ nhớ cho tới khi chấm xong (đóng khi thoát main)
+    profiling = ExitStack()
+    timings = profiling.enter_context(collect_timings(profile_memory=True)) if args.profile_memory else None
+    
     # Khởi tạo Pitch Extractor
     print("⏳ Đang trích xuất pitch từ audio người hát...")
-    extractor_user = PitchExtractor(method=args.method, model_capacity=args.crepe_capacity)
+    activation_cache = ActivationCache(args.activation_cache) if args.activation_cache else None
+    extractor_user = PitchExtractor(method=args.method, model_capacity=args.crepe_capacity,
+                                    precision=args.precision, activation_cache=activation_cache)
     try:
-        if args.method == 'crepe':
-            time_user, freq_user = extractor_user.extract_pitch(
-                args.user, 
-                step_size=args.crepe_step_size,
-                use_viterbi=args.crepe_viterbi
-            )
-        else:
-            time_user, freq_user = extractor_user.extract_pitch(args.user)
+        with stage('extract_user'):
+            if args.method == 'crepe':
+                time_user, freq_user = extractor_user.extract_pitch(
+                    args.user, 
+                    step_size=args.crepe_step_size,
+                    use_viterbi=args.crepe_viterbi,
+                    confidence_threshold=args.crepe_confidence,
+                    start=args.start, end=args.end
+                )
+            else:
+                time_user, freq_user = extractor_user.extract_pitch(args.user, start=args.start, end=args.end)
         print(f"✅ Đã trích xuất {len(time_user)} điểm pitch từ audio người hát")
     except Exception as e:
         print(f"❌ Lỗi khi trích xuất pitch từ audio người hát: {e}")
@@ -91,16 +394,24 @@ Ví dụ sử dụng:
     # Trích xuất pitch từ reference audio (ca sĩ mẫu)
     print("⏳ Đang trích xuất pitch từ audio ca sĩ mẫu...")
     ref_ext = Path(args.reference).suffix.lower()
+    reference_segments = None
+    reference_notes = None
     
     if ref_ext == '.mid' or ref_ext == '.midi':
         # Vẫn hỗ trợ MIDI nếu cần
         try:
             pitch_range = tuple(args.midi_pitch_range) if args.midi_pitch_range else None
-            time_ref, freq_ref = extractor_user.extract_pitch_from_midi(
-                args.reference,
-                track_filter=args.midi_track,
-                pitch_range=pitch_range
-            )
+            with stage('reference'):
+                time_ref, freq_ref = window_contour(*extractor_user.extract_pitch_from_midi(
+                    args.reference,
+                    track_filter=args.midi_track,
+                    pitch_range=pitch_range
+                ), args.start, args.end)
+                if args.voiced_only or args.scoring_mode == 'notes':
+                    reference_notes = window_segments(extractor_user.extract_notes_from_midi(
+                        args.reference, track_filter=args.midi_track, pitch_range=pitch_range),
+                        args.start, args.end)
+                    reference_segments = reference_notes[:, :2] if args.voiced_only else None
             print(f"✅ Đã trích xuất {len(time_ref)} điểm pitch từ MIDI")
             if args.midi_track == 'auto':
                 print("   (Đã tự động lọc track vocal)")
@@ -109,16 +420,21 @@ Ví dụ sử dụng:
             sys.exit(1)
     else:
         # File Audio reference (ca sĩ mẫu) - sử dụng cùng settings với user audio để công bằng
-        extractor_ref = PitchExtractor(method=args.method, model_capacity=args.crepe_capacity)
+        extractor_ref = PitchExtractor(method=args.method, model_capacity=args.crepe_capacity,
+                                    precision=args.precision, activation_cache=activation_cache)
         try:
-            if args.method == 'crepe':
-                time_ref, freq_ref = extractor_ref.extract_pitch(
-                    args.reference, 
-                    step_size=args.crepe_step_size,
-                    use_viterbi=args.crepe_viterbi
-                )
-            else:
-                time_ref, freq_ref = extractor_ref.extract_pitch(args.reference)
+            with stage('reference'):
+                if args.method == 'crepe':
+                    time_ref, freq_ref = extractor_ref.extract_pitch(
+                        args.reference, 
+                        step_size=args.crepe_step_size,
+                        use_viterbi=args.crepe_viterbi,
+                        confidence_threshold=args.crepe_confidence,
+                        start=args.start, end=args.end
+                    )
+                else:
+                    time_ref, freq_ref = extractor_ref.extract_pitch(args.reference, start=args.start,
+                                                                     end=args.end)
             print(f"✅ Đã trích xuất {len(time_ref)} điểm pitch từ audio ca sĩ mẫu")
         except Exception as e:
             print(f"❌ Lỗi khi trích xuất pitch từ audio reference: {e}")
@@ -127,13 +443,26 @@ Ví dụ sử dụng:
     # So khớp và tính điểm
     print()
     print("⏳ Đang so khớp pitch và tính điểm...")
-    matcher = PitchMatcher(tolerance_cents=args.tolerance)
+    matcher = PitchMatcher(tolerance_cents=args.tolerance, precision=args.precision,
+                           voiced_only=args.voiced_only)
     
     try:
-        results = matcher.calculate_score(
-            time_user, freq_user,
-            time_ref, freq_ref
-        )
+        with stage('match'):
+            if args.scoring_mode == 'notes':
+                if reference_notes is None:
+                    reference_notes = segment_notes(time_ref, freq_ref)
+                results = matcher.score_notes(time_user, freq_user, reference_notes)
+            else:
+                results = matcher.calculate_score(
+                    time_user, freq_user,
+                    time_ref, freq_ref,
+                    reference_segments=reference_segments
+                )
+        
+        if timings is not None:
+            profiling.close()
+            results['timings'] = timings.as_dict()
+            print_memory_profile(results['timings'])
         
         # Hiển thị kết quả
         print()
@@ -142,15 +471,19 @@ Ví dụ sử dụng:
         print("=" * 50)
         print(f"🎯 Điểm tổng hợp: {results['final_score']:.2f}/100")
         print(f"📈 Độ chính xác: {results['accuracy']:.2f}%")
-        print(f"🎵 Điểm DTW: {results['dtw_score']:.2f}/100")
-        print(f"📏 Khoảng cách DTW: {results['dtw_distance']:.2f} cents")
-        print(f"📉 Độ lệch trung bình: {results['mae_cents']:.2f} cents")
+        if args.scoring_mode == 'notes':
+            print(f"🎼 Nốt hát đúng: {results['notes_hit']}/{results['notes_total']} "
+                  f"(đã hát {results['notes_sung']})")
+        else:
+            print(f"🎵 Điểm DTW: {results['dtw_score']:.2f}/100")
+            print(f"📏 Khoảng cách DTW: {results['dtw_distance']:.2f} cents")
+        if results['mae_cents'] is not None:
+            print(f"📉 Độ lệch trung bình: {results['mae_cents']:.2f} cents")
         print(f"⏱️  Thời lượng: {results['duration']:.2f} giây")
         print("=" * 50)
         
         # Lưu kết quả nếu có yêu cầu
         if args.output:
-            import json
             with open(args.output, 'w', encoding='utf-8') as f:
                 json.dump(results, f, indent=2, ensure_ascii=False)
             print(f"\n💾 Đã lưu kết quả vào: {args.output}")
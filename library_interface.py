@@ -1,80 +1,1434 @@
 
+import asyncio
+import copy
+import functools
 import json
+import multiprocessing
 import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import Executor, Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from collections import OrderedDict
 from pathlib import Path
-from pitch_extractor import PitchExtractor
-from pitch_matcher import PitchMatcher
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from pitch_extractor import PitchExtractor, AudioSource, is_audio_path
+from activation_cache import MEMORY_ENTRIES, ActivationCache, audio_digest
+from pitch_matcher import PitchMatcher, resolve_precision, segment_notes, window_contour, window_segments
+from pitch_advisor import PitchAdvisor
+from contour_export import write_contours
+from reference_catalog import ReferenceCatalog
+from instrumentation import collect_timings, stage
+from metrics import REGISTRY, FileExporter, install_stage_hook, record_cache, record_score
+from cancellation import (CancellationToken, ProgressCallback, ScoringCancelled,
+                          check_cancelled, report_progress)
+
+# Timeline resolution (Hz) used when aligning contours; matches PitchMatcher's default
+CONTOUR_GRID_RATE = 10.0
+
+# Result cache size used by long-running hosts (scoring_server); sessions default to no cache
+DEFAULT_RESULT_CACHE_SIZE = 128
+
+
+def build_error_result(error: Exception) -> Dict:
+    """Build the consistent error payload returned to callers."""
+    return {
+        'error': str(error),
+        'final_score': 0.0,
+        'accuracy': 0.0,
+        'dtw_score': 0.0,
+        'dtw_distance': 0.0,
+        'mae_cents': 0.0,
+        'duration': 0.0
+    }
+
+
+def fingerprint_audio(user_audio: AudioSource, sample_rate: Optional[int] = None,
+                      dtype: str = 'float32') -> str:
+    """
+    Content hash of the user audio, independent of its file name.
+    
+    Files are hashed in chunks; in-memory PCM is hashed together with its sample
+    rate and sample type, so the same samples in a different format do not collide.
+    
+    Returns:
+        Hex digest (BLAKE2b, 128-bit)
+    """
+    return audio_digest(user_audio, sample_rate, dtype).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of scoring results with a time-to-live.
+    
+    Concurrent requests for the same key are deduplicated: the first caller of
+    lookup() computes the result and every other caller waits for it, so a client
+    retrying while its first request is still running does not score twice.
+    """
+    
+    def __init__(self, max_entries: int = 128, ttl_seconds: float = 600.0):
+        """
+        Args:
+            max_entries (int): Results kept; the least recently used is evicted first.
+            ttl_seconds (float): Age after which a result is no longer served.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, result)
+        self._inflight = {}            # key -> threading.Event set when the owner finishes
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+    
+    def _get(self, key) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl_seconds:
+            del self._entries[key]
+            self._counters['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+    
+    def lookup(self, key, cancel_token: Optional[CancellationToken] = None) -> Optional[Dict]:
+        """
+        Return a copy of the cached result, or None after claiming the key.
+        
+        A caller that gets None owns the computation and must call release(key)
+        when done (after store() on success). If another caller owns the key, this
+        waits for it, checking cancel_token.
+        """
+        while True:
+            with self._lock:
+                result = self._get(key)
+                if result is not None:
+                    self._counters['hits'] += 1
+                    record_cache('result', hit=True)
+                    return copy.deepcopy(result)
+                pending = self._inflight.get(key)
+                if pending is None:
+                    self._inflight[key] = threading.Event()
+                    self._counters['misses'] += 1
+                    record_cache('result', hit=False)
+                    return None
+            # The owner failed or was cancelled if nothing is cached afterwards: claim it then
+            while not pending.wait(0.1):
+                check_cancelled(cancel_token)
+    
+    def store(self, key, result: Dict):
+        """Cache a successful result."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+    
+    def release(self, key):
+        """End the claim taken by lookup() and wake up waiting callers."""
+        with self._lock:
+            pending = self._inflight.pop(key, None)
+        if pending is not None:
+            pending.set()
+    
+    def clear(self):
+        """Drop all cached results (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """Hit / miss / expiry / eviction counters and the current size."""
+        with self._lock:
+            return dict(self._counters, size=len(self._entries), max_entries=self.max_entries,
+                        ttl_seconds=self.ttl_seconds)
+
+
+class KaraokeSession:
+    """
+    Long-lived scoring session for host processes (C++ embedding, services, GUI).
+    
+    Keeps pitch extractors (and therefore the loaded CREPE / Basic Pitch models),
+    matchers and an LRU cache of reference contours alive across calls, so that
+    repeated requests only pay for the user-side extraction and the matching.
+    The session is safe to share between threads.
+    """
+    
+    def __init__(self,
+                 method: str = 'crepe',
+                 model_capacity: str = 'tiny',
+                 tolerance_cents: float = 200.0,
+                 difficulty_mode: str = 'easy',
+                 normalize_audio: bool = True,
+                 step_size: int = 50,
+                 use_viterbi: bool = False,
+                 confidence_threshold: float = 0.4,
+                 midi_track_filter: Optional[str] = 'auto',
+                 reference_cache_size: int = 32,
+                 catalog_path: Optional[str] = None,
+                 precision: str = 'float64',
+                 voiced_only: bool = False,
+                 result_cache_size: int = 0,
+                 result_cache_ttl: float = 600.0,
+                 activation_cache_size: int = 0,
+                 activation_cache_dir: Optional[str] = None):
+        """
+        Args:
+            method (str): Default pitch extraction method ('crepe' or 'basic_pitch').
+            model_capacity (str): CREPE model capacity. Default: 'tiny'
+            tolerance_cents (float): Default tolerance in cents. Default: 200.0
+            difficulty_mode (str): Default difficulty ('easy', 'normal', 'hard'). Default: 'easy'
+            normalize_audio (bool): Peak-normalize audio before extraction. Default: True
+            step_size (int): CREPE step size in milliseconds. Default: 50
+            use_viterbi (bool): CREPE Viterbi smoothing. Default: False
+            confidence_threshold (float): CREPE confidence threshold. Default: 0.4
+            midi_track_filter (str): Track filter used for MIDI references. Default: 'auto'
+            reference_cache_size (int): Number of reference contours kept in memory. Default: 32
+            catalog_path (str): Reference catalog built with reference_catalog.py; enables
+                                scoring by song ID without decoding the reference.
+            precision (str): 'float64' or 'float32' for contours, aligned grids, cents and
+                             deviations. float32 halves memory traffic; final scores stay
+                             within 0.05 points of float64. Default: 'float64'
+            voiced_only (bool): Score only the spans where both singer and reference have
+                                pitch instead of interpolating across silence. MIDI
+                                references use their note spans. Default: False
+            result_cache_size (int): Number of scoring results kept, keyed by a content
+                                     hash of the user audio, the reference and the scoring
+                                     parameters, so a re-submitted take is answered
+                                     instantly. 0 disables the cache; long-running hosts
+                                     such as scoring_server enable it with
+                                     DEFAULT_RESULT_CACHE_SIZE. Default: 0
+            result_cache_ttl (float): Seconds a cached result stays valid. Default: 600
+            activation_cache_size (int): Number of raw CREPE activation matrices kept in
+                                         memory (float16), so changing confidence_threshold
+                                         or use_viterbi re-decodes without re-inference.
+                                         0 disables it unless activation_cache_dir is set.
+                                         Default: 0
+            activation_cache_dir (str): Directory where activations are also persisted as
+                                        compressed .npz files, shared across runs and
+                                        processes. Default: None
+        """
+        self.method = method
+        self.model_capacity = model_capacity
+        self.tolerance_cents = tolerance_cents
+        self.difficulty_mode = difficulty_mode
+        self.normalize_audio = normalize_audio
+        self.step_size = step_size
+        self.use_viterbi = use_viterbi
+        self.confidence_threshold = confidence_threshold
+        self.midi_track_filter = midi_track_filter
+        self.reference_cache_size = reference_cache_size
+        self.catalog_path = catalog_path
+        self.precision = precision
+        self.voiced_only = voiced_only
+        resolve_precision(precision)
+        
+        self._catalog = None
+        self._extractors = {}
+        self._matchers = {}
+        self._reference_cache = OrderedDict()
+        # Read-only reference views in shared memory, installed by KaraokeWorkerPool workers
+        self._shared_references = {}
+        self._lock = threading.RLock()
+        self.result_cache = ResultCache(result_cache_size, result_cache_ttl) if result_cache_size > 0 else None
+        self.activation_cache = None
+        if activation_cache_size > 0 or activation_cache_dir:
+            self.activation_cache = ActivationCache(activation_cache_dir, activation_cache_size or MEMORY_ENTRIES)
+        install_stage_hook()
+    
+    def get_extractor(self, method: Optional[str] = None) -> PitchExtractor:
+        """Return the (cached) PitchExtractor for a method."""
+        method = method or self.method
+        with self._lock:
+            extractor = self._extractors.get(method)
+            if extractor is None:
+                extractor = PitchExtractor(method=method, model_capacity=self.model_capacity,
+                                           normalize_audio=self.normalize_audio, precision=self.precision,
+                                           activation_cache=self.activation_cache)
+                self._extractors[method] = extractor
+            return extractor
+    
+    def get_matcher(self, tolerance_cents: Optional[float] = None,
+                    difficulty_mode: Optional[str] = None) -> PitchMatcher:
+        """Return the (cached) PitchMatcher for a tolerance / difficulty pair."""
+        key = (tolerance_cents if tolerance_cents is not None else self.tolerance_cents,
+               difficulty_mode or self.difficulty_mode)
+        with self._lock:
+            matcher = self._matchers.get(key)
+            if matcher is None:
+                matcher = PitchMatcher(tolerance_cents=key[0], difficulty_mode=key[1],
+                                       precision=self.precision, voiced_only=self.voiced_only)
+                self._matchers[key] = matcher
+            return matcher
+    
+    def warm_up(self, method: Optional[str] = None):
+        """Load the pitch model up front so the first request does not pay for it."""
+        self.get_extractor(method).warm_up()
+    
+    def _extraction_kwargs(self, method: str) -> Dict:
+        """Extraction settings passed to PitchExtractor.extract_pitch."""
+        if method == 'crepe':
+            return {
+                'step_size': self.step_size,
+                'use_viterbi': self.use_viterbi,
+                'confidence_threshold': self.confidence_threshold
+            }
+        return {}
+    
+    def reference_params(self, reference_path: str, method: Optional[str] = None) -> Dict:
+        """Settings that determine a reference contour (stored as catalog metadata)."""
+        method = method or self.method
+        if Path(reference_path).suffix.lower() in ['.mid', '.midi']:
+            return {'method': 'midi', 'midi_track_filter': self.midi_track_filter}
+        params = {'method': method, **self._extraction_kwargs(method)}
+        if method == 'crepe':
+            params['model_capacity'] = self.model_capacity
+        return params
+    
+    def get_catalog(self) -> ReferenceCatalog:
+        """Return the (lazily opened, memory-mapped) reference catalog."""
+        with self._lock:
+            if self._catalog is None:
+                if not self.catalog_path:
+                    raise ValueError("Scoring by song_id requires a session with catalog_path")
+                self._catalog = ReferenceCatalog(self.catalog_path, create=False)
+            return self._catalog
+    
+    def get_catalog_contour(self, song_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the precomputed reference contour of a catalog song.
+        
+        Only the song's record is touched (through the mmap), so this costs a
+        dictionary lookup plus decoding a few thousand int16 values.
+        
+        Returns:
+            (time, frequency) arrays
+        """
+        time_ref, freq_ref = self.get_catalog().get_contour(song_id)
+        if len(time_ref) == 0:
+            raise ValueError(f"No pitch stored for song: {song_id}")
+        return time_ref, freq_ref
+    
+    def extract_user(self, user_audio: AudioSource,
+                     method: Optional[str] = None,
+                     sample_rate: Optional[int] = None,
+                     dtype: str = 'float32',
+                     cancel_token: Optional[CancellationToken] = None,
+                     progress: Optional[ProgressCallback] = None,
+                     start: Optional[float] = None,
+                     end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Extract the user's pitch contour (never cached).
+        
+        Args:
+            user_audio: Path to the user's audio file, or in-memory PCM (NumPy array,
+                        bytes, memoryview or any object supporting the buffer protocol).
+            method (str): Override the session's extraction method.
+            sample_rate (int): Sample rate of the PCM (required for in-memory audio).
+            dtype (str): Sample type of raw PCM buffers ('float32', 'int16', ...).
+            cancel_token (CancellationToken): Checked between inference batches.
+            progress (callable): progress(stage, fraction) for extractor stages.
+            start, end (float): Only decode and analyse this span (seconds from the start
+                                of the recording); times stay relative to the recording.
+        
+        Returns:
+            (time, frequency) arrays
+        """
+        method = method or self.method
+        if is_audio_path(user_audio):
+            if not os.path.exists(user_audio):
+                raise FileNotFoundError(f"User audio file not found: {user_audio}")
+            source_name = user_audio
+        else:
+            source_name = '<pcm buffer>'
+        
+        time_user, freq_user = self.get_extractor(method).extract_pitch(
+            user_audio, sample_rate=sample_rate, dtype=dtype, cancel_token=cancel_token,
+            progress=progress, start=start, end=end, **self._extraction_kwargs(method))
+        if len(time_user) == 0 or len(freq_user) == 0:
+            raise ValueError(f"No pitch detected in user audio: {source_name}")
+        return time_user, freq_user
+    
+    def get_reference_contour(self, reference_path: str,
+                              method: Optional[str] = None,
+                              cancel_token: Optional[CancellationToken] = None,
+                              progress: Optional[ProgressCallback] = None,
+                              start: Optional[float] = None,
+                              end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the reference pitch contour, extracting it only on a cache miss.
+        
+        The cache key includes the file's modification time and size, so an
+        edited reference is re-extracted automatically.
+        
+        With start / end, only that span is returned. It is cut from the full
+        contour when that is cached (or cheap, for MIDI); otherwise only the span
+        of the audio is decoded and analysed, and cached on its own.
+        
+        Returns:
+            (time, frequency) arrays
+        """
+        method = method or self.method
+        key = self.reference_key(reference_path, method)
+        is_midi = key[3] == 'midi'
+        windowed = start is not None or end is not None
+        
+        cached = self._cache_get(key)
+        if cached is None and windowed and not is_midi:
+            key = key + (('window', start, end),)
+            cached = self._cache_get(key)
+            if cached is not None:
+                record_cache('reference', hit=True)
+                return cached
+        record_cache('reference', hit=cached is not None)
+        
+        if cached is None:
+            extractor = self.get_extractor(method)
+            if is_midi:
+                time_ref, freq_ref = extractor.extract_pitch_from_midi(reference_path,
+                                                                       track_filter=self.midi_track_filter)
+            else:
+                time_ref, freq_ref = extractor.extract_pitch(reference_path, cancel_token=cancel_token,
+                                                             progress=progress, start=start, end=end,
+                                                             **self._extraction_kwargs(method))
+            
+            if len(time_ref) == 0 or len(freq_ref) == 0:
+                raise ValueError(f"No pitch detected in reference: {reference_path}")
+            
+            cached = (time_ref, freq_ref)
+            self._cache_put(key, cached)
+        
+        if not windowed:
+            return cached
+        contour = window_contour(*cached, start, end)
+        if len(contour[0]) == 0:
+            raise ValueError(f"No pitch detected in reference between {start} and {end} s: {reference_path}")
+        return contour
+    
+    def reference_key(self, reference_path: str, method: Optional[str] = None) -> Tuple:
+        """
+        Reference cache key: path, modification time, size and extraction settings.
+        
+        Raises:
+            FileNotFoundError: If the reference does not exist
+        """
+        method = method or self.method
+        if not os.path.exists(reference_path):
+            raise FileNotFoundError(f"Reference file not found: {reference_path}")
+        stat = os.stat(reference_path)
+        is_midi = Path(reference_path).suffix.lower() in ['.mid', '.midi']
+        return (os.path.abspath(reference_path), stat.st_mtime_ns, stat.st_size,
+                'midi' if is_midi else method,
+                self.midi_track_filter if is_midi else tuple(sorted(self._extraction_kwargs(method).items())))
+    
+    def _cache_get(self, key):
+        """Look a reference up in shared memory (pool workers), then in the LRU cache."""
+        with self._lock:
+            value = self._shared_references.get(key)
+            if value is None:
+                value = self._reference_cache.get(key)
+                if value is not None:
+                    self._reference_cache.move_to_end(key)
+            return value
+    
+    def _cache_put(self, key, value):
+        with self._lock:
+            self._reference_cache[key] = value
+            self._reference_cache.move_to_end(key)
+            while len(self._reference_cache) > self.reference_cache_size:
+                self._reference_cache.popitem(last=False)
+    
+    def get_reference_notes(self, reference_path: Optional[str] = None,
+                            song_id: Optional[str] = None,
+                            method: Optional[str] = None,
+                            cancel_token: Optional[CancellationToken] = None,
+                            progress: Optional[ProgressCallback] = None,
+                            start: Optional[float] = None,
+                            end: Optional[float] = None) -> np.ndarray:
+        """
+        Return the reference segmented into notes, computing it only on a cache miss.
+        
+        MIDI references use their note events; audio references (and catalog songs
+        stored without notes) are segmented from the pitch contour with
+        pitch_matcher.segment_notes. With start / end, only the notes overlapping
+        that span are returned, clipped to it.
+        
+        Returns:
+            (N, 3) array of onset / offset (seconds) and median cents relative to A4
+        """
+        windowed = start is not None or end is not None
+        if song_id is not None:
+            notes = self.get_catalog().get_notes(song_id)
+            if len(notes) == 0:
+                notes = segment_notes(*self.get_catalog_contour(song_id))
+            return window_segments(notes, start, end) if windowed else notes
+        
+        method = method or self.method
+        key = ('notes',) + self.reference_key(reference_path, method)
+        is_midi = key[4] == 'midi'
+        if windowed and not is_midi:
+            # Audio: only the window's contour is analysed, so its notes are cached per window
+            key = key + (('window', start, end),)
+        notes = self._cache_get(key)
+        
+        if notes is None:
+            if is_midi:
+                notes = self.get_extractor(method).extract_notes_from_midi(reference_path,
+                                                                           track_filter=self.midi_track_filter)
+            else:
+                notes = segment_notes(*self.get_reference_contour(reference_path, method,
+                                                                  cancel_token=cancel_token,
+                                                                  progress=progress, start=start, end=end))
+            if len(notes) == 0:
+                raise ValueError(f"No notes detected in reference: {reference_path}")
+            self._cache_put(key, notes)
+        if windowed:
+            notes = window_segments(notes, start, end)
+            if len(notes) == 0:
+                raise ValueError(f"No notes in reference between {start} and {end} s: {reference_path}")
+        return notes
+    
+    def get_reference_segments(self, reference_path: Optional[str] = None,
+                               song_id: Optional[str] = None,
+                               start: Optional[float] = None,
+                               end: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Return the voiced spans of a MIDI reference (its notes), or None.
+        
+        Audio references (and catalog songs without notes) return None; their
+        spans are derived from the contour gaps by the matcher.
+        
+        Returns:
+            (N, 2) array of note onset / offset times (clipped to start / end), or None
+        """
+        if song_id is not None:
+            notes = self.get_catalog().get_notes(song_id)
+            return window_segments(notes[:, :2], start, end) if len(notes) else None
+        if Path(reference_path).suffix.lower() not in ['.mid', '.midi']:
+            return None
+        return window_segments(self.get_reference_notes(reference_path)[:, :2], start, end)
+    
+    def result_key(self, user_audio: AudioSource, reference_path: Optional[str] = None,
+                   song_id: Optional[str] = None, sample_rate: Optional[int] = None,
+                   dtype: str = 'float32', **params) -> Tuple:
+        """
+        Result cache key: user audio content hash, reference identity, scoring parameters.
+        
+        The reference is identified by path, modification time and size, or by song ID
+        and the catalog file's state. Session settings that change the score are included.
+        """
+        if song_id is not None:
+            stat = os.stat(self.catalog_path)
+            reference = ('song', song_id, os.path.abspath(self.catalog_path), stat.st_mtime_ns, stat.st_size)
+        else:
+            stat = os.stat(reference_path)
+            reference = ('file', os.path.abspath(reference_path), stat.st_mtime_ns, stat.st_size)
+        method = params.pop('method', None) or self.method
+        settings = (method, self.model_capacity, self.normalize_audio, self.midi_track_filter,
+                    self.precision, self.voiced_only, tuple(sorted(self._extraction_kwargs(method).items())))
+        return (fingerprint_audio(user_audio, sample_rate, dtype), reference, settings,
+                tuple(sorted(params.items())))
+    
+    def result_cache_stats(self) -> Dict:
+        """Result cache counters (hits, misses, expired, evictions, size), empty if disabled."""
+        return self.result_cache.stats() if self.result_cache is not None else {}
+    
+    def clear_cache(self):
+        """Drop all cached reference contours, scoring results and in-memory activations."""
+        with self._lock:
+            self._reference_cache.clear()
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if self.activation_cache is not None:
+            self.activation_cache.clear()
+    
+    def close(self):
+        """Release the reference catalog mapping (reopened on next use)."""
+        with self._lock:
+            if self._catalog is not None:
+                self._catalog.close()
+                self._catalog = None
+    
+    def score(self,
+              user_audio_path: AudioSource,
+              reference_path: Optional[str] = None,
+              method: Optional[str] = None,
+              tolerance_cents: Optional[float] = None,
+              difficulty_mode: Optional[str] = None,
+              include_advice: bool = False,
+              sample_rate: Optional[int] = None,
+              dtype: str = 'float32',
+              contour_output_path: Optional[str] = None,
+              include_timings: bool = False,
+              profile_memory: bool = False,
+              song_id: Optional[str] = None,
+              cancel_token: Optional[CancellationToken] = None,
+              progress: Optional[ProgressCallback] = None,
+              scoring_mode: str = 'frames',
+              start: Optional[float] = None,
+              end: Optional[float] = None) -> Dict:
+        """
+        Score a user recording against a reference.
+        
+        Args:
+            user_audio_path: Path to the user's audio file, or in-memory PCM
+                             (NumPy array, bytes, memoryview) together with sample_rate.
+            reference_path (str): Path to the reference audio or MIDI file. May be
+                                  omitted when song_id is given.
+            method (str): Override the session's extraction method.
+            tolerance_cents (float): Override the session's tolerance.
+            difficulty_mode (str): Override the session's difficulty.
+            include_advice (bool): Add PitchAdvisor output under "advice".
+            sample_rate (int): Sample rate of in-memory PCM.
+            dtype (str): Sample type of raw PCM buffers. Default: 'float32'
+            contour_output_path (str): If set, also write the aligned contours and
+                                       per-frame deviation as a binary KSPC file
+                                       (see contour_export). The JSON only gets
+                                       "contours_path" and "contours_frames".
+            include_timings (bool): Add per-stage timings under "timings" as
+                                    {stage: {"seconds", "frames", "calls"}}; nested
+                                    stages are dotted (e.g. "extract_user.crepe_inference").
+                                    Hooks registered with instrumentation.add_timing_hook
+                                    are called either way.
+            profile_memory (bool): Implies include_timings and adds a "memory" entry per
+                                   stage: tracemalloc "peak_bytes" / "retained_bytes"
+                                   relative to the stage start, plus sampled process
+                                   "peak_rss_bytes" and "rss_delta_bytes". Slow; profile
+                                   one score at a time since both sources are process-wide.
+            song_id (str): Take the reference contour from the session's catalog
+                           instead of extracting it from reference_path.
+            cancel_token (CancellationToken): Cancel from another thread; checked between
+                                              CREPE batches and periodically inside DTW.
+                                              A cancelled score returns the error payload
+                                              with "cancelled": true.
+            progress (callable): progress(stage, fraction) with top-level stages
+                                 ("extract_user", "reference", "match", "advice") and
+                                 dotted extractor stages ("extract_user.crepe_inference").
+            scoring_mode (str): 'frames' (default): align the contours and score every
+                                grid frame with DTW. 'notes': score the singer per
+                                reference note (see PitchMatcher.score_notes); results
+                                have no DTW fields but list every note under "notes".
+            start, end (float): Score only this span of the song (seconds; None = from the
+                                beginning / to the end). Both recordings must start at the
+                                song's beginning. Only the span plus a small margin is
+                                decoded and analysed, so latency scales with its length.
+        
+        Successful results are kept in the session's result cache; re-submitting the
+        same audio content with the same reference and parameters returns a copy of
+        the stored result with "cached": true. Requests asking for timings or a
+        contour file always run the pipeline.
+        
+        Returns:
+            dict: Scoring results, or the error payload ({"error": ..., "final_score": 0, ...}).
+        """
+        tolerance_cents = tolerance_cents if tolerance_cents is not None else self.tolerance_cents
+        started = time.perf_counter()
+        collecting = include_timings or profile_memory
+        cache_key = None
+        error_type = None
+        with (collect_timings(profile_memory) if collecting else nullcontext()) as timings:
+            try:
+                # Validate both paths before paying for any extraction
+                if is_audio_path(user_audio_path) and not os.path.exists(user_audio_path):
+                    raise FileNotFoundError(f"User audio file not found: {user_audio_path}")
+                if song_id is None:
+                    if not reference_path:
+                        raise ValueError("Either reference_path or song_id is required")
+                    if not os.path.exists(reference_path):
+                        raise FileNotFoundError(f"Reference file not found: {reference_path}")
+                elif song_id not in self.get_catalog():
+                    raise ValueError(f"Song not found in catalog: {song_id}")
+                if scoring_mode not in ('frames', 'notes'):
+                    raise ValueError(f"Invalid scoring_mode: {scoring_mode}. Use 'frames' or 'notes'")
+                if (start is not None and start < 0) or (end is not None and end <= (start or 0.0)):
+                    raise ValueError(f"Invalid scoring window: start={start}, end={end}")
+                check_cancelled(cancel_token)
+                
+                if self.result_cache is not None and not (collecting or contour_output_path):
+                    key = self.result_key(user_audio_path, reference_path, song_id,
+                                          sample_rate=sample_rate, dtype=dtype, method=method,
+                                          tolerance_cents=tolerance_cents,
+                                          difficulty_mode=difficulty_mode or self.difficulty_mode,
+                                          include_advice=include_advice, scoring_mode=scoring_mode,
+                                          start=start, end=end)
+                    cached = self.result_cache.lookup(key, cancel_token)
+                    if cached is not None:
+                        for step in ('extract_user', 'reference', 'match'):
+                            report_progress(progress, step, 1.0)
+                        cached['cached'] = True
+                        record_score(time.perf_counter() - started, scoring_mode, cached=True)
+                        return cached
+                    cache_key = key  # this call owns the computation from here on
+                
+                with stage('extract_user') as record:
+                    time_user, freq_user = self.extract_user(user_audio_path, method,
+                                                             sample_rate=sample_rate, dtype=dtype,
+                                                             cancel_token=cancel_token,
+                                                             progress=_sub_progress(progress, 'extract_user'),
+                                                             start=start, end=end)
+                    record.frames = len(time_user)
+                report_progress(progress, 'extract_user', 1.0)
+                with stage('reference') as record:
+                    if song_id is not None:
+                        time_ref, freq_ref = window_contour(*self.get_catalog_contour(song_id), start, end)
+                        if len(time_ref) == 0:
+                            raise ValueError(f"No pitch stored between {start} and {end} s for song: {song_id}")
+                    else:
+                        time_ref, freq_ref = self.get_reference_contour(
+                            reference_path, method, cancel_token=cancel_token,
+                            progress=_sub_progress(progress, 'reference'), start=start, end=end)
+                    record.frames = len(time_ref)
+                    reference_segments = None
+                    if self.voiced_only:
+                        reference_segments = self.get_reference_segments(reference_path, song_id, start, end)
+                    if scoring_mode == 'notes':
+                        reference_notes = self.get_reference_notes(reference_path, song_id, method,
+                                                                   start=start, end=end)
+                report_progress(progress, 'reference', 1.0)
+                
+                with stage('match'):
+                    matcher = self.get_matcher(tolerance_cents, difficulty_mode)
+                    if scoring_mode == 'notes':
+                        results = matcher.score_notes(time_user, freq_user, reference_notes,
+                                                      cancel_token=cancel_token)
+                    # Advice reuses this alignment instead of aligning the contours again
+                    if scoring_mode == 'frames' or contour_output_path or include_advice:
+                        aligned_time, cents_user, cents_ref = matcher.align_cents(time_user, freq_user,
+                                                                                  time_ref, freq_ref,
+                                                                                  CONTOUR_GRID_RATE,
+                                                                                  cancel_token=cancel_token,
+                                                                                  reference_segments=reference_segments)
+                    if scoring_mode == 'frames':
+                        results = matcher.score_aligned(aligned_time, cents_user, cents_ref,
+                                                        cancel_token=cancel_token)
+                report_progress(progress, 'match', 1.0)
+                
+                if contour_output_path:
+                    with stage('export_contours', frames=len(aligned_time)):
+                        results['contours_path'] = contour_output_path
+                        results['contours_frames'] = write_contours(contour_output_path, aligned_time,
+                                                                    cents_user, cents_ref,
+                                                                    CONTOUR_GRID_RATE)
+                
+                if include_advice:
+                    check_cancelled(cancel_token)
+                    with stage('advice'):
+                        advisor = PitchAdvisor(tolerance_cents=tolerance_cents, precision=self.precision,
+                                               voiced_only=self.voiced_only)
+                        results['advice'] = advisor.analyze_aligned(aligned_time, cents_user, cents_ref)
+                    report_progress(progress, 'advice', 1.0)
+                
+                # Ensure no error field in success case
+                results.pop('error', None)
+                if cache_key is not None:
+                    self.result_cache.store(cache_key, results)
+            except ScoringCancelled as e:
+                results = build_error_result(e)
+                results['cancelled'] = True
+                error_type = type(e).__name__
+            except Exception as e:
+                results = build_error_result(e)
+                error_type = type(e).__name__
+            finally:
+                if cache_key is not None:
+                    self.result_cache.release(cache_key)
+        
+        record_score(time.perf_counter() - started, scoring_mode, error_type)
+        if timings is not None:
+            results['timings'] = timings.as_dict()
+            results['timings']['total'] = {'seconds': time.perf_counter() - started,
+                                           'frames': None, 'calls': 1}
+        return results
+    
+    def score_json(self, *args, **kwargs) -> str:
+        """Same as score() but returns the JSON string used by the C++ wrapper."""
+        return json.dumps(self.score(*args, **kwargs), indent=2, ensure_ascii=False)
+
+
+def _sub_progress(progress: Optional[ProgressCallback], parent: str) -> Optional[ProgressCallback]:
+    """Prefix nested progress reports with the parent stage (like instrumentation stages)."""
+    if progress is None:
+        return None
+    return lambda name, fraction: progress(f'{parent}.{name}', fraction)
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+_metrics_exporter = None
+
+
+def get_default_session() -> KaraokeSession:
+    """
+    Return the process-wide session used by score_karaoke_and_get_json.
+    
+    If the KARAOKE_METRICS_FILE environment variable is set, the process metrics
+    are also written to that file periodically (Prometheus text format).
+    """
+    global _default_session, _metrics_exporter
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = KaraokeSession(catalog_path=os.environ.get('KARAOKE_CATALOG'))
+            if os.environ.get('KARAOKE_METRICS_FILE') and _metrics_exporter is None:
+                _metrics_exporter = FileExporter(os.environ['KARAOKE_METRICS_FILE']).start()
+        return _default_session
+
+
+def get_metrics_text() -> str:
+    """
+    Return the process metrics in Prometheus text format.
+    
+    Covers scores served, errors by type, cache hits / misses, per-stage and
+    end-to-end latency histograms, queue depth and model load time (see metrics.py).
+    Called by KaraokeScorer::getMetrics() on the C++ side.
+    """
+    return REGISTRY.render()
+
 
 def score_karaoke_and_get_json(user_audio_path: str, 
-                               reference_path: str, 
+                               reference_path: Optional[str] = None, 
                                method: str = 'crepe', 
                                tolerance_cents: float = 200.0,
-                               difficulty_mode: str = 'easy') -> str:
+                               difficulty_mode: str = 'easy',
+                               include_advice: bool = False,
+                               contour_output_path: Optional[str] = None,
+                               include_timings: bool = False,
+                               profile_memory: bool = False,
+                               song_id: Optional[str] = None,
+                               scoring_mode: str = 'frames',
+                               start: Optional[float] = None,
+                               end: Optional[float] = None) -> str:
     """
     Encapsulates the entire karaoke scoring pipeline and returns the results as a JSON string.
     This function is intended to be called from a C-compatible interface (e.g., C++ embedding Python).
+    It is a thin wrapper around the process-wide KaraokeSession, so models and reference
+    contours stay warm between calls.
     
     Args:
         user_audio_path (str): Path to the user's audio file (WAV, MP3, FLAC, etc.)
         reference_path (str): Path to the reference audio file (WAV, MP3, FLAC, or MIDI).
+                              May be empty/None when song_id is given.
         method (str): Pitch extraction method ('crepe' or 'basic_pitch'). Default: 'crepe'
         tolerance_cents (float): Tolerance in cents for pitch matching. Default: 200.0 (easy mode)
         difficulty_mode (str): Difficulty mode ('easy', 'normal', 'hard'). Default: 'easy'
+        include_advice (bool): Also run PitchAdvisor and add its output under "advice",
+                               including timestamped "problem_regions". Default: False
+        contour_output_path (str): Also write the contours as a binary KSPC file at this
+                                   path; the C++ side can map it with mapContours().
+        include_timings (bool): Add per-stage timings under "timings". Default: False
+        profile_memory (bool): Also add per-stage peak/retained memory to "timings". Default: False
+        song_id (str): Score against the precomputed contour of this song in the reference
+                       catalog (path taken from the KARAOKE_CATALOG environment variable),
+                       so no reference audio is decoded.
+        scoring_mode (str): 'frames' (default) or 'notes' for per-note scoring, which adds
+                            the per-note results under "notes". Default: 'frames'
+        start (float): Score only from this time in the song (seconds). Default: None
+        end (float): Score only up to this time in the song (seconds). Only the
+                     [start, end] span of both recordings is decoded. Default: None
     
     Returns:
         str: JSON string containing the scoring results or error message.
              Success format: {"final_score": ..., "accuracy": ..., ...}
              Error format: {"error": "...", "final_score": 0, "accuracy": 0, "dtw_score": 0}
     """
-    results = {}
-    try:
-        # 1. Validate file paths
-        if not os.path.exists(user_audio_path):
-            raise FileNotFoundError(f"User audio file not found: {user_audio_path}")
-        if not os.path.exists(reference_path):
-            raise FileNotFoundError(f"Reference file not found: {reference_path}")
+    return get_default_session().score_json(user_audio_path, reference_path,
+                                            method=method,
+                                            tolerance_cents=tolerance_cents,
+                                            difficulty_mode=difficulty_mode,
+                                            include_advice=include_advice,
+                                            contour_output_path=contour_output_path,
+                                            include_timings=include_timings,
+                                            profile_memory=profile_memory,
+                                            song_id=song_id,
+                                            scoring_mode=scoring_mode,
+                                            start=start,
+                                            end=end)
+
+
+def score_karaoke_pcm_and_get_json(user_pcm,
+                                   sample_rate: int,
+                                   reference_path: str,
+                                   method: str = 'crepe',
+                                   tolerance_cents: float = 200.0,
+                                   difficulty_mode: str = 'easy',
+                                   dtype: str = 'float32',
+                                   include_advice: bool = False,
+                                   include_timings: bool = False,
+                                   profile_memory: bool = False,
+                                   start: Optional[float] = None,
+                                   end: Optional[float] = None) -> str:
+    """
+    Same as score_karaoke_and_get_json, but the user recording is passed as in-memory PCM.
+    
+    The buffer is wrapped without copying (np.frombuffer), so the C++ wrapper can hand
+    over a memoryview of its own float array. The caller must keep the memory alive
+    for the duration of the call.
+    
+    Args:
+        user_pcm: NumPy array, bytes, memoryview or any buffer-protocol object (mono, or
+                  interleaved as a 2-D (samples, channels) NumPy array).
+        sample_rate (int): Sample rate of user_pcm in Hz.
+        reference_path (str): Path to the reference audio file (WAV, MP3, FLAC, or MIDI).
+        method (str): Pitch extraction method ('crepe' or 'basic_pitch'). Default: 'crepe'
+        tolerance_cents (float): Tolerance in cents for pitch matching. Default: 200.0
+        difficulty_mode (str): Difficulty mode ('easy', 'normal', 'hard'). Default: 'easy'
+        dtype (str): Sample type of raw buffers ('float32', 'float64', 'int16', 'int32'). Default: 'float32'
+        include_advice (bool): Also add PitchAdvisor output under "advice". Default: False
+        include_timings (bool): Add per-stage timings under "timings". Default: False
+        profile_memory (bool): Also add per-stage peak/retained memory to "timings". Default: False
+        start, end (float): Score only this span of the song (seconds); only that part of
+                            user_pcm is converted. Default: None
+    
+    Returns:
+        str: JSON string with the same schema as score_karaoke_and_get_json.
+    """
+    return get_default_session().score_json(user_pcm, reference_path,
+                                            method=method,
+                                            tolerance_cents=tolerance_cents,
+                                            difficulty_mode=difficulty_mode,
+                                            include_advice=include_advice,
+                                            include_timings=include_timings,
+                                            profile_memory=profile_memory,
+                                            sample_rate=sample_rate,
+                                            dtype=dtype,
+                                            start=start,
+                                            end=end)
+
+
+class AsyncKaraokeSession:
+    """
+    Asyncio front-end for KaraokeSession.
+    
+    Extraction and matching run on an executor so slow inference never blocks the
+    event loop. A semaphore bounds how many scores run at once; callers beyond the
+    limit wait in line, and the time spent waiting is reported separately from the
+    compute time ("queue_wait_s" / "compute_s" in the result).
+    
+    Cancelling the awaiting task (or hitting the timeout) returns control to the
+    caller immediately and cancels the request's CancellationToken, so the worker
+    thread stops at its next check (between inference batches / DTW blocks). The
+    concurrency slot is only given back once the worker has actually stopped.
+    """
+    
+    def __init__(self,
+                 session: Optional[KaraokeSession] = None,
+                 executor: Optional[Executor] = None,
+                 max_concurrency: int = 2,
+                 timeout: Optional[float] = None):
+        """
+        Args:
+            session (KaraokeSession): Session to run on. Default: a new KaraokeSession()
+            executor (Executor): Thread-based executor for the blocking work (e.g. a shared
+                                 ThreadPoolExecutor). Process pools are rejected: the bound
+                                 session.score and its CancellationToken cannot be pickled;
+                                 use KaraokeWorkerPool for process workers. Default: a private
+                                 ThreadPoolExecutor with max_concurrency threads
+            max_concurrency (int): Maximum number of scores computed at the same time. Default: 2
+            timeout (float): Default timeout in seconds for a whole request (queue + compute).
+                             None = no timeout
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be >= 1")
+        if isinstance(executor, ProcessPoolExecutor):
+            raise TypeError("AsyncKaraokeSession needs a thread executor; ProcessPoolExecutor cannot "
+                            "pickle the session or its CancellationToken (use KaraokeWorkerPool instead)")
+        self.session = session or KaraokeSession()
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_concurrency,
+                                                        thread_name_prefix='karaoke-score')
+        self._loop = None
+        self._semaphore = None
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semaphore bound to the running event loop (recreated if the loop changes)."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+    
+    async def score(self, user_audio_path: AudioSource, reference_path: Optional[str] = None,
+                    timeout: Optional[float] = None, **kwargs) -> Dict:
+        """
+        Score without blocking the event loop.
         
-        # 2. Initialize PitchExtractor
-        extractor = PitchExtractor(method=method, model_capacity='tiny')
+        Args:
+            user_audio_path: Path or in-memory PCM, as for KaraokeSession.score.
+            reference_path (str): Path to the reference audio or MIDI file (or pass song_id).
+            timeout (float): Override the default timeout for this request.
+            **kwargs: Passed to KaraokeSession.score (method, tolerance_cents, ...).
+                      A cancel_token is created per request unless one is given.
         
-        # 3. Extract pitch from user's audio
-        time_user, freq_user = extractor.extract_pitch(user_audio_path)
-        if len(time_user) == 0 or len(freq_user) == 0:
-            raise ValueError(f"No pitch detected in user audio: {user_audio_path}")
+        Returns:
+            dict: KaraokeSession.score result plus "queue_wait_s" and "compute_s".
         
-        # 4. Extract pitch from reference (audio or MIDI)
-        ref_ext = Path(reference_path).suffix.lower()
-        if ref_ext in ['.mid', '.midi']:
-            # MIDI reference
-            time_ref, freq_ref = extractor.extract_pitch_from_midi(reference_path, track_filter='auto')
-        else:
-            # Audio reference
-            time_ref, freq_ref = extractor.extract_pitch(reference_path)
+        Raises:
+            asyncio.TimeoutError: The request did not finish within the timeout.
+            asyncio.CancelledError: The awaiting task was cancelled.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        coro = self._score(user_audio_path, reference_path, kwargs)
+        if timeout is None:
+            return await coro
+        return await asyncio.wait_for(coro, timeout)
+    
+    async def score_json(self, *args, **kwargs) -> str:
+        """Same as score() but returns a JSON string."""
+        return json.dumps(await self.score(*args, **kwargs), indent=2, ensure_ascii=False)
+    
+    async def _score(self, user_audio_path, reference_path, kwargs: Dict) -> Dict:
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
         
-        if len(time_ref) == 0 or len(freq_ref) == 0:
-            raise ValueError(f"No pitch detected in reference: {reference_path}")
+        queued_at = time.monotonic()
+        REGISTRY.inc('karaoke_queue_depth', 1, queue='async_session')
+        try:
+            await semaphore.acquire()
+        finally:
+            REGISTRY.inc('karaoke_queue_depth', -1, queue='async_session')
+        started_at = time.monotonic()
+        REGISTRY.observe('karaoke_queue_wait_seconds', started_at - queued_at, queue='async_session')
         
-        # 5. Match pitches and calculate score
-        matcher = PitchMatcher(tolerance_cents=tolerance_cents, difficulty_mode=difficulty_mode)
-        results = matcher.calculate_score(time_user, freq_user, time_ref, freq_ref)
+        # One token per request: a timeout / cancellation stops the CPU work too
+        token = kwargs.pop('cancel_token', None) or CancellationToken()
+        future = loop.run_in_executor(
+            self._executor,
+            functools.partial(self.session.score, user_audio_path, reference_path,
+                              cancel_token=token, **kwargs))
+        try:
+            # shield: cancelling the caller must not mark the executor job as done
+            # while it is still running, otherwise the slot would be freed too early
+            results = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            token.cancel()
+            future.add_done_callback(lambda _: semaphore.release())
+            raise
+        semaphore.release()
         
-        # 6. Ensure no error field in success case
-        if 'error' in results:
-            del results['error']
+        results = dict(results)
+        results['queue_wait_s'] = round(started_at - queued_at, 4)
+        results['compute_s'] = round(time.monotonic() - started_at, 4)
+        return results
+    
+    def close(self):
+        """Shut down the private executor (a caller-supplied executor is left alone)."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_default_async_session = None
+
+
+def get_default_async_session() -> AsyncKaraokeSession:
+    """Return the process-wide AsyncKaraokeSession (wraps the default KaraokeSession)."""
+    global _default_async_session
+    session = get_default_session()
+    with _default_session_lock:
+        if _default_async_session is None:
+            _default_async_session = AsyncKaraokeSession(session=session)
+        return _default_async_session
+
+
+async def score_karaoke_async(user_audio_path: AudioSource,
+                              reference_path: str,
+                              method: str = 'crepe',
+                              tolerance_cents: float = 200.0,
+                              difficulty_mode: str = 'easy',
+                              include_advice: bool = False,
+                              sample_rate: Optional[int] = None,
+                              dtype: str = 'float32',
+                              timeout: Optional[float] = None) -> Dict:
+    """
+    Asyncio counterpart of score_karaoke_and_get_json that returns a dict.
+    
+    Runs on the process-wide AsyncKaraokeSession, so concurrent calls share its
+    concurrency limit and warm models. See AsyncKaraokeSession.score for the
+    timeout / cancellation behaviour.
+    
+    Returns:
+        dict: Scoring results plus "queue_wait_s" and "compute_s".
+    """
+    return await get_default_async_session().score(user_audio_path, reference_path,
+                                                   timeout=timeout,
+                                                   method=method,
+                                                   tolerance_cents=tolerance_cents,
+                                                   difficulty_mode=difficulty_mode,
+                                                   include_advice=include_advice,
+                                                   sample_rate=sample_rate,
+                                                   dtype=dtype)
+
+
+# Byte alignment of each array inside a shared reference block
+_SHM_ALIGN = 64
+
+
+class SharedReferenceBlock:
+    """
+    Reference contours and notes packed into one shared-memory block.
+    
+    Created by the parent process. Workers attach by name and read the arrays in
+    place as read-only views, so a hot reference is neither copied nor pickled per job.
+    """
+    
+    def __init__(self, entries):
+        """
+        Args:
+            entries: Iterable of (reference cache key, ndarray or tuple of ndarrays)
+        """
+        placed = []
+        self.layout = []
+        size = 0
+        for key, value in entries:
+            fields = []
+            for array in (value if isinstance(value, tuple) else (value,)):
+                array = np.ascontiguousarray(array)
+                size = -(-size // _SHM_ALIGN) * _SHM_ALIGN
+                fields.append((size, array.shape, array.dtype.str))
+                placed.append((size, array))
+                size += array.nbytes
+            self.layout.append((key, isinstance(value, tuple), tuple(fields)))
+        
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for offset, array in placed:
+            np.ndarray(array.shape, array.dtype, buffer=self.shm.buf, offset=offset)[...] = array
+        self.name = self.shm.name
+        self.nbytes = size
+    
+    @staticmethod
+    def view(buffer, is_tuple: bool, fields):
+        """Rebuild one entry as read-only arrays over the block's buffer."""
+        arrays = []
+        for offset, shape, dtype in fields:
+            array = np.ndarray(shape, np.dtype(dtype), buffer=buffer, offset=offset)
+            array.setflags(write=False)
+            arrays.append(array)
+        return tuple(arrays) if is_tuple else arrays[0]
+    
+    def close(self):
+        """Unmap and free the block (workers must have stopped using it)."""
+        self.shm.close()
+        self.shm.unlink()
+
 
+class _SharedPCM(NamedTuple):
+    """User PCM handed to a pool worker through a per-job shared-memory block."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    is_array: bool
+    
+    @classmethod
+    def create(cls, user_audio) -> Tuple[shared_memory.SharedMemory, '_SharedPCM']:
+        is_array = isinstance(user_audio, np.ndarray)
+        array = np.ascontiguousarray(user_audio if is_array else np.frombuffer(user_audio, dtype=np.uint8))
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        return shm, cls(shm.name, array.shape, array.dtype.str, is_array)
+    
+    def view(self, buffer):
+        array = np.ndarray(self.shape, np.dtype(self.dtype), buffer=buffer)
+        return array if self.is_array else memoryview(array)
+
+
+# State of a KaraokeWorkerPool worker process (set up by _init_pool_worker)
+_pool_session = None
+_pool_blocks = {}
+# Reference slot (key without the file's mtime / size) -> (installed key, block name)
+_pool_slots = {}
+
+
+def _reference_slot(key: Tuple) -> Tuple:
+    """A shared reference key without the file stamp: a republished (edited) file keeps its slot."""
+    if key[0] == 'notes':
+        return ('notes',) + _reference_slot(key[1:])
+    return (key[0],) + key[3:]
+
+
+def _init_pool_worker(session_kwargs: Dict):
+    """Worker initializer: build the session and load the pitch model once."""
+    global _pool_session
+    # A forked worker inherits the parent's counters; start from zero so merging is exact
+    REGISTRY.reset()
+    _pool_blocks.clear()
+    _pool_slots.clear()
+    _pool_session = KaraokeSession(**session_kwargs)
+    try:
+        _pool_session.warm_up()
     except Exception as e:
-        # Return consistent error format
-        results = {
-            'error': str(e),
-            'final_score': 0.0,
-            'accuracy': 0.0,
-            'dtw_score': 0.0,
-            'dtw_distance': 0.0,
-            'mae_cents': 0.0,
-            'duration': 0.0
-        }
-
-    return json.dumps(results, indent=2, ensure_ascii=False)
+        # MIDI references still work; extraction errors are reported per job
+        print(f"⚠️ Worker {os.getpid()} could not load the pitch model: {e}")
+
+
+def _pool_ping() -> Dict:
+    """Empty job used to start every worker up front; returns its model-load metrics."""
+    return REGISTRY.take()
+
+
+def _pool_extract_reference(reference_path: str, method: Optional[str]):
+    """Extract a reference contour and its notes for the parent to publish."""
+    key = _pool_session.reference_key(reference_path, method)
+    contour = _pool_session.get_reference_contour(reference_path, method)
+    notes = _pool_session.get_reference_notes(reference_path, method=method)
+    return [(key, contour), (('notes',) + key, notes)], REGISTRY.take()
+
+
+def _pool_release_reference(key: Tuple, name: str):
+    """Drop a replaced reference view; unmap its block once no installed reference uses it."""
+    with _pool_session._lock:
+        _pool_session._shared_references.pop(key, None)
+    if all(block_name != name for _, block_name in _pool_slots.values()):
+        block = _pool_blocks.pop(name, None)
+        if block is not None:
+            try:
+                block.close()
+            except BufferError:
+                # A view is still referenced; the mapping is released when it is collected
+                pass
+
+
+def _pool_score(user_audio, reference_path: Optional[str], kwargs: Dict, shared):
+    """Score in a worker, reading references from shared memory; returns (results, metrics)."""
+    for name, (key, is_tuple, fields) in shared:
+        if key in _pool_session._shared_references:
+            continue
+        block = _pool_blocks.get(name)
+        if block is None:
+            block = _pool_blocks[name] = shared_memory.SharedMemory(name=name)
+        _pool_session._shared_references[key] = SharedReferenceBlock.view(block.buf, is_tuple, fields)
+        # A republished reference replaces the old version of the same file
+        previous = _pool_slots.get(_reference_slot(key))
+        _pool_slots[_reference_slot(key)] = (key, name)
+        if previous is not None:
+            _pool_release_reference(*previous)
+    
+    pcm = None
+    if isinstance(user_audio, _SharedPCM):
+        pcm = shared_memory.SharedMemory(name=user_audio.name)
+        user_audio = user_audio.view(pcm.buf)
+    try:
+        results = _pool_session.score(user_audio, reference_path, **kwargs)
+    finally:
+        if pcm is not None:
+            user_audio = None
+            try:
+                pcm.close()
+            except BufferError:
+                # A view outlived the job; the mapping is released when it is collected
+                pass
+    return results, REGISTRY.take()
+
+
+def _pool_start_method() -> str:
+    """'fork' where available, unless TensorFlow is already loaded in this process."""
+    if 'fork' in multiprocessing.get_all_start_methods() and 'tensorflow' not in sys.modules:
+        return 'fork'
+    return 'spawn'
+
+
+class _PoolJob(Future):
+    """Future for a pool job; cancelling succeeds only while the job is still queued."""
+    
+    def __init__(self, job: Future, pcm: Optional[shared_memory.SharedMemory]):
+        super().__init__()
+        self._job = job
+        self._pcm = pcm
+        job.add_done_callback(self._finish)
+    
+    def cancel(self) -> bool:
+        return self._job.cancel() and super().cancel()
+    
+    def _finish(self, job: Future):
+        if self._pcm is not None:
+            self._pcm.close()
+            self._pcm.unlink()
+        try:
+            if job.cancelled():
+                super().cancel()
+            elif job.exception() is not None:
+                self.set_exception(job.exception())
+            else:
+                results, snapshot = job.result()
+                REGISTRY.merge(snapshot)
+                self.set_result(results)
+        except InvalidStateError:
+            pass
+
+
+class KaraokeWorkerPool:
+    """
+    Pool of pre-started scoring processes that share hot reference contours.
+    
+    Every worker is started once and loads its pitch model up front. Reference
+    contours and notes are extracted once for the whole pool and held by the parent
+    in shared memory; workers map the same pages read-only instead of re-extracting
+    or unpickling them. A job carries only the user audio path (or the name of a
+    shared-memory block holding its PCM), the reference path and the parameters.
+    
+    Workers are forked from the parent where the platform allows, sharing its
+    imported modules. Unlike a fork-after-warm-up design, the parent never loads a
+    model itself: TensorFlow is not safe to fork once initialised, so each worker
+    loads (warms) its own model right after the fork, during start(). What is shared
+    copy-free is the reference data, not the model weights.
+    
+    Example:
+        with KaraokeWorkerPool(workers=4, references=['songs/a.mid']) as pool:
+            results = pool.score('take.wav', 'songs/a.mid')
+    """
+    
+    def __init__(self, workers: int = 2, references=(), start_method: Optional[str] = None,
+                 **session_kwargs):
+        """
+        Args:
+            workers (int): Number of worker processes. Default: 2
+            references: Reference paths published to shared memory on start()
+            start_method (str): multiprocessing start method. Default: 'fork' where
+                                available and TensorFlow is not loaded, else 'spawn'
+            **session_kwargs: KaraokeSession settings for every worker
+                              (method, model_capacity, catalog_path, ...)
+        """
+        self.workers = workers
+        self.references = list(references)
+        self.start_method = start_method or _pool_start_method()
+        self.session_kwargs = session_kwargs
+        
+        # Used only to compute reference cache keys; never loads a model
+        self._session = KaraokeSession(**session_kwargs)
+        self._executor = None
+        self._blocks = []
+        self._shared = {}
+        self._lock = threading.Lock()
+    
+    def start(self) -> 'KaraokeWorkerPool':
+        """Start the workers (models loaded) and publish the initial references."""
+        if self._executor is None:
+            # Workers share the parent's resource tracker, which frees the blocks if it dies
+            resource_tracker.ensure_running()
+            context = multiprocessing.get_context(self.start_method)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                 initializer=_init_pool_worker,
+                                                 initargs=(self.session_kwargs,))
+            for future in [self._executor.submit(_pool_ping) for _ in range(self.workers)]:
+                REGISTRY.merge(future.result())
+            if self.references:
+                self.preload_references(self.references)
+        return self
+    
+    def preload_references(self, reference_paths, method: Optional[str] = None) -> int:
+        """
+        Extract references on the workers (in parallel) and publish them in shared memory.
+        
+        References already shared and unchanged on disk are skipped; an edited file
+        gets a new cache key and is published again.
+        
+        Returns:
+            Number of references published
+        """
+        if self._executor is None:
+            raise RuntimeError('Worker pool is not running')
+        with self._lock:
+            paths = [path for path in dict.fromkeys(reference_paths)
+                     if self._session.reference_key(path, method) not in self._shared]
+        
+        entries = []
+        for future in [self._executor.submit(_pool_extract_reference, path, method) for path in paths]:
+            extracted, snapshot = future.result()
+            REGISTRY.merge(snapshot)
+            entries.extend(extracted)
+        if entries:
+            block = SharedReferenceBlock(entries)
+            with self._lock:
+                self._blocks.append(block)
+                for entry in block.layout:
+                    # Forget the previous version of a republished file (its block stays mapped
+                    # until close(), since queued jobs may still refer to it)
+                    slot = _reference_slot(entry[0])
+                    for stale in [key for key in self._shared if _reference_slot(key) == slot]:
+                        del self._shared[stale]
+                    self._shared[entry[0]] = (block.name, entry)
+        return len(paths)
+    
+    def _shared_entries(self, reference_path: Optional[str], method: Optional[str]) -> Tuple:
+        """Shared-memory entries a job needs: the reference's contour and notes, if published."""
+        if reference_path is None or not os.path.exists(reference_path):
+            return ()
+        key = self._session.reference_key(reference_path, method)
+        with self._lock:
+            return tuple(self._shared[k] for k in (key, ('notes',) + key) if k in self._shared)
+    
+    def submit(self, user_audio: AudioSource, reference_path: Optional[str] = None, **kwargs) -> Future:
+        """
+        Queue a score on the pool.
+        
+        Args:
+            user_audio: Path to the user's audio, or in-memory PCM (copied once into
+                        shared memory rather than pickled)
+            reference_path: Reference file (or None with song_id=...)
+            **kwargs: KaraokeSession.score parameters (no cancel_token / progress)
+        
+        Returns:
+            Future resolving to the scoring results dict
+        """
+        if self._executor is None:
+            raise RuntimeError('Worker pool is not running')
+        shared = self._shared_entries(reference_path, kwargs.get('method'))
+        pcm = None
+        if not is_audio_path(user_audio):
+            pcm, user_audio = _SharedPCM.create(user_audio)
+        try:
+            job = self._executor.submit(_pool_score, user_audio, reference_path, kwargs, shared)
+        except BaseException:
+            if pcm is not None:
+                pcm.close()
+                pcm.unlink()
+            raise
+        return _PoolJob(job, pcm)
+    
+    def score(self, user_audio: AudioSource, reference_path: Optional[str] = None,
+              timeout: Optional[float] = None, **kwargs) -> Dict:
+        """Score on the pool and wait for the result (see submit)."""
+        return self.submit(user_audio, reference_path, **kwargs).result(timeout=timeout)
+    
+    def stats(self) -> Dict:
+        """Worker count and the references held in shared memory."""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'start_method': self.start_method,
+                'shared_references': len(self._shared),
+                'shared_bytes': sum(block.nbytes for block in self._blocks),
+            }
+    
+    def close(self):
+        """Stop the workers, then free the shared references."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        with self._lock:
+            for block in self._blocks:
+                block.close()
+            self._blocks = []
+            self._shared.clear()
+        self._session.close()
+    
+    def __enter__(self) -> 'KaraokeWorkerPool':
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 if __name__ == '__main__':
     # Example usage for testing the function directly
@@ -110,5 +1464,7 @@ if __name__ == '__main__':
 # The C++ code will embed Python interpreter and call these functions directly
 
 # Export the main function for C++ to use
-__all__ = ['score_karaoke_and_get_json']
+__all__ = ['score_karaoke_and_get_json', 'score_karaoke_pcm_and_get_json', 'score_karaoke_async',
+           'KaraokeSession', 'AsyncKaraokeSession', 'KaraokeWorkerPool', 'get_default_session',
+           'get_default_async_session']
 
@@ -0,0 +1,315 @@
+"""
+Chấm điểm trực tiếp (live): trích xuất pitch theo từng đoạn audio và tính điểm tạm thời
+
+Nguồn audio là một generator trả về các đoạn PCM mono 16kHz float32:
+    - simulate_realtime_feed: phát file có sẵn theo đúng nhịp thời gian thực (không cần
+      thiết bị âm thanh, dùng để thử chế độ live)
+    - pcm_stream_feed: đọc PCM thô từ stream (pipe, socket, FIFO...)
+
+StreamingPitchTracker giữ phần đuôi chưa đủ frame giữa các lần feed nên kết quả
+không phụ thuộc cách cắt đoạn. LiveScorer cộng dồn độ chính xác theo từng frame
+(cùng công thức graded của PitchMatcher) và tính điểm đầy đủ khi kết thúc.
+RingBuffer giữ một số điểm cố định cho phần hiển thị, nên bộ nhớ / CPU không
+tăng theo độ dài bài hát.
+
+Ví dụ:
+    extractor = PitchExtractor(method='crepe')
+    audio, _ = extractor.load_audio('user.wav', target_sr=LIVE_SAMPLE_RATE)
+    scorer = LiveScorer(time_ref, freq_ref, tolerance_cents=200.0)
+    results = run_live(simulate_realtime_feed(audio), StreamingPitchTracker(extractor), scorer)
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from cancellation import CancellationToken, check_cancelled
+from pitch_extractor import (CREPE_FRAME_LENGTH, CREPE_SAMPLE_RATE, PitchExtractor,
+                             pcm_to_float)
+from pitch_matcher import PitchMatcher
+
+LIVE_SAMPLE_RATE = CREPE_SAMPLE_RATE
+# Độ dài mỗi đoạn audio đưa vào tracker (giây)
+LIVE_CHUNK_SECONDS = 0.05
+
+
+class RingBuffer:
+    """
+    Bộ đệm vòng kích thước cố định cho các cặp (time, value)
+
+    Mỗi giá trị được ghi hai lần (ở i và i + capacity) nên phần dữ liệu theo thứ tự
+    cũ -> mới luôn là một đoạn liên tục, đọc ra không cần ghép mảng.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.capacity = capacity
+        self._time = np.full(2 * capacity, np.nan)
+        self._value = np.full(2 * capacity, np.nan)
+        self._head = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        """Thêm các điểm mới (chỉ giữ capacity điểm cuối)"""
+        times = np.asarray(times, dtype=np.float64)[-self.capacity:]
+        values = np.asarray(values, dtype=np.float64)[-self.capacity:]
+        with self._lock:
+            index = (self._head + np.arange(len(times))) % self.capacity
+            self._time[index] = times
+            self._time[index + self.capacity] = times
+            self._value[index] = values
+            self._value[index + self.capacity] = values
+            self._head = (self._head + len(times)) % self.capacity
+            self._size = min(self._size + len(times), self.capacity)
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Bản copy (time, value) theo thứ tự thời gian, tối đa capacity điểm"""
+        with self._lock:
+            start = self._head if self._size == self.capacity else 0
+            stop = start + self._size
+            return self._time[start:stop].copy(), self._value[start:stop].copy()
+
+    def clear(self):
+        with self._lock:
+            self._head = 0
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class StreamingPitchTracker:
+    """
+    Trích xuất pitch từ audio đến theo từng đoạn
+
+    method='crepe' dùng model CREPE của PitchExtractor (frame không pad, mỗi lần feed
+    chạy model trên các frame đã đủ dữ liệu). method='yin' dùng librosa.yin, không cần
+    TensorFlow, đủ nhẹ để chạy live trên máy yếu.
+    """
+
+    def __init__(self, extractor: Optional[PitchExtractor] = None, method: str = 'crepe',
+                 step_size: int = 50, confidence_threshold: float = 0.4,
+                 fmin: float = 65.0, fmax: float = 1000.0, silence_db: float = -45.0):
+        """
+        Args:
+            extractor: PitchExtractor dùng cho CREPE (mặc định: PitchExtractor('crepe'))
+            method: 'crepe' hoặc 'yin'
+            step_size: Khoảng cách giữa các frame (ms)
+            confidence_threshold: Ngưỡng confidence của CREPE
+            fmin, fmax: Dải tần tìm kiếm của YIN (Hz)
+            silence_db: Frame có RMS thấp hơn ngưỡng này (dBFS) bị coi là không có pitch (YIN)
+        """
+        if method not in ('crepe', 'yin'):
+            raise ValueError(f"Method không hợp lệ cho live: {method}. Chọn 'crepe' hoặc 'yin'")
+        if extractor is None and method == 'crepe':
+            extractor = PitchExtractor(method='crepe')
+        self.method = method
+        self.extractor = extractor
+        self.step_size = step_size
+        self.confidence_threshold = confidence_threshold
+        self.fmin = fmin
+        self.fmax = fmax
+        self.silence_db = silence_db
+        self.hop_length = int(LIVE_SAMPLE_RATE * step_size / 1000)
+        self.reset()
+
+    def reset(self):
+        """Bắt đầu stream mới"""
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._offset = 0  # Vị trí (sample) của _pending[0] trong stream
+
+    @property
+    def stream_time(self) -> float:
+        """Thời lượng audio đã nhận (giây)"""
+        return (self._offset + len(self._pending)) / LIVE_SAMPLE_RATE
+
+    def feed(self, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Đưa thêm một đoạn PCM 16kHz, trả về pitch của các frame mới đủ dữ liệu
+
+        Returns:
+            (time, frequency): Thời điểm tâm frame tính từ đầu stream (giây) và
+                               tần số (Hz, 0 = không có pitch)
+        """
+        buffer = np.concatenate((self._pending, np.asarray(samples, dtype=np.float32)))
+        if len(buffer) < CREPE_FRAME_LENGTH:
+            self._pending = buffer
+            return np.zeros(0), np.zeros(0)
+
+        n_frames = 1 + (len(buffer) - CREPE_FRAME_LENGTH) // self.hop_length
+        used = buffer[:(n_frames - 1) * self.hop_length + CREPE_FRAME_LENGTH]
+        if self.method == 'crepe':
+            activation = self.extractor._crepe_activation(used, self.step_size, center=False)
+            frequency, confidence = self.extractor._crepe_decode(activation)
+            frequency[confidence <= self.confidence_threshold] = 0.0
+        else:
+            frequency = self._yin(used, n_frames)
+
+        times = (self._offset + np.arange(n_frames) * self.hop_length
+                 + CREPE_FRAME_LENGTH / 2) / LIVE_SAMPLE_RATE
+        consumed = n_frames * self.hop_length
+        self._pending = buffer[consumed:].copy()
+        self._offset += consumed
+        return times, frequency
+
+    def _yin(self, audio: np.ndarray, n_frames: int) -> np.ndarray:
+        import librosa
+        frequency = librosa.yin(audio, fmin=self.fmin, fmax=self.fmax, sr=LIVE_SAMPLE_RATE,
+                                frame_length=CREPE_FRAME_LENGTH, hop_length=self.hop_length,
+                                center=False)[:n_frames].astype(np.float64)
+        frames = as_strided(audio, shape=(n_frames, CREPE_FRAME_LENGTH),
+                            strides=(self.hop_length * audio.itemsize, audio.itemsize))
+        rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+        with np.errstate(divide='ignore'):
+            silent = 20 * np.log10(rms) < self.silence_db
+        frequency[silent] = 0.0
+        return frequency
+
+
+class LiveScorer:
+    """Điểm tạm tính trong lúc hát và điểm đầy đủ khi kết thúc"""
+
+    def __init__(self, time_reference: np.ndarray, freq_reference: np.ndarray,
+                 tolerance_cents: float = 200.0, difficulty_mode: str = 'easy'):
+        self.matcher = PitchMatcher(tolerance_cents=tolerance_cents, difficulty_mode=difficulty_mode)
+        self.time_reference = np.asarray(time_reference, dtype=np.float64)
+        self.freq_reference = np.asarray(freq_reference, dtype=np.float64)
+        self._times = []
+        self._freqs = []
+        self._score_sum = 0.0
+        self._frames_scored = 0
+
+    def reference_at(self, times: np.ndarray) -> np.ndarray:
+        """Pitch reference (Hz) tại các thời điểm, 0 ngoài khoảng thời gian của reference"""
+        reference = self.matcher.interpolate_pitch(self.time_reference, self.freq_reference, times)
+        if len(self.time_reference):
+            outside = (times < self.time_reference[0]) | (times > self.time_reference[-1])
+            reference[outside] = 0.0
+        return reference
+
+    def update(self, times: np.ndarray, frequency: np.ndarray) -> float:
+        """
+        Cộng thêm các frame mới của người hát
+
+        Returns:
+            Độ chính xác tạm tính (0-100)
+        """
+        if len(times) == 0:
+            return self.running_accuracy
+        cents_user = self.matcher.hz_to_cents(frequency)
+        cents_reference = self.matcher.hz_to_cents(self.reference_at(times))
+        scored = int(np.sum((cents_user != 0) & (cents_reference != 0)))
+        if scored:
+            self._score_sum += self.matcher.calculate_accuracy(cents_user, cents_reference) * scored
+            self._frames_scored += scored
+        self._times.append(np.asarray(times, dtype=np.float64))
+        self._freqs.append(np.asarray(frequency, dtype=np.float64))
+        return self.running_accuracy
+
+    @property
+    def running_accuracy(self) -> float:
+        if self._frames_scored == 0:
+            return 0.0
+        return 100.0 * self._score_sum / self._frames_scored
+
+    @property
+    def frames_scored(self) -> int:
+        return self._frames_scored
+
+    def final_results(self) -> Dict:
+        """Điểm đầy đủ (accuracy + DTW) trên toàn bộ contour đã nhận, cùng schema với calculate_score"""
+        if not self._times:
+            raise ValueError("No pitch detected in live input")
+        times = np.concatenate(self._times)
+        frequency = np.concatenate(self._freqs)
+        voiced = frequency > 0
+        if not np.any(voiced):
+            raise ValueError("No pitch detected in live input")
+        return self.matcher.calculate_score(times[voiced], frequency[voiced],
+                                            self.time_reference, self.freq_reference)
+
+
+def simulate_realtime_feed(audio: np.ndarray, chunk_seconds: float = LIVE_CHUNK_SECONDS,
+                           speed: float = 1.0) -> Iterator[np.ndarray]:
+    """
+    Phát audio (16kHz) theo từng đoạn đúng nhịp thời gian thực
+
+    Args:
+        audio: Audio mono 16kHz (ví dụ từ PitchExtractor.load_audio)
+        chunk_seconds: Độ dài mỗi đoạn
+        speed: Hệ số tốc độ (2.0 = nhanh gấp đôi, <= 0 = không chờ)
+    """
+    chunk = max(int(chunk_seconds * LIVE_SAMPLE_RATE), 1)
+    start = time.perf_counter()
+    for index, offset in enumerate(range(0, len(audio), chunk)):
+        if speed > 0:
+            # Hẹn giờ theo mốc bắt đầu để không bị trôi khi xử lý chậm
+            delay = start + index * chunk_seconds / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield audio[offset:offset + chunk]
+
+
+def pcm_stream_feed(stream, sample_rate: int, dtype: str = 'float32', channels: int = 1,
+                    chunk_seconds: float = LIVE_CHUNK_SECONDS) -> Iterator[np.ndarray]:
+    """
+    Đọc PCM thô (interleaved) từ stream đến khi hết dữ liệu
+
+    Args:
+        stream: Object có read(n) trả về bytes (file, pipe, socket.makefile('rb'))
+        sample_rate: Sample rate của PCM, được resample về 16kHz theo từng đoạn
+        dtype: Kiểu sample ('float32', 'int16', ...)
+        channels: Số kênh (được trộn về mono)
+    """
+    frame_bytes = np.dtype(dtype).itemsize * channels
+    chunk_bytes = max(int(chunk_seconds * sample_rate), 1) * frame_bytes
+    leftover = b''
+    while True:
+        data = stream.read(chunk_bytes)
+        if not data:
+            break
+        data = leftover + data
+        usable = len(data) - len(data) % frame_bytes
+        leftover = data[usable:]
+        if usable == 0:
+            continue
+        pcm = np.frombuffer(data[:usable], dtype=np.dtype(dtype))
+        if channels > 1:
+            pcm = pcm.reshape(-1, channels)
+        audio = pcm_to_float(pcm, dtype)
+        if sample_rate != LIVE_SAMPLE_RATE:
+            import librosa
+            audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=LIVE_SAMPLE_RATE)
+        yield audio
+
+
+def run_live(feed: Iterable[np.ndarray], tracker: StreamingPitchTracker, scorer: LiveScorer,
+             on_frames: Optional[Callable[[np.ndarray, np.ndarray, float], None]] = None,
+             cancel_token: Optional[CancellationToken] = None) -> Dict:
+    """
+    Chạy vòng live: feed -> tracker -> scorer cho đến khi hết audio
+
+    Args:
+        feed: Các đoạn PCM 16kHz
+        tracker: StreamingPitchTracker
+        scorer: LiveScorer
+        on_frames: Gọi sau mỗi đoạn có frame mới: on_frames(time, frequency, running_accuracy)
+        cancel_token: Dừng giữa chừng (ném ScoringCancelled)
+
+    Returns:
+        Kết quả đầy đủ của LiveScorer.final_results()
+    """
+    tracker.reset()
+    for chunk in feed:
+        check_cancelled(cancel_token)
+        times, frequency = tracker.feed(chunk)
+        if len(times):
+            accuracy = scorer.update(times, frequency)
+            if on_frames is not None:
+                on_frames(times, frequency, accuracy)
+    check_cancelled(cancel_token)
+    return scorer.final_results()
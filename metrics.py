@@ -0,0 +1,278 @@
+"""
+Bộ đếm và histogram độ trễ cấp process cho host chấm điểm chạy lâu
+
+Thư viện tự ghi số bài đã chấm, lỗi theo loại, cache hit / miss, độ trễ từng
+stage (qua hook của instrumentation), độ sâu hàng đợi và thời gian load model
+vào REGISTRY. Số liệu được xuất ở định dạng text của Prometheus qua:
+
+    - Python: REGISTRY.render() / REGISTRY.snapshot()
+    - File: FileExporter(path) ghi lại file định kỳ (node_exporter textfile
+      collector), hoặc đặt biến môi trường KARAOKE_METRICS_FILE cho session mặc
+      định của score_karaoke_and_get_json (host C++)
+    - HTTP: GET /metrics của scoring_server.py
+
+Ví dụ:
+    from metrics import REGISTRY
+    print(REGISTRY.render())
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from instrumentation import add_timing_hook
+
+# Mốc bucket (giây) cho mọi histogram độ trễ: từ stage vài ms tới bài dài vài phút
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Chu kỳ ghi file của FileExporter (giây)
+EXPORT_INTERVAL_SECONDS = 15.0
+
+# Tên metric -> (kiểu Prometheus, mô tả)
+METRICS = {
+    'karaoke_scores_total': ('counter', 'Scores served, by scoring mode and whether they came from the result cache'),
+    'karaoke_score_errors_total': ('counter', 'Scoring requests that failed, by exception type'),
+    'karaoke_score_duration_seconds': ('histogram', 'End-to-end latency of KaraokeSession.score'),
+    'karaoke_stage_duration_seconds': ('histogram', 'Latency of each pipeline stage (dotted stage names)'),
+    'karaoke_cache_requests_total': ('counter', 'Result / reference / activation cache lookups, by outcome'),
+    'karaoke_queue_depth': ('gauge', 'Scoring requests waiting or running, by queue'),
+    'karaoke_queue_wait_seconds': ('histogram', 'Time spent waiting for a scoring slot, by queue'),
+    'karaoke_model_loads_total': ('counter', 'Pitch model loads, by method'),
+    'karaoke_model_load_seconds_total': ('counter', 'Time spent loading pitch models, by method'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Counter, gauge và histogram có nhãn, an toàn giữa các thread
+
+    Kiểu của mỗi metric lấy từ METRICS (tên khác được coi là 'untyped'). Histogram
+    đếm theo LATENCY_BUCKETS, chỉ giữ số đếm từng bucket, tổng và số lần quan sát.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, Labels], float] = {}
+        # (tên, nhãn) -> [số đếm từng bucket (không cộng dồn), tổng, số lần]
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        """Cộng vào counter (hoặc gauge, amount có thể âm)"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        """Đặt giá trị gauge"""
+        with self._lock:
+            self._values[(name, _labels(labels))] = float(value)
+
+    def observe(self, name: str, value: float, **labels):
+        """Thêm một lần quan sát vào histogram"""
+        key = (name, _labels(labels))
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def value(self, name: str, **labels) -> float:
+        """Giá trị hiện tại của counter / gauge (0 nếu chưa có)"""
+        with self._lock:
+            return self._values.get((name, _labels(labels)), 0.0)
+
+    def snapshot(self) -> Dict:
+        """
+        Bản copy JSON được: {"values": [[tên, {nhãn}, giá trị]], "histograms":
+        [[tên, {nhãn}, [số đếm từng bucket], tổng, số lần]]}
+        """
+        with self._lock:
+            return {
+                'values': [[name, dict(labels), value] for (name, labels), value in self._values.items()],
+                'histograms': [[name, dict(labels), list(counts), total, count]
+                               for (name, labels), (counts, total, count) in self._histograms.items()],
+            }
+
+    def take(self) -> Dict:
+        """snapshot() rồi xóa counter và histogram (gauge giữ nguyên), dùng để chuyển sang merge()"""
+        with self._lock:
+            values = [[name, dict(labels), value] for (name, labels), value in self._values.items()
+                      if METRICS.get(name, ('untyped',))[0] != 'gauge']
+            histograms = [[name, dict(labels), list(counts), total, count]
+                          for (name, labels), (counts, total, count) in self._histograms.items()]
+            self._values = {key: value for key, value in self._values.items()
+                            if METRICS.get(key[0], ('untyped',))[0] == 'gauge'}
+            self._histograms = {}
+        return {'values': values, 'histograms': histograms}
+
+    def merge(self, snapshot: Dict):
+        """Cộng số liệu từ process khác (kết quả take()) vào registry này"""
+        with self._lock:
+            for name, labels, value in snapshot.get('values', ()):
+                key = (name, _labels(labels))
+                if METRICS.get(name, ('untyped',))[0] == 'gauge':
+                    self._values[key] = value
+                else:
+                    self._values[key] = self._values.get(key, 0.0) + value
+            for name, labels, counts, total, count in snapshot.get('histograms', ()):
+                key = (name, _labels(labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def reset(self):
+        """Xóa toàn bộ số liệu"""
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Số liệu ở định dạng text của Prometheus (exposition format 0.0.4)"""
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, help_text = METRICS.get(name, ('untyped', name))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in values:
+            describe(name)
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), (counts, total, count) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels, ("le", le))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write(self, path: str):
+        """Ghi render() ra file (ghi file tạm rồi đổi tên, người đọc không thấy file ghi dở)"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+# Registry mặc định của process
+REGISTRY = MetricsRegistry()
+
+_stage_hook_installed = False
+_stage_hook_lock = threading.Lock()
+
+
+def _observe_stage(name: str, seconds: float, frames: Optional[int]):
+    REGISTRY.observe('karaoke_stage_duration_seconds', seconds, stage=name)
+
+
+def install_stage_hook():
+    """Đưa thời gian mọi stage vào karaoke_stage_duration_seconds (chỉ đăng ký một lần)"""
+    global _stage_hook_installed
+    with _stage_hook_lock:
+        if not _stage_hook_installed:
+            add_timing_hook(_observe_stage)
+            _stage_hook_installed = True
+
+
+def record_score(seconds: float, scoring_mode: str = 'frames', error_type: Optional[str] = None,
+                 cached: bool = False):
+    """Ghi một lần chấm điểm: thành công theo chế độ chấm hoặc lỗi theo loại, kèm độ trễ"""
+    if error_type is None:
+        REGISTRY.inc('karaoke_scores_total', scoring_mode=scoring_mode, cached=str(cached).lower())
+    else:
+        REGISTRY.inc('karaoke_score_errors_total', type=error_type)
+    REGISTRY.observe('karaoke_score_duration_seconds', seconds, outcome='ok' if error_type is None else 'error')
+
+
+def record_cache(cache: str, hit: bool):
+    """Ghi một lần tra cache ('result', 'reference' hoặc 'activation')"""
+    REGISTRY.inc('karaoke_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def record_model_load(method: str, seconds: float):
+    """Ghi một lần load model trích xuất pitch"""
+    REGISTRY.inc('karaoke_model_loads_total', method=method)
+    REGISTRY.inc('karaoke_model_load_seconds_total', seconds, method=method)
+
+
+class FileExporter:
+    """
+    Ghi REGISTRY ra file theo chu kỳ trên thread nền (cho textfile collector của node_exporter)
+
+    Ví dụ:
+        exporter = FileExporter('/var/lib/node_exporter/karaoke.prom').start()
+        ...
+        exporter.stop()  # ghi lần cuối
+    """
+
+    def __init__(self, path: str, interval: float = EXPORT_INTERVAL_SECONDS,
+                 registry: Optional[MetricsRegistry] = None):
+        self.path = path
+        self.interval = interval
+        self.registry = registry or REGISTRY
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'FileExporter':
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Dừng thread và ghi file lần cuối"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.export()
+
+    def export(self):
+        try:
+            self.registry.write(self.path)
+        except OSError as e:
+            print(f"⚠️ Không ghi được metrics ra {self.path}: {e}")
+
+    def _run(self):
+        next_export = time.monotonic()
+        while not self._stop.is_set():
+            self.export()
+            next_export += self.interval
+            self._stop.wait(max(next_export - time.monotonic(), 0.0))
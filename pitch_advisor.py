@@ -1,23 +1,44 @@
 """
 Phân tích Pitch Contour và đưa ra lời khuyên cho người hát
 """
+import heapq
+from array import array
+from bisect import bisect_right, insort
 import numpy as np
-from typing import Dict, List, Tuple
-from pitch_matcher import PitchMatcher
+from typing import Callable, Dict, List, Optional, Tuple
+from pitch_matcher import PitchMatcher, resolve_precision
+from instrumentation import stage
+
+# Bước thời gian lớn hơn hệ số này nhân bước lưới được coi là chỗ nhảy cóc của timeline
+# (voiced_only), run lệch lớn bị cắt tại đó
+GRID_GAP_FACTOR = 1.5
 
 
 class PitchAdvisor:
     """Lớp phân tích pitch và đưa ra lời khuyên"""
     
-    def __init__(self, tolerance_cents: float = 200.0):
+    def __init__(self, tolerance_cents: float = 200.0, max_problem_regions: int = 5,
+                 region_merge_gap: float = 0.5, region_min_frames: int = 3,
+                 precision: str = 'float64', voiced_only: bool = False):
         """
         Args:
             tolerance_cents: Độ lệch cho phép tính bằng cents
+            max_problem_regions: Số đoạn có vấn đề tối đa được trả về (đoạn tệ nhất trước)
+            region_merge_gap: Khoảng cách tối đa (giây) giữa hai đoạn lệch để gộp thành một
+            region_min_frames: Số frame lệch tối thiểu để một đoạn được coi là có vấn đề
+            precision: 'float64' hoặc 'float32' cho timeline, cents và độ lệch (xem PitchMatcher)
+            voiced_only: Chỉ phân tích các đoạn cả hai bên cùng có pitch (xem PitchMatcher)
         """
         self.tolerance_cents = tolerance_cents
+        self.max_problem_regions = max_problem_regions
+        self.region_merge_gap = region_merge_gap
+        self.region_min_frames = region_min_frames
+        self.precision = precision
+        self.voiced_only = voiced_only
     
     def analyze_pitch_contour(self, time_user: np.ndarray, freq_user: np.ndarray,
-                              time_reference: np.ndarray, freq_reference: np.ndarray) -> Dict:
+                              time_reference: np.ndarray, freq_reference: np.ndarray,
+                              reference_segments: Optional[np.ndarray] = None) -> Dict:
         """
         Phân tích pitch contour và đưa ra lời khuyên
         
@@ -26,41 +47,89 @@ class PitchAdvisor:
             freq_user: Tần số pitch người hát (Hz)
             time_reference: Thời gian pitch chuẩn
             freq_reference: Tần số pitch chuẩn (Hz)
+            reference_segments: Các đoạn có pitch của reference khi voiced_only (xem PitchMatcher.align_cents)
         
         Returns:
             Dictionary chứa các lời khuyên và phân tích
         """
-        # Căn chỉnh về cùng timeline
-        matcher = PitchMatcher(tolerance_cents=self.tolerance_cents)
-        aligned_time, aligned_freq_user, aligned_freq_reference = \
-            matcher.align_time_series(time_user, freq_user, time_reference, freq_reference)
+        # Căn chỉnh về cùng timeline và chuyển sang Cents
+        matcher = PitchMatcher(tolerance_cents=self.tolerance_cents, precision=self.precision,
+                               voiced_only=self.voiced_only)
+        aligned_time, cents_user, cents_reference = \
+            matcher.align_cents(time_user, freq_user, time_reference, freq_reference,
+                                reference_segments=reference_segments)
+        
+        with stage('analyze', frames=len(aligned_time)):
+            return self.analyze_aligned(aligned_time, cents_user, cents_reference)
+    
+    def analyze_aligned(self, aligned_time: np.ndarray, cents_user: np.ndarray,
+                        cents_reference: np.ndarray) -> Dict:
+        """
+        Phân tích pitch đã căn chỉnh về cùng timeline (đơn vị cents)
         
-        # Chuyển sang Cents
-        cents_user = matcher.hz_to_cents(aligned_freq_user)
-        cents_reference = matcher.hz_to_cents(aligned_freq_reference)
+        Args:
+            aligned_time: Timeline chung
+            cents_user: Pitch người hát (cents) trên timeline
+            cents_reference: Pitch chuẩn (cents) trên timeline
         
+        Returns:
+            Dictionary chứa các lời khuyên và phân tích
+        """
         # Loại bỏ các điểm không hợp lệ
         mask = (cents_user != 0) & (cents_reference != 0) & \
                np.isfinite(cents_user) & np.isfinite(cents_reference)
         
         if np.sum(mask) == 0:
-            return {
-                'advices': ['Không có đủ dữ liệu để phân tích.'],
-                'issues': [],
-                'strengths': []
-            }
+            return self._empty_analysis()
         
         cents_user_valid = cents_user[mask]
         cents_reference_valid = cents_reference[mask]
-        time_valid = aligned_time[mask]
+        deviation = np.abs(cents_user_valid - cents_reference_valid)
+        
+        # Các phép cộng dồn chạy trong float64 kể cả khi contour là float32
+        stats = {
+            'avg_deviation': np.mean(deviation, dtype=np.float64),
+            'mean_diff': np.mean(cents_user_valid - cents_reference_valid, dtype=np.float64),
+            'user_variance': np.var(cents_user_valid, dtype=np.float64),
+            'ref_variance': np.var(cents_reference_valid, dtype=np.float64),
+            'large_error_ratio': np.sum(deviation > self.tolerance_cents * 2) / len(deviation),
+            'good_ratio': np.sum(deviation <= self.tolerance_cents * 0.5) / len(deviation),
+            'user_range': np.max(cents_user_valid) - np.min(cents_user_valid),
+            'ref_range': np.max(cents_reference_valid) - np.min(cents_reference_valid),
+            'user_peaks': None,
+            'ref_peaks': None
+        }
+        
+        # Tìm các peak trong cả hai contour (chỉ khi đủ dữ liệu)
+        if len(cents_user_valid) > 10 and len(cents_reference_valid) > 10:
+            stats['user_peaks'] = len(self._find_peaks(cents_user_valid))
+            stats['ref_peaks'] = len(self._find_peaks(cents_reference_valid))
         
-        # Phân tích các vấn đề
+        problem_regions = self.find_problem_regions(aligned_time, cents_user, cents_reference, mask)
+        return self._build_analysis(stats, problem_regions)
+    
+    def _empty_analysis(self) -> Dict:
+        """Kết quả khi không có đủ dữ liệu"""
+        return {
+            'advices': ['Không có đủ dữ liệu để phân tích.'],
+            'issues': [],
+            'strengths': [],
+            'problem_regions': []
+        }
+    
+    def _build_analysis(self, stats: Dict, problem_regions: List[Dict]) -> Dict:
+        """
+        Tạo lời khuyên từ các thống kê tổng hợp
+        
+        Dùng chung cho phân tích batch (analyze_aligned) và StreamingPitchAdvisor
+        để hai cách cho cùng kết quả.
+        """
         advices = []
         issues = []
         strengths = []
         
         # 1. Phân tích độ lệch trung bình
-        avg_deviation = np.mean(np.abs(cents_user_valid - cents_reference_valid))
+        avg_deviation = stats['avg_deviation']
         if avg_deviation < 50:
             strengths.append("Độ chính xác pitch rất tốt!")
         elif avg_deviation < 100:
@@ -70,7 +139,7 @@ class PitchAdvisor:
             advices.append(f"💡 Lời khuyên: Cố gắng hát đúng cao độ hơn. Độ lệch trung bình hiện tại: {avg_deviation:.1f} cents (≈{avg_deviation/100:.1f} semitone)")
         
         # 2. Phân tích xu hướng lệch (cao hơn hay thấp hơn)
-        mean_diff = np.mean(cents_user_valid - cents_reference_valid)
+        mean_diff = stats['mean_diff']
         if mean_diff > 50:
             issues.append("Hát cao hơn reference")
             advices.append(f"💡 Lời khuyên: Bạn đang hát cao hơn khoảng {mean_diff:.1f} cents (≈{mean_diff/100:.1f} semitone). Hãy thử hạ giọng xuống một chút.")
@@ -79,8 +148,8 @@ class PitchAdvisor:
             advices.append(f"💡 Lời khuyên: Bạn đang hát thấp hơn khoảng {abs(mean_diff):.1f} cents (≈{abs(mean_diff)/100:.1f} semitone). Hãy thử nâng giọng lên một chút.")
         
         # 3. Phân tích độ ổn định (variance)
-        user_variance = np.var(cents_user_valid)
-        ref_variance = np.var(cents_reference_valid)
+        user_variance = stats['user_variance']
+        ref_variance = stats['ref_variance']
         stability_ratio = user_variance / ref_variance if ref_variance > 0 else 1.0
         
         if stability_ratio > 2.0:
@@ -90,24 +159,19 @@ class PitchAdvisor:
             strengths.append("Pitch rất ổn định!")
         
         # 4. Phân tích các đoạn có vấn đề lớn
-        deviation = np.abs(cents_user_valid - cents_reference_valid)
-        large_error_mask = deviation > self.tolerance_cents * 2
-        large_error_ratio = np.sum(large_error_mask) / len(deviation) if len(deviation) > 0 else 0
-        
+        large_error_ratio = stats['large_error_ratio']
         if large_error_ratio > 0.3:
             issues.append(f"{large_error_ratio*100:.1f}% thời lượng có lệch lớn")
             advices.append(f"💡 Lời khuyên: Có {large_error_ratio*100:.1f}% thời lượng bài hát có lệch pitch lớn. Hãy tập luyện các đoạn này nhiều hơn.")
         
         # 5. Phân tích các đoạn tốt
-        good_mask = deviation <= self.tolerance_cents * 0.5
-        good_ratio = np.sum(good_mask) / len(deviation) if len(deviation) > 0 else 0
-        
+        good_ratio = stats['good_ratio']
         if good_ratio > 0.5:
             strengths.append(f"{good_ratio*100:.1f}% thời lượng hát rất chính xác!")
         
         # 6. Phân tích khoảng pitch (range)
-        user_range = np.max(cents_user_valid) - np.min(cents_user_valid)
-        ref_range = np.max(cents_reference_valid) - np.min(cents_reference_valid)
+        user_range = stats['user_range']
+        ref_range = stats['ref_range']
         
         if user_range < ref_range * 0.7:
             issues.append("Khoảng pitch hẹp hơn reference")
@@ -117,36 +181,132 @@ class PitchAdvisor:
             advices.append("💡 Lời khuyên: Bạn đang hát trong khoảng pitch rộng hơn bài gốc. Hãy tập trung vào các nốt chính của bài hát.")
         
         # 7. Phân tích timing (nếu có thể)
-        # Tìm các peak trong cả hai contour
-        if len(cents_user_valid) > 10 and len(cents_reference_valid) > 10:
-            # Đơn giản hóa: so sánh các điểm quan trọng
-            user_peaks = self._find_peaks(cents_user_valid)
-            ref_peaks = self._find_peaks(cents_reference_valid)
-            
-            if len(user_peaks) > 0 and len(ref_peaks) > 0:
-                # So sánh timing của peaks
-                if len(user_peaks) < len(ref_peaks) * 0.7:
-                    issues.append("Thiếu các điểm nhấn")
-                    advices.append("💡 Lời khuyên: Bạn đang bỏ qua một số điểm nhấn quan trọng trong bài hát. Hãy chú ý đến các nốt cao và các điểm nhấn.")
+        # So sánh số điểm nhấn (peak) giữa hai contour
+        user_peaks = stats['user_peaks']
+        ref_peaks = stats['ref_peaks']
+        if user_peaks and ref_peaks:
+            if user_peaks < ref_peaks * 0.7:
+                issues.append("Thiếu các điểm nhấn")
+                advices.append("💡 Lời khuyên: Bạn đang bỏ qua một số điểm nhấn quan trọng trong bài hát. Hãy chú ý đến các nốt cao và các điểm nhấn.")
+        
+        # 8. Đoạn có vấn đề kèm thời gian (để nhảy thẳng tới đoạn cần tập)
+        if problem_regions:
+            worst = problem_regions[0]
+            direction_text = 'cao hơn' if worst['direction'] == 'sharp' else 'thấp hơn'
+            advices.append(f"💡 Lời khuyên: Đoạn cần tập nhất là {worst['start']:.1f}s - {worst['end']:.1f}s, "
+                           f"bạn hát {direction_text} khoảng {worst['mean_deviation_cents']:.0f} cents.")
         
         # Tổng hợp kết quả
         result = {
             'advices': advices if advices else ['🎉 Tuyệt vời! Bạn đang hát rất tốt!'],
             'issues': issues,
             'strengths': strengths,
+            'problem_regions': problem_regions,
             'metrics': {
-                'avg_deviation_cents': round(avg_deviation, 2),
-                'mean_diff_cents': round(mean_diff, 2),
-                'stability_ratio': round(stability_ratio, 2),
-                'large_error_ratio': round(large_error_ratio * 100, 2),
-                'good_ratio': round(good_ratio * 100, 2),
-                'user_range_cents': round(user_range, 2),
-                'ref_range_cents': round(ref_range, 2)
+                'avg_deviation_cents': round(float(avg_deviation), 2),
+                'mean_diff_cents': round(float(mean_diff), 2),
+                'stability_ratio': round(float(stability_ratio), 2),
+                'large_error_ratio': round(float(large_error_ratio) * 100, 2),
+                'good_ratio': round(float(good_ratio) * 100, 2),
+                'user_range_cents': round(float(user_range), 2),
+                'ref_range_cents': round(float(ref_range), 2)
             }
         }
         
         return result
     
+    def find_problem_regions(self, time: np.ndarray, cents_user: np.ndarray,
+                             cents_reference: np.ndarray,
+                             valid_mask: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Tìm các đoạn hát lệch nhiều nhất kèm thời gian bắt đầu/kết thúc
+        
+        Mask lệch lớn của từng frame được run-length encode, các đoạn gần nhau
+        (cách nhau <= region_merge_gap giây) được gộp lại, sau đó trả về
+        max_problem_regions đoạn tệ nhất. Toàn bộ tính toán là O(n) bằng NumPy.
+        
+        Args:
+            time: Timeline đã căn chỉnh
+            cents_user: Pitch người hát (cents) trên timeline
+            cents_reference: Pitch chuẩn (cents) trên timeline
+            valid_mask: Mask các frame hợp lệ (None = tự tính từ dữ liệu)
+        
+        Returns:
+            Danh sách đoạn (tệ nhất trước), mỗi đoạn gồm start, end, duration,
+            mean_deviation_cents, mean_offset_cents, direction ('sharp'/'flat') và frames
+        """
+        if len(time) == 0:
+            return []
+        if valid_mask is None:
+            valid_mask = (cents_user != 0) & (cents_reference != 0) & \
+                         np.isfinite(cents_user) & np.isfinite(cents_reference)
+        
+        offset = np.where(valid_mask, cents_user - cents_reference, 0.0)
+        deviation = np.abs(offset)
+        bad = valid_mask & (deviation > self.tolerance_cents * 2)
+        
+        # Run-length encoding: vị trí bắt đầu/kết thúc (exclusive) của từng run lệch.
+        # Timeline chỉ gồm đoạn có pitch (voiced_only) có chỗ nhảy cóc, run bị cắt tại đó
+        steps = np.diff(np.asarray(time, dtype=np.float64))
+        gap = steps > GRID_GAP_FACTOR * np.median(steps) if len(steps) else steps.astype(bool)
+        starts = np.flatnonzero(bad & np.concatenate(([True], ~bad[:-1] | gap)))
+        ends = np.flatnonzero(bad & np.concatenate((~bad[1:] | gap, [True]))) + 1
+        if len(starts) == 0:
+            return []
+        
+        # Tổng độ lệch của từng run qua cumulative sum
+        cum_abs = np.concatenate(([0.0], np.cumsum(np.where(bad, deviation, 0.0), dtype=np.float64)))
+        cum_offset = np.concatenate(([0.0], np.cumsum(np.where(bad, offset, 0.0), dtype=np.float64)))
+        
+        return self._rank_problem_runs(
+            time[starts], time[ends - 1],
+            cum_abs[ends] - cum_abs[starts],
+            cum_offset[ends] - cum_offset[starts],
+            ends - starts
+        )
+    
+    def _rank_problem_runs(self, run_start: np.ndarray, run_end: np.ndarray,
+                           run_abs_sum: np.ndarray, run_offset_sum: np.ndarray,
+                           run_frames: np.ndarray) -> List[Dict]:
+        """Gộp các run gần nhau và xếp hạng theo tổng độ lệch (độ nghiêm trọng)"""
+        if len(run_start) == 0:
+            return []
+        run_start = np.asarray(run_start, dtype=np.float64)
+        run_end = np.asarray(run_end, dtype=np.float64)
+        
+        # Bắt đầu nhóm mới khi khoảng trống với run trước lớn hơn region_merge_gap
+        new_group = np.concatenate(([True], (run_start[1:] - run_end[:-1]) > self.region_merge_gap))
+        group_first = np.flatnonzero(new_group)
+        group_last = np.concatenate((group_first[1:], [len(run_start)])) - 1
+        
+        start = run_start[group_first]
+        end = run_end[group_last]
+        abs_sum = np.add.reduceat(np.asarray(run_abs_sum, dtype=np.float64), group_first)
+        offset_sum = np.add.reduceat(np.asarray(run_offset_sum, dtype=np.float64), group_first)
+        frames = np.add.reduceat(np.asarray(run_frames, dtype=np.int64), group_first)
+        
+        keep = np.flatnonzero(frames >= self.region_min_frames)
+        if len(keep) == 0:
+            return []
+        # Đoạn tệ nhất = tổng độ lệch lớn nhất (kết hợp cả độ dài và mức lệch)
+        order = keep[np.argsort(-abs_sum[keep], kind='stable')][:self.max_problem_regions]
+        
+        return [self._region_dict(start[i], end[i], abs_sum[i], offset_sum[i], frames[i]) for i in order]
+    
+    @staticmethod
+    def _region_dict(start: float, end: float, abs_sum: float, offset_sum: float, frames: int) -> Dict:
+        """Một đoạn có vấn đề ở định dạng kết quả (dùng chung cho batch và streaming)"""
+        mean_offset = offset_sum / frames
+        return {
+            'start': round(float(start), 2),
+            'end': round(float(end), 2),
+            'duration': round(float(end - start), 2),
+            'mean_deviation_cents': round(float(abs_sum / frames), 2),
+            'mean_offset_cents': round(float(mean_offset), 2),
+            'direction': 'sharp' if mean_offset > 0 else 'flat',
+            'frames': int(frames)
+        }
+    
     def _find_peaks(self, data: np.ndarray, min_height: float = None) -> List[int]:
         """Tìm các peak trong dữ liệu"""
         if len(data) < 3:
@@ -184,6 +344,13 @@ class PitchAdvisor:
             for issue in analysis_result['issues']:
                 summary_parts.append(f"   • {issue}")
         
+        if analysis_result.get('problem_regions'):
+            summary_parts.append("\n🎯 Đoạn cần tập:")
+            for region in analysis_result['problem_regions']:
+                direction_text = 'cao' if region['direction'] == 'sharp' else 'thấp'
+                summary_parts.append(f"   • {region['start']:.1f}s - {region['end']:.1f}s: "
+                                     f"lệch {direction_text} {region['mean_deviation_cents']:.0f} cents")
+        
         if analysis_result['advices']:
             summary_parts.append("\n💡 Lời khuyên:")
             for advice in analysis_result['advices'][:5]:  # Chỉ lấy 5 lời khuyên đầu
@@ -191,3 +358,241 @@ class PitchAdvisor:
         
         return "\n".join(summary_parts) if summary_parts else "Không có dữ liệu để phân tích."
 
+
+class StreamingPitchAdvisor:
+    """
+    Phiên bản streaming của PitchAdvisor cho chế độ hát trực tiếp
+    
+    Nhận từng frame đã căn chỉnh (cùng timeline với reference) và cập nhật
+    thống kê tích lũy với chi phí O(1) mỗi frame, bộ nhớ không tăng theo độ dài
+    bài: mean/variance (Welford), min/max, xu hướng cao/thấp, run lệch lớn đang
+    mở và đoạn có vấn đề đang gộp. Riêng giá trị các peak dương được giữ chính xác
+    (mảng float64 đã sắp xếp, 8 byte mỗi peak) vì ngưỡng đếm peak std * 0.5 chỉ
+    biết khi đã có toàn bộ dữ liệu. Đoạn đã đóng
+    (frame tiếp theo cách đoạn quá region_merge_gap) được báo qua on_region và chỉ
+    max_problem_regions đoạn tệ nhất được giữ lại.
+    
+    get_analysis() có chi phí cố định (có thể gọi mỗi giây) và khi nhận hết frame
+    cho cùng kết quả với PitchAdvisor.analyze_aligned trên toàn bộ dữ liệu.
+    """
+    
+    def __init__(self, tolerance_cents: float = 200.0,
+                 on_region: Optional[Callable[[Dict], None]] = None, **advisor_kwargs):
+        """
+        Args:
+            tolerance_cents: Độ lệch cho phép tính bằng cents
+            on_region: Callback nhận mỗi đoạn có vấn đề ngay khi đoạn đó kết thúc
+            **advisor_kwargs: Các tham số khác truyền cho PitchAdvisor
+                            (max_problem_regions, region_merge_gap, region_min_frames, precision)
+        """
+        self.advisor = PitchAdvisor(tolerance_cents=tolerance_cents, **advisor_kwargs)
+        self.dtype = resolve_precision(self.advisor.precision)
+        self.on_region = on_region
+        self.reset()
+    
+    def reset(self):
+        """Xóa toàn bộ thống kê để bắt đầu bài hát mới"""
+        self.count = 0
+        # Welford cho pitch người hát và pitch chuẩn
+        self._user_mean = 0.0
+        self._user_m2 = 0.0
+        self._ref_mean = 0.0
+        self._ref_m2 = 0.0
+        self._user_min = float('inf')
+        self._user_max = float('-inf')
+        self._ref_min = float('inf')
+        self._ref_max = float('-inf')
+        # Tổng độ lệch tuyệt đối và có dấu (xu hướng cao/thấp)
+        self._abs_sum = 0.0
+        self._offset_sum = 0.0
+        self._large_error_count = 0
+        self._good_count = 0
+        # Hai giá trị hợp lệ gần nhất để phát hiện peak, giá trị các peak dương (đã sắp xếp)
+        self._user_prev = []
+        self._ref_prev = []
+        self._user_peaks = array('d')
+        self._ref_peaks = array('d')
+        # Bước lưới (bước nhỏ nhất đã gặp) để nhận ra chỗ nhảy cóc như find_problem_regions
+        self._last_time = None
+        self._grid_step = None
+        # Run lệch lớn đang mở và đoạn đang gộp: [start, end, abs_sum, offset_sum, frames]
+        self._open_run = None
+        self._open_region = None
+        # max_problem_regions đoạn tệ nhất đã đóng: min-heap (abs_sum, -thứ tự, đoạn)
+        self._closed = []
+        self._closed_seq = 0
+    
+    def update(self, time: float, cents_user: float, cents_reference: float):
+        """
+        Thêm một frame đã căn chỉnh
+        
+        Args:
+            time: Thời điểm của frame (giây)
+            cents_user: Pitch người hát (cents), 0 hoặc NaN nếu không có pitch
+            cents_reference: Pitch chuẩn (cents), 0 hoặc NaN nếu không có pitch
+        """
+        self._update(time, cents_user, cents_reference, cents_user - cents_reference)
+    
+    def _update(self, time: float, cents_user: float, cents_reference: float, offset: float):
+        if self._last_time is not None:
+            step = time - self._last_time
+            if step > 0 and (self._grid_step is None or step < self._grid_step):
+                self._grid_step = step
+            if self._grid_step is not None and step > GRID_GAP_FACTOR * self._grid_step:
+                self._close_run()
+        self._last_time = time
+        self._close_region_before(time)
+        
+        valid = cents_user != 0 and cents_reference != 0 and \
+            np.isfinite(cents_user) and np.isfinite(cents_reference)
+        if not valid:
+            self._close_run()
+            return
+        
+        self.count += 1
+        delta = cents_user - self._user_mean
+        self._user_mean += delta / self.count
+        self._user_m2 += delta * (cents_user - self._user_mean)
+        delta = cents_reference - self._ref_mean
+        self._ref_mean += delta / self.count
+        self._ref_m2 += delta * (cents_reference - self._ref_mean)
+        
+        self._user_min = min(self._user_min, cents_user)
+        self._user_max = max(self._user_max, cents_user)
+        self._ref_min = min(self._ref_min, cents_reference)
+        self._ref_max = max(self._ref_max, cents_reference)
+        
+        deviation = abs(offset)
+        self._abs_sum += deviation
+        self._offset_sum += offset
+        if deviation <= self.advisor.tolerance_cents * 0.5:
+            self._good_count += 1
+        
+        if deviation > self.advisor.tolerance_cents * 2:
+            self._large_error_count += 1
+            if self._open_run is None:
+                self._open_run = [time, time, 0.0, 0.0, 0]
+            run = self._open_run
+            run[1] = time
+            run[2] += deviation
+            run[3] += offset
+            run[4] += 1
+        else:
+            self._close_run()
+        
+        self._track_peak(self._user_prev, self._user_peaks, cents_user)
+        self._track_peak(self._ref_prev, self._ref_peaks, cents_reference)
+    
+    def update_frames(self, times: np.ndarray, cents_user: np.ndarray, cents_reference: np.ndarray):
+        """Thêm nhiều frame đã căn chỉnh (đơn vị cents, độ lệch tính theo precision như bản batch)"""
+        cents_user = np.asarray(cents_user, dtype=self.dtype)
+        cents_reference = np.asarray(cents_reference, dtype=self.dtype)
+        offsets = cents_user - cents_reference
+        for t, user, ref, offset in zip(np.asarray(times, dtype=np.float64).tolist(), cents_user.tolist(),
+                                        cents_reference.tolist(), offsets.tolist()):
+            self._update(t, user, ref, offset)
+    
+    def update_hz(self, times: np.ndarray, freq_user: np.ndarray, freq_reference: np.ndarray):
+        """Thêm nhiều frame đã căn chỉnh (đơn vị Hz)"""
+        matcher = PitchMatcher(tolerance_cents=self.advisor.tolerance_cents, precision=self.advisor.precision)
+        self.update_frames(times, matcher.hz_to_cents(freq_user), matcher.hz_to_cents(freq_reference))
+    
+    def get_analysis(self) -> Dict:
+        """
+        Lời khuyên cho phần bài hát đã nhận (không thay đổi trạng thái)
+        
+        Returns:
+            Dictionary cùng định dạng với PitchAdvisor.analyze_pitch_contour
+        """
+        if self.count == 0:
+            return self.advisor._empty_analysis()
+        
+        stats = {
+            'avg_deviation': self._abs_sum / self.count,
+            'mean_diff': self._offset_sum / self.count,
+            'user_variance': self._user_m2 / self.count,
+            'ref_variance': self._ref_m2 / self.count,
+            'large_error_ratio': self._large_error_count / self.count,
+            'good_ratio': self._good_count / self.count,
+            'user_range': self._user_max - self._user_min,
+            'ref_range': self._ref_max - self._ref_min,
+            'user_peaks': None,
+            'ref_peaks': None
+        }
+        if self.count > 10:
+            stats['user_peaks'] = self._count_peaks(self._user_peaks, self._user_m2)
+            stats['ref_peaks'] = self._count_peaks(self._ref_peaks, self._ref_m2)
+        
+        # Đoạn đang mở được tính tạm (run đang mở gộp vào nếu đủ gần)
+        pending = []
+        region = list(self._open_region) if self._open_region is not None else None
+        if self._open_run is not None:
+            if region is not None and self._open_run[0] - region[1] <= self.advisor.region_merge_gap:
+                region = self._merge(region, self._open_run)
+            else:
+                if region is not None:
+                    pending.append(region)
+                region = list(self._open_run)
+        if region is not None:
+            pending.append(region)
+        
+        # (tổng độ lệch, thứ tự, đoạn)
+        candidates = [(abs_sum, -negative_seq, item) for abs_sum, negative_seq, item in self._closed]
+        for offset, item in enumerate(pending):
+            if item[4] >= self.advisor.region_min_frames:
+                candidates.append((item[2], self._closed_seq + offset, self.advisor._region_dict(*item)))
+        # Tệ nhất trước; bằng nhau thì đoạn sớm hơn trước (giống argsort stable của bản batch)
+        candidates.sort(key=lambda entry: (-entry[0], entry[1]))
+        problem_regions = [entry[2] for entry in candidates[:self.advisor.max_problem_regions]]
+        return self.advisor._build_analysis(stats, problem_regions)
+    
+    @staticmethod
+    def _merge(region: list, run: list) -> list:
+        return [region[0], run[1], region[2] + run[2], region[3] + run[3], region[4] + run[4]]
+    
+    def _close_run(self):
+        """Kết thúc run lệch lớn đang mở (nếu có), gộp vào đoạn đang mở hoặc mở đoạn mới"""
+        run, self._open_run = self._open_run, None
+        if run is None:
+            return
+        if self._open_region is not None and run[0] - self._open_region[1] <= self.advisor.region_merge_gap:
+            self._open_region = self._merge(self._open_region, run)
+        else:
+            self._close_region()
+            self._open_region = run
+    
+    def _close_region_before(self, time: float):
+        """Đóng đoạn đang mở khi frame mới đã cách nó quá region_merge_gap (không run nào gộp được nữa)"""
+        if self._open_region is not None and self._open_run is None and \
+                time - self._open_region[1] > self.advisor.region_merge_gap:
+            self._close_region()
+    
+    def _close_region(self):
+        """Chốt đoạn đang mở: báo qua on_region và giữ nếu thuộc nhóm tệ nhất"""
+        region, self._open_region = self._open_region, None
+        if region is None or region[4] < self.advisor.region_min_frames:
+            return
+        result = self.advisor._region_dict(*region)
+        if self.on_region is not None:
+            self.on_region(result)
+        entry = (region[2], -self._closed_seq, result)
+        self._closed_seq += 1
+        if len(self._closed) < self.advisor.max_problem_regions:
+            heapq.heappush(self._closed, entry)
+        elif self._closed and entry[:2] > self._closed[0][:2]:
+            heapq.heapreplace(self._closed, entry)
+    
+    @staticmethod
+    def _track_peak(previous: List[float], peaks: array, value: float):
+        """Lưu giá trị ở giữa nếu nó là cực đại cục bộ (giống _find_peaks)"""
+        # Peak không dương không bao giờ vượt ngưỡng std * 0.5 nên không cần lưu
+        if len(previous) == 2 and previous[1] > previous[0] and previous[1] > value and previous[1] > 0:
+            insort(peaks, previous[1])
+        previous.append(value)
+        if len(previous) > 2:
+            previous.pop(0)
+    
+    def _count_peaks(self, peaks: array, m2: float) -> int:
+        """Đếm peak vượt ngưỡng std * 0.5 (ngưỡng phụ thuộc toàn bộ dữ liệu)"""
+        min_height = np.sqrt(m2 / self.count) * 0.5
+        return len(peaks) - bisect_right(peaks, min_height)
@@ -1,17 +1,102 @@
 """
 Trích xuất Pitch Contour từ audio sử dụng CREPE hoặc Basic Pitch
 """
+import os
+from time import perf_counter
 import numpy as np
 import librosa
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Union
 import warnings
+from numpy.lib.stride_tricks import as_strided
+from instrumentation import stage
+from activation_cache import ActivationCache, activation_key
+from cancellation import CancellationToken, ProgressCallback, check_cancelled, report_progress
+from metrics import record_model_load
+from pitch_matcher import resolve_precision, window_contour
 warnings.filterwarnings('ignore')
 
+# Audio đầu vào: đường dẫn file hoặc PCM trong bộ nhớ (numpy array, bytes, memoryview...)
+AudioSource = Union[str, os.PathLike, np.ndarray, bytes, bytearray, memoryview]
+
+# CREPE: sample rate và độ dài frame của model (giống crepe.core)
+CREPE_SAMPLE_RATE = 16000
+CREPE_FRAME_LENGTH = 1024
+# Số frame mỗi lần gọi model.predict; token hủy được kiểm tra giữa các batch
+# (~50-100ms với model tiny trên CPU)
+CREPE_BATCH_FRAMES = 256
+
+# Basic Pitch resample mọi input về tần số này
+BASIC_PITCH_SAMPLE_RATE = 22050
+
+# Chấm một đoạn [start, end] của bài: decode và suy luận thêm khoảng này (giây) mỗi bên
+# để frame ở mép cửa sổ có đủ ngữ cảnh (Viterbi, frame CREPE 64ms)
+WINDOW_MARGIN_SECONDS = 0.5
+
+# Hệ số chuyển PCM số nguyên về float trong [-1, 1]
+_PCM_INT_SCALE = {
+    np.dtype('int16'): 1.0 / 32768.0,
+    np.dtype('int32'): 1.0 / 2147483648.0,
+}
+
+
+def is_audio_path(audio_source) -> bool:
+    """Kiểm tra audio_source là đường dẫn file (True) hay PCM trong bộ nhớ (False)"""
+    return isinstance(audio_source, (str, os.PathLike))
+
+
+def pcm_to_float(pcm, dtype: str = 'float32') -> np.ndarray:
+    """
+    Chuyển PCM trong bộ nhớ thành mảng float32 mono mà không copy khi có thể
+    
+    Args:
+        pcm: numpy array hoặc object hỗ trợ buffer protocol (bytes, bytearray, memoryview)
+             Mảng 2 chiều được hiểu là (samples, channels)
+        dtype: Kiểu sample khi pcm là buffer thô ('float32', 'float64', 'int16', 'int32')
+    
+    Returns:
+        Mảng float32 1 chiều
+    """
+    if isinstance(pcm, np.ndarray):
+        audio = pcm
+    else:
+        # np.frombuffer bọc trực tiếp bộ nhớ của buffer (zero-copy)
+        audio = np.frombuffer(memoryview(pcm).cast('B'), dtype=np.dtype(dtype))
+    
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    elif audio.ndim != 1:
+        raise ValueError(f"PCM phải là mảng 1 hoặc 2 chiều, nhận được {audio.ndim} chiều")
+    
+    if audio.dtype in _PCM_INT_SCALE:
+        return audio.astype(np.float32) * np.float32(_PCM_INT_SCALE[audio.dtype])
+    if audio.dtype != np.float32:
+        return audio.astype(np.float32)
+    return audio
+
+
+def decode_span(start: Optional[float] = None, end: Optional[float] = None,
+                margin: float = WINDOW_MARGIN_SECONDS) -> Tuple[float, Optional[float]]:
+    """(offset, duration) cần decode cho cửa sổ [start, end] kèm margin, duration None = tới hết file"""
+    offset = max(start - margin, 0.0) if start is not None else 0.0
+    duration = end + margin - offset if end is not None else None
+    return offset, duration
+
+
+def _slice_pcm(pcm, sample_rate: int, dtype: str, offset: float, duration: Optional[float]):
+    """Cắt PCM theo thời gian trước khi chuyển sang float (không copy)"""
+    first = int(round(offset * sample_rate))
+    last = None if duration is None else first + int(round(duration * sample_rate))
+    if isinstance(pcm, np.ndarray):
+        return pcm[first:last]
+    itemsize = np.dtype(dtype).itemsize
+    return memoryview(pcm).cast('B')[first * itemsize:None if last is None else last * itemsize]
+
 
 class PitchExtractor:
     """Lớp trích xuất pitch từ audio"""
     
-    def __init__(self, method: str = 'crepe', model_capacity: str = 'tiny', normalize_audio: bool = True):
+    def __init__(self, method: str = 'crepe', model_capacity: str = 'tiny', normalize_audio: bool = True,
+                 precision: str = 'float64', activation_cache: Optional[ActivationCache] = None):
         """
         Args:
             method: 'crepe' hoặc 'basic_pitch'
@@ -20,18 +105,26 @@ class PitchExtractor:
             normalize_audio: Có normalize audio trước khi extract pitch không (mặc định True)
                            - True: Normalize để đảm bảo công bằng khi so sánh
                            - False: Giữ nguyên volume gốc
+            precision: Kiểu của contour trả về, 'float64' (mặc định) hoặc 'float32'
+            activation_cache: Giữ activation thô của CREPE (float16, có thể lưu ra đĩa) để đổi
+                              confidence_threshold / use_viterbi mà không suy luận lại
         """
         self.method = method
         self.model_capacity = model_capacity
         self.normalize_audio = normalize_audio
+        self.precision = precision
+        self.dtype = resolve_precision(precision)
+        self.activation_cache = activation_cache
         self._crepe_model = None
         self._basic_pitch_model = None
         
     def _load_crepe(self):
         """Load CREPE model"""
+        started = perf_counter()
         try:
             import crepe
             self._crepe_model = crepe
+            record_model_load('crepe', perf_counter() - started)
             return True
         except ImportError:
             print("⚠️ CREPE chưa được cài đặt. Chạy: pip install crepe")
@@ -39,6 +132,7 @@ class PitchExtractor:
     
     def _load_basic_pitch(self):
         """Load Basic Pitch model"""
+        started = perf_counter()
         try:
             from basic_pitch import ICASSP_2022_MODEL_PATH
             from basic_pitch.inference import predict
@@ -56,6 +150,7 @@ class PitchExtractor:
                 'predict': predict,
                 'model_path': ICASSP_2022_MODEL_PATH
             }
+            record_model_load('basic_pitch', perf_counter() - started)
             return True
         except ImportError:
             print("⚠️ Basic Pitch chưa được cài đặt. Chạy: pip install basic-pitch")
@@ -65,15 +160,139 @@ class PitchExtractor:
             print("   Khuyến nghị: Sử dụng CREPE thay thế (pip install crepe)")
             return False
     
-    def extract_pitch_crepe(self, audio_path: str, step_size: int = 50, use_viterbi: bool = False, confidence_threshold: float = 0.4) -> Tuple[np.ndarray, np.ndarray]:
+    def warm_up(self):
+        """
+        Load model trước để lần trích xuất đầu tiên không phải chờ load
+        (dùng cho các process chạy lâu như KaraokeSession / server)
+        """
+        if self.method == 'crepe':
+            if self._crepe_model is None and not self._load_crepe():
+                raise ImportError("Không thể load CREPE model")
+            # CREPE cache model đã build theo capacity, build một lần ở đây
+            started = perf_counter()
+            self._crepe_model.core.build_and_load_model(self.model_capacity)
+            record_model_load('crepe', perf_counter() - started)
+        elif self.method == 'basic_pitch':
+            if self._basic_pitch_model is None and not self._load_basic_pitch():
+                raise ImportError("Không thể load Basic Pitch model")
+    
+    def load_audio(self, audio_path: AudioSource, sample_rate: Optional[int] = None,
+                   dtype: str = 'float32', target_sr: int = 16000,
+                   cancel_token: Optional[CancellationToken] = None,
+                   offset: float = 0.0, duration: Optional[float] = None) -> Tuple[np.ndarray, int]:
+        """
+        Đọc audio từ file hoặc từ PCM trong bộ nhớ và resample về target_sr
+        
+        Args:
+            audio_path: Đường dẫn file audio hoặc PCM (numpy array, bytes, memoryview)
+            sample_rate: Sample rate của PCM (bắt buộc khi truyền PCM)
+            dtype: Kiểu sample của PCM thô ('float32', 'int16', ...)
+            target_sr: Sample rate đích
+            cancel_token: Kiểm tra sau khi decode (decode / resample không dừng giữa chừng được)
+            offset: Bắt đầu đọc từ giây này (file được seek, không decode phần trước)
+            duration: Chỉ đọc chừng này giây (None = tới hết)
+        
+        Returns:
+            (audio, sr): Mảng audio mono và sample rate
+        """
+        with stage('decode') as record:
+            if is_audio_path(audio_path):
+                # Decode ở sample rate gốc, resample riêng để đo được từng bước
+                audio, sample_rate = librosa.load(audio_path, sr=None, offset=offset, duration=duration)
+            else:
+                if sample_rate is None:
+                    raise ValueError("Cần truyền sample_rate khi dùng PCM trong bộ nhớ")
+                if offset or duration is not None:
+                    audio_path = _slice_pcm(audio_path, sample_rate, dtype, offset, duration)
+                audio = pcm_to_float(audio_path, dtype)
+            record.frames = len(audio)
+        check_cancelled(cancel_token)
+        
+        if sample_rate != target_sr:
+            with stage('resample') as record:
+                audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=target_sr)
+                record.frames = len(audio)
+        return audio, target_sr
+    
+    def _crepe_activation(self, audio: np.ndarray, step_size: int,
+                          cancel_token: Optional[CancellationToken] = None,
+                          progress: Optional[ProgressCallback] = None,
+                          center: bool = True) -> np.ndarray:
+        """
+        Activation của CREPE cho audio 16kHz, chạy model theo từng batch frame
+        
+        Giống crepe.core.get_activation (chuẩn hóa từng frame) nhưng chỉ tạo
+        CREPE_BATCH_FRAMES frame mỗi lần, nên có thể hủy / báo tiến độ giữa
+        các batch và không phải giữ ma trận frame của cả bài trong bộ nhớ.
+        
+        Args:
+            center: Pad nửa frame hai đầu như crepe (False khi audio là một đoạn
+                    của stream, frame i bắt đầu ở sample i * hop)
+        
+        Returns:
+            Mảng (n_frames, 360)
+        """
+        if self._crepe_model is None and not self._load_crepe():
+            raise ImportError("Không thể load CREPE model")
+        model = self._crepe_model.core.build_and_load_model(self.model_capacity)
+        audio = np.asarray(audio, dtype=np.float32)
+        if center:
+            audio = np.pad(audio, CREPE_FRAME_LENGTH // 2, mode='constant')
+        hop_length = int(CREPE_SAMPLE_RATE * step_size / 1000)
+        n_frames = 1 + (len(audio) - CREPE_FRAME_LENGTH) // hop_length
+        activations = []
+        for start in range(0, n_frames, CREPE_BATCH_FRAMES):
+            check_cancelled(cancel_token)
+            count = min(CREPE_BATCH_FRAMES, n_frames - start)
+            chunk = audio[start * hop_length:]
+            frames = as_strided(chunk, shape=(count, CREPE_FRAME_LENGTH),
+                                strides=(hop_length * chunk.itemsize, chunk.itemsize)).copy()
+            frames -= np.mean(frames, axis=1)[:, np.newaxis]
+            frames /= np.clip(np.std(frames, axis=1)[:, np.newaxis], 1e-8, None)
+            activations.append(model.predict(frames, verbose=0))
+            report_progress(progress, 'crepe_inference', (start + count) / n_frames)
+        check_cancelled(cancel_token)
+        if not activations:
+            return np.zeros((0, 360), dtype=np.float32)
+        return np.concatenate(activations)
+    
+    def _crepe_decode(self, activation: np.ndarray, use_viterbi: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Giải mã activation thành (frequency, confidence) giống crepe.predict"""
+        # Activation từ cache là float16: giải mã ở float32
+        activation = np.asarray(activation, dtype=np.float32)
+        confidence = activation.max(axis=1) if len(activation) else np.zeros(0)
+        if use_viterbi and len(activation):
+            cents = self._crepe_model.core.to_viterbi_cents(activation)
+        else:
+            cents = self._crepe_model.core.to_local_average_cents(activation)
+        frequency = 10 * 2 ** (np.asarray(cents, dtype=self.dtype) / 1200)
+        frequency[np.isnan(frequency)] = 0
+        return frequency, confidence
+    
+    def extract_pitch_crepe(self, audio_path: AudioSource, step_size: int = 50, use_viterbi: bool = False,
+                            confidence_threshold: float = 0.4, sample_rate: Optional[int] = None,
+                            dtype: str = 'float32', cancel_token: Optional[CancellationToken] = None,
+                            progress: Optional[ProgressCallback] = None, start: Optional[float] = None,
+                            end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
         """
         Trích xuất pitch sử dụng CREPE
         
         Args:
-            audio_path: Đường dẫn file audio
+            audio_path: Đường dẫn file audio hoặc PCM trong bộ nhớ (numpy array, bytes, memoryview)
             step_size: Độ phân giải tính bằng milliseconds (50ms mặc định cho tốc độ cao, 10ms = 100Hz cho độ chính xác cao)
             use_viterbi: Sử dụng Viterbi smoothing (False để tăng tốc, True cho độ chính xác cao hơn)
             confidence_threshold: Ngưỡng confidence (0.4 mặc định, thấp hơn = giữ lại nhiều điểm hơn)
+            sample_rate: Sample rate của PCM (chỉ dùng khi truyền PCM)
+            dtype: Kiểu sample của PCM thô (chỉ dùng khi truyền bytes/memoryview)
+            cancel_token: Token hủy, kiểm tra giữa các batch suy luận (ném ScoringCancelled)
+            progress: Callback progress(stage, fraction) - 'crepe_inference' theo từng batch
+            start, end: Chỉ trích xuất đoạn [start, end] giây (None = từ đầu / tới hết). Chỉ
+                        đoạn này cộng WINDOW_MARGIN_SECONDS mỗi bên được decode và suy luận;
+                        thời gian trả về vẫn tính từ đầu bài
+        
+        Khi có activation_cache, activation của cùng audio / capacity / step size / đoạn
+        được lấy từ cache: không decode audio, không chạy model, chỉ giải mã lại
+        (chọn đỉnh, Viterbi, ngưỡng confidence).
         
         Returns:
             (time, frequency): Mảng thời gian và mảng tần số (Hz)
@@ -82,46 +301,76 @@ class PitchExtractor:
             if not self._load_crepe():
                 raise ImportError("Không thể load CREPE model")
         
-        # Load audio - chỉ load với độ dài cần thiết nếu audio quá dài
-        audio, sr = librosa.load(audio_path, sr=16000)
+        offset, duration = decode_span(start, end)
+        activation = cache_key = None
+        if self.activation_cache is not None:
+            cache_key = activation_key(audio_path, sample_rate, dtype, model_capacity=self.model_capacity,
+                                       step_size=step_size, normalize_audio=self.normalize_audio,
+                                       offset=offset, duration=duration)
+            activation = self.activation_cache.get(cache_key)
         
-        # Normalize audio để đảm bảo công bằng khi so sánh (nếu được bật)
-        # Điều này giúp giảm ảnh hưởng của sự khác biệt về âm lượng
-        if self.normalize_audio and len(audio) > 0:
-            max_amp = np.max(np.abs(audio))
-            if max_amp > 0:
-                # Normalize về [-1, 1] range, nhưng giữ nguyên tỷ lệ
-                # Sử dụng peak normalization thay vì RMS để tránh làm mất dynamic range
-                audio = audio / max_amp * 0.95  # 0.95 để tránh clipping
+        if activation is None:
+            # Load audio (file hoặc PCM trong bộ nhớ), CREPE cần 16kHz
+            audio, sr = self.load_audio(audio_path, sample_rate=sample_rate, dtype=dtype,
+                                        target_sr=CREPE_SAMPLE_RATE, cancel_token=cancel_token,
+                                        offset=offset, duration=duration)
+            
+            # Normalize audio để đảm bảo công bằng khi so sánh (nếu được bật)
+            # Điều này giúp giảm ảnh hưởng của sự khác biệt về âm lượng
+            if self.normalize_audio and len(audio) > 0:
+                max_amp = np.max(np.abs(audio))
+                if max_amp > 0:
+                    # Normalize về [-1, 1] range, nhưng giữ nguyên tỷ lệ
+                    # Sử dụng peak normalization thay vì RMS để tránh làm mất dynamic range
+                    audio = audio / max_amp * 0.95  # 0.95 để tránh clipping
+            
+            # CREPE yêu cầu sample rate 16kHz
+            with stage('crepe_inference') as record:
+                activation = self._crepe_activation(audio, step_size, cancel_token, progress)
+                record.frames = len(activation)
+            if cache_key is not None:
+                activation = self.activation_cache.put(cache_key, activation)
         
-        # CREPE yêu cầu sample rate 16kHz
         # Tắt viterbi để tăng tốc (giảm một chút độ chính xác nhưng nhanh hơn đáng kể)
-        time, frequency, confidence, activation = self._crepe_model.predict(
-            audio, 
-            sr, 
-            viterbi=use_viterbi,  # Tắt viterbi để tăng tốc
-            model_capacity=self.model_capacity,
-            step_size=step_size
-        )
-        
-        # Lọc các pitch không đáng tin cậy với threshold thấp hơn để giữ lại nhiều điểm hơn
-        mask = confidence > confidence_threshold
-        time_filtered = time[mask]
-        frequency_filtered = frequency[mask]
-        
-        # Loại bỏ các giá trị 0 (không phát hiện được pitch)
-        mask_nonzero = frequency_filtered > 0
-        time_filtered = time_filtered[mask_nonzero]
-        frequency_filtered = frequency_filtered[mask_nonzero]
+        with stage('crepe_decode') as record:
+            frequency, confidence = self._crepe_decode(activation, use_viterbi)
+            time = (offset + np.arange(len(confidence)) * (step_size / 1000.0)).astype(self.dtype, copy=False)
+            record.frames = len(time)
+        
+        with stage('confidence_filter') as record:
+            # Lọc các pitch không đáng tin cậy với threshold thấp hơn để giữ lại nhiều điểm hơn
+            mask = confidence > confidence_threshold
+            # Bỏ phần margin, chỉ giữ frame trong cửa sổ
+            if start is not None:
+                mask &= time >= start
+            if end is not None:
+                mask &= time <= end
+            time_filtered = time[mask]
+            frequency_filtered = frequency[mask]
+            
+            # Loại bỏ các giá trị 0 (không phát hiện được pitch)
+            mask_nonzero = frequency_filtered > 0
+            time_filtered = time_filtered[mask_nonzero]
+            frequency_filtered = frequency_filtered[mask_nonzero]
+            record.frames = len(time_filtered)
         
         return time_filtered, frequency_filtered
     
-    def extract_pitch_basic_pitch(self, audio_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    def extract_pitch_basic_pitch(self, audio_path: AudioSource, sample_rate: Optional[int] = None,
+                                  dtype: str = 'float32', cancel_token: Optional[CancellationToken] = None,
+                                  progress: Optional[ProgressCallback] = None, start: Optional[float] = None,
+                                  end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
         """
         Trích xuất pitch sử dụng Basic Pitch
         
         Args:
-            audio_path: Đường dẫn file audio
+            audio_path: Đường dẫn file audio hoặc PCM trong bộ nhớ
+            sample_rate: Sample rate của PCM (chỉ dùng khi truyền PCM)
+            dtype: Kiểu sample của PCM thô
+            cancel_token: Token hủy (Basic Pitch chạy cả file một lần nên chỉ kiểm tra
+                          trước và sau suy luận)
+            progress: Callback progress(stage, fraction)
+            start, end: Chỉ trích xuất đoạn [start, end] giây (xem extract_pitch_crepe)
         
         Returns:
             (time, frequency): Mảng thời gian và mảng tần số (Hz)
@@ -130,12 +379,43 @@ class PitchExtractor:
             if not self._load_basic_pitch():
                 raise ImportError("Không thể load Basic Pitch model")
         
+        if not is_audio_path(audio_path):
+            # Basic Pitch chỉ nhận đường dẫn file nên PCM phải ghi ra file WAV tạm
+            if sample_rate is None:
+                raise ValueError("Cần truyền sample_rate khi dùng PCM trong bộ nhớ")
+            if start is None and end is None:
+                import tempfile
+                import soundfile as sf
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    tmp_path = os.path.join(tmp_dir, 'pcm.wav')
+                    sf.write(tmp_path, pcm_to_float(audio_path, dtype), sample_rate)
+                    return self.extract_pitch_basic_pitch(tmp_path, cancel_token=cancel_token,
+                                                          progress=progress)
+        
+        if start is not None or end is not None:
+            # Chỉ ghi đoạn cần chấm (kèm margin) ra WAV tạm rồi dời thời gian về mốc của bài
+            import tempfile
+            import soundfile as sf
+            offset, duration = decode_span(start, end)
+            audio, sr = self.load_audio(audio_path, sample_rate=sample_rate, dtype=dtype,
+                                        target_sr=BASIC_PITCH_SAMPLE_RATE, cancel_token=cancel_token,
+                                        offset=offset, duration=duration)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                tmp_path = os.path.join(tmp_dir, 'window.wav')
+                sf.write(tmp_path, audio, sr)
+                time, frequency = self.extract_pitch_basic_pitch(tmp_path, cancel_token=cancel_token,
+                                                                 progress=progress)
+            return window_contour((time + offset).astype(self.dtype, copy=False), frequency, start, end)
+        
+        check_cancelled(cancel_token)
+        report_progress(progress, 'basic_pitch_inference', 0.0)
         try:
             # Basic Pitch trả về MIDI notes, cần convert sang Hz
-            model_output, midi_data, note_events = self._basic_pitch_model['predict'](
-                audio_path,
-                self._basic_pitch_model['model_path']
-            )
+            with stage('basic_pitch_inference'):
+                model_output, midi_data, note_events = self._basic_pitch_model['predict'](
+                    audio_path,
+                    self._basic_pitch_model['model_path']
+                )
         except AttributeError as e:
             if "'_UserObject' object has no attribute 'add_slot'" in str(e):
                 error_msg = (
@@ -157,6 +437,8 @@ class PitchExtractor:
             error_msg = f"Lỗi khi chạy Basic Pitch: {str(e)}\n\n"
             error_msg += "Gợi ý: Thử sử dụng CREPE thay thế (nhanh hơn và ổn định hơn)"
             raise RuntimeError(error_msg) from e
+        check_cancelled(cancel_token)
+        report_progress(progress, 'basic_pitch_inference', 1.0)
         
         # Chuyển đổi MIDI notes sang frequency (Hz)
         # MIDI note 69 = A4 = 440 Hz
@@ -182,18 +464,24 @@ class PitchExtractor:
                 frequencies.extend(freq_points)
         
         if len(times) == 0:
-            return np.array([]), np.array([])
+            return np.array([], dtype=self.dtype), np.array([], dtype=self.dtype)
         
-        return np.array(times), np.array(frequencies)
+        return np.array(times, dtype=self.dtype), np.array(frequencies, dtype=self.dtype)
     
-    def extract_pitch(self, audio_path: str, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    def extract_pitch(self, audio_path: AudioSource, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
         """
         Trích xuất pitch từ audio
         
         Args:
-            audio_path: Đường dẫn file audio
+            audio_path: Đường dẫn file audio hoặc PCM trong bộ nhớ (numpy array,
+                        bytes, memoryview - bất kỳ object nào hỗ trợ buffer protocol)
             **kwargs: Các tham số bổ sung cho từng method
                     - normalize_audio: Override normalize setting (optional)
+                    - sample_rate: Sample rate của PCM (bắt buộc khi truyền PCM)
+                    - dtype: Kiểu sample của PCM thô (mặc định 'float32')
+                    - cancel_token: CancellationToken để hủy giữa chừng
+                    - progress: Callback progress(stage, fraction)
+                    - start, end: Chỉ trích xuất đoạn [start, end] giây của bài
         
         Returns:
             (time, frequency): Mảng thời gian và mảng tần số (Hz)
@@ -208,31 +496,34 @@ class PitchExtractor:
                 step_size = kwargs.get('step_size', 50)  # Mặc định 50ms cho tốc độ cao
                 use_viterbi = kwargs.get('use_viterbi', False)  # Tắt viterbi để tăng tốc
                 confidence_threshold = kwargs.get('confidence_threshold', 0.4)  # Threshold thấp hơn
-                return self.extract_pitch_crepe(audio_path, step_size, use_viterbi, confidence_threshold)
+                return self.extract_pitch_crepe(audio_path, step_size, use_viterbi, confidence_threshold,
+                                                sample_rate=kwargs.get('sample_rate'),
+                                                dtype=kwargs.get('dtype', 'float32'),
+                                                cancel_token=kwargs.get('cancel_token'),
+                                                progress=kwargs.get('progress'),
+                                                start=kwargs.get('start'), end=kwargs.get('end'))
             elif self.method == 'basic_pitch':
-                return self.extract_pitch_basic_pitch(audio_path)
+                return self.extract_pitch_basic_pitch(audio_path, sample_rate=kwargs.get('sample_rate'),
+                                                      dtype=kwargs.get('dtype', 'float32'),
+                                                      cancel_token=kwargs.get('cancel_token'),
+                                                      progress=kwargs.get('progress'),
+                                                      start=kwargs.get('start'), end=kwargs.get('end'))
             else:
                 raise ValueError(f"Method không hợp lệ: {self.method}. Chọn 'crepe' hoặc 'basic_pitch'")
         finally:
             # Khôi phục lại setting gốc
             self.normalize_audio = original_normalize
     
-    def extract_pitch_from_midi(self, midi_path: str, 
-                                track_filter: Optional[str] = None,
-                                pitch_range: Optional[Tuple[float, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    def _iter_midi_messages(self, midi_path: str, track_filter: Optional[str] = None):
         """
-        Trích xuất pitch từ file MIDI (cho reference)
+        Duyệt các message của những track được chọn kèm thời điểm (giây)
         
         Args:
             midi_path: Đường dẫn file MIDI
-            track_filter: Lọc track theo tên (ví dụ: 'vocal', 'voice', 'melody'). 
-                         Nếu None, lấy tất cả track.
-                         Có thể dùng 'auto' để tự động tìm track vocal.
-            pitch_range: Lọc theo khoảng pitch (Hz). Ví dụ: (80, 2000) cho vocal.
-                        Nếu None, không lọc theo pitch.
+            track_filter: Lọc track theo tên, 'auto' để tự tìm track vocal, None = tất cả
         
-        Returns:
-            (time, frequency): Mảng thời gian và mảng tần số (Hz)
+        Yields:
+            (current_time, msg)
         """
         try:
             from mido import MidiFile
@@ -241,8 +532,6 @@ class PitchExtractor:
             raise ImportError("Cần cài đặt mido: pip install mido")
         
         midi = MidiFile(midi_path)
-        times = []
-        frequencies = []
         
         # Từ khóa để nhận diện track vocal
         vocal_keywords = ['vocal', 'voice', 'sing', 'melody', 'lead', 'solo', 'vox']
@@ -298,6 +587,30 @@ class PitchExtractor:
                 if midi.ticks_per_beat > 0:
                     current_time += mido.tick2second(msg.time, midi.ticks_per_beat, tempo)
                 
+                yield current_time, msg
+    
+    def extract_pitch_from_midi(self, midi_path: str, 
+                                track_filter: Optional[str] = None,
+                                pitch_range: Optional[Tuple[float, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Trích xuất pitch từ file MIDI (cho reference)
+        
+        Args:
+            midi_path: Đường dẫn file MIDI
+            track_filter: Lọc track theo tên (ví dụ: 'vocal', 'voice', 'melody'). 
+                         Nếu None, lấy tất cả track.
+                         Có thể dùng 'auto' để tự động tìm track vocal.
+            pitch_range: Lọc theo khoảng pitch (Hz). Ví dụ: (80, 2000) cho vocal.
+                        Nếu None, không lọc theo pitch.
+        
+        Returns:
+            (time, frequency): Mảng thời gian và mảng tần số (Hz)
+        """
+        with stage('midi_parse') as record:
+            times = []
+            frequencies = []
+            
+            for current_time, msg in self._iter_midi_messages(midi_path, track_filter):
                 if msg.type == 'note_on' and msg.velocity > 0:
                     # Convert MIDI note to Hz
                     midi_note = msg.note
@@ -310,18 +623,55 @@ class PitchExtractor:
                     
                     times.append(current_time)
                     frequencies.append(freq)
-        
-        # Sắp xếp theo thời gian
-        if len(times) > 0:
-            sorted_indices = np.argsort(times)
-            times = np.array(times)[sorted_indices]
-            frequencies = np.array(frequencies)[sorted_indices]
-        else:
-            times = np.array([])
-            frequencies = np.array([])
+            
+            # Sắp xếp theo thời gian
+            if len(times) > 0:
+                sorted_indices = np.argsort(times)
+                times = np.array(times, dtype=self.dtype)[sorted_indices]
+                frequencies = np.array(frequencies, dtype=self.dtype)[sorted_indices]
+            else:
+                times = np.array([], dtype=self.dtype)
+                frequencies = np.array([], dtype=self.dtype)
+            record.frames = len(times)
         
         return times, frequencies
-
+    
+    def extract_notes_from_midi(self, midi_path: str,
+                                track_filter: Optional[str] = None,
+                                pitch_range: Optional[Tuple[float, float]] = None) -> np.ndarray:
+        """
+        Đọc các nốt (onset, offset, cao độ) từ file MIDI
+        
+        Args:
+            midi_path: Đường dẫn file MIDI
+            track_filter: Giống extract_pitch_from_midi
+            pitch_range: Giống extract_pitch_from_midi
+        
+        Returns:
+            Mảng shape (N, 3): onset (giây), offset (giây), cao độ (cents so với A4),
+            sắp xếp theo onset
+        """
+        with stage('midi_notes') as record:
+            notes = []
+            open_notes = {}  # (channel, note) -> danh sách onset đang mở
+            for current_time, msg in self._iter_midi_messages(midi_path, track_filter):
+                if msg.type not in ('note_on', 'note_off'):
+                    continue
+                key = (msg.channel, msg.note)
+                if msg.type == 'note_on' and msg.velocity > 0:
+                    open_notes.setdefault(key, []).append(current_time)
+                elif open_notes.get(key):
+                    # note_off hoặc note_on velocity 0 đóng nốt mở sớm nhất
+                    onset = open_notes[key].pop(0)
+                    notes.append((onset, current_time, (msg.note - 69) * 100.0))
+            
+            notes = np.array(notes, dtype=np.float64).reshape(-1, 3)
+            if pitch_range and len(notes) > 0:
+                freq = 440.0 * np.power(2.0, notes[:, 2] / 1200.0)
+                notes = notes[(freq >= pitch_range[0]) & (freq <= pitch_range[1])]
+            notes = notes[np.argsort(notes[:, 0], kind='stable')]
+            record.frames = len(notes)
+        return notes
 
 def hz_to_cents(hz: np.ndarray, reference_hz: float = 440.0) -> np.ndarray:
     """
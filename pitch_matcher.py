@@ -1,25 +1,212 @@
 """
 So khớp Pitch và tính điểm sử dụng DTW (Dynamic Time Warping)
 """
+import itertools
 import numpy as np
 from typing import Tuple, Optional
 from scipy.spatial.distance import euclidean
 from fastdtw import fastdtw
 import warnings
+from instrumentation import stage
+from cancellation import CancellationToken, check_cancelled
 warnings.filterwarnings('ignore')
 
+# Số lần gọi hàm khoảng cách giữa hai lần kiểm tra token hủy trong DTW
+DTW_CANCEL_CHECK_INTERVAL = 20000
+
+# Độ chính xác số cho contour, timeline, cents và độ lệch.
+# float32 giảm một nửa băng thông bộ nhớ; so với float64 final_score lệch < 0.05 điểm,
+# độ lệch cents < 0.02 (các phép cộng dồn luôn chạy trong float64)
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+
+# Chế độ voiced_only: hai frame có pitch cách nhau quá khoảng này (giây) thuộc hai đoạn khác nhau
+VOICED_MAX_GAP_SECONDS = 0.25
+
+# Tách nốt từ contour audio: lệch khỏi cao độ nốt hiện tại quá NOTE_SPLIT_CENTS trong
+# NOTE_SPLIT_FRAMES frame liên tiếp thì bắt đầu nốt mới; nốt ngắn hơn NOTE_MIN_SECONDS bị bỏ
+NOTE_SPLIT_CENTS = 70.0
+NOTE_SPLIT_FRAMES = 3
+NOTE_MIN_SECONDS = 0.1
+
+
+def resolve_precision(precision: str):
+    """'float64' / 'float32' -> kiểu NumPy tương ứng"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precision không hợp lệ: {precision}. Chọn 'float64' hoặc 'float32'")
+    return PRECISIONS[precision]
+
+
+def find_voiced_segments(time: np.ndarray, frequency: np.ndarray,
+                         max_gap: float = VOICED_MAX_GAP_SECONDS) -> np.ndarray:
+    """
+    Danh sách các đoạn có pitch (run-length theo thời gian) của một contour
+    
+    Contour từ extractor chỉ chứa frame có pitch, nên khoảng lặng là chỗ hai frame
+    liên tiếp cách nhau hơn max_gap. Mỗi đoạn được nới thêm nửa bước frame ở hai đầu
+    để lưới thời gian vẫn lấy mẫu được frame đầu / cuối.
+    
+    Args:
+        time: Mảng thời gian (tăng dần)
+        frequency: Mảng tần số (Hz), <= 0 hoặc NaN = không có pitch
+        max_gap: Khoảng trống tối đa (giây) trong cùng một đoạn
+    
+    Returns:
+        Mảng shape (N, 2): start, end (giây) của từng đoạn, tăng dần
+    """
+    time = np.asarray(time, dtype=np.float64)
+    frequency = np.asarray(frequency)
+    voiced = time[np.isfinite(frequency) & (frequency > 0)]
+    if len(voiced) == 0:
+        return np.zeros((0, 2))
+    steps = np.diff(voiced)
+    split = np.flatnonzero(steps > max_gap)
+    first = np.concatenate(([0], split + 1))
+    last = np.concatenate((split, [len(voiced) - 1]))
+    small_steps = steps[steps <= max_gap]
+    pad = float(np.median(small_steps)) / 2 if len(small_steps) else 0.0
+    return np.column_stack((voiced[first] - pad, voiced[last] + pad))
+
+
+def segment_notes(time: np.ndarray, frequency: np.ndarray,
+                  max_gap: float = VOICED_MAX_GAP_SECONDS,
+                  split_cents: float = NOTE_SPLIT_CENTS,
+                  split_frames: int = NOTE_SPLIT_FRAMES,
+                  min_duration: float = NOTE_MIN_SECONDS) -> np.ndarray:
+    """
+    Tách contour (thường là reference audio) thành các nốt
+    
+    Mỗi đoạn có pitch (find_voiced_segments) được chia tiếp khi cao độ rời khỏi
+    trung bình của nốt đang mở quá split_cents trong split_frames frame liên tiếp,
+    nên vibrato và các frame lạc đơn lẻ không tạo nốt mới. O(số frame).
+    
+    Args:
+        time: Mảng thời gian (tăng dần)
+        frequency: Mảng tần số (Hz), <= 0 hoặc NaN = không có pitch
+        max_gap: Khoảng trống tối đa (giây) trong một nốt
+        split_cents: Độ lệch (cents) so với nốt hiện tại để tính là đổi nốt
+        split_frames: Số frame lệch liên tiếp tối thiểu để đổi nốt
+        min_duration: Độ dài tối thiểu (giây) của một nốt
+    
+    Returns:
+        Mảng shape (N, 3) giống extract_notes_from_midi: onset, offset (giây),
+        cao độ (median cents so với A4)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    frequency = np.asarray(frequency, dtype=np.float64)
+    voiced = np.isfinite(frequency) & (frequency > 0)
+    time, cents = time[voiced], 1200 * np.log2(frequency[voiced] / 440.0)
+    if len(time) == 0:
+        return np.zeros((0, 3))
+    steps = np.diff(time)
+    small_steps = steps[steps <= max_gap]
+    pad = float(np.median(small_steps)) / 2 if len(small_steps) else 0.0
+    split = np.flatnonzero(steps > max_gap) + 1
+    
+    notes = []
+    for first, end in zip(np.concatenate(([0], split)), np.concatenate((split, [len(time)]))):
+        bounds = [first]
+        total, count, pending = cents[first], 1, None
+        for i in range(first + 1, end):
+            if abs(cents[i] - total / count) > split_cents:
+                if pending is None:
+                    pending = i
+                if i - pending + 1 >= split_frames:
+                    bounds.append(pending)
+                    total, count, pending = cents[pending:i + 1].sum(), i + 1 - pending, None
+            else:
+                total, count, pending = total + cents[i], count + 1, None
+        bounds.append(end)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            onset, offset = time[start] - pad, time[stop - 1] + pad
+            if offset - onset >= min_duration:
+                notes.append((onset, offset, float(np.median(cents[start:stop]))))
+    return np.array(notes, dtype=np.float64).reshape(-1, 3)
+
+
+def merge_segments(segments: np.ndarray) -> np.ndarray:
+    """Sắp xếp và gộp các đoạn chồng lên nhau (ví dụ nốt MIDI trong hợp âm), shape (N, 2)"""
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2)
+    if len(segments) < 2:
+        return segments
+    segments = segments[np.argsort(segments[:, 0], kind='stable')]
+    reach = np.maximum.accumulate(segments[:, 1])
+    # Đoạn mới bắt đầu khi không chồng lên các đoạn trước (chạm mép vẫn tách riêng)
+    first = np.flatnonzero(np.concatenate(([True], segments[1:, 0] >= reach[:-1])))
+    last = np.concatenate((first[1:], [len(segments)])) - 1
+    return np.column_stack((segments[first, 0], reach[last]))
+
+
+def intersect_segments(segments1: np.ndarray, segments2: np.ndarray) -> np.ndarray:
+    """Giao của hai danh sách đoạn (đã sắp xếp, không chồng nhau), shape (N, 2)"""
+    overlaps = []
+    i = j = 0
+    while i < len(segments1) and j < len(segments2):
+        start = max(segments1[i, 0], segments2[j, 0])
+        end = min(segments1[i, 1], segments2[j, 1])
+        if end >= start:
+            overlaps.append((start, end))
+        # Đoạn kết thúc trước không thể giao với đoạn nào phía sau của danh sách kia
+        if segments1[i, 1] < segments2[j, 1]:
+            i += 1
+        else:
+            j += 1
+    return np.array(overlaps, dtype=np.float64).reshape(-1, 2)
+
+
+def window_contour(time: np.ndarray, frequency: np.ndarray, start: Optional[float] = None,
+                   end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Các frame trong khoảng [start, end] giây (None = không giới hạn phía đó)"""
+    mask = np.ones(len(time), dtype=bool)
+    if start is not None:
+        mask &= time >= start
+    if end is not None:
+        mask &= time <= end
+    return time[mask], frequency[mask]
+
+
+def window_segments(segments: np.ndarray, start: Optional[float] = None,
+                    end: Optional[float] = None) -> np.ndarray:
+    """
+    Các đoạn / nốt giao với [start, end], onset và offset bị cắt về mép cửa sổ
+    
+    segments có shape (N, 2) hoặc (N, 3) (nốt: cột thứ ba được giữ nguyên).
+    """
+    segments = np.asarray(segments, dtype=np.float64)
+    keep = np.ones(len(segments), dtype=bool)
+    if start is not None:
+        keep &= segments[:, 1] > start
+    if end is not None:
+        keep &= segments[:, 0] < end
+    segments = segments[keep].copy()
+    if start is not None:
+        segments[:, :2] = np.maximum(segments[:, :2], start)
+    if end is not None:
+        segments[:, :2] = np.minimum(segments[:, :2], end)
+    return segments
+
 
 class PitchMatcher:
     """Lớp so khớp pitch và tính điểm"""
     
-    def __init__(self, tolerance_cents: float = 75.0, difficulty_mode: str = 'normal'):
+    def __init__(self, tolerance_cents: float = 75.0, difficulty_mode: str = 'normal',
+                 precision: str = 'float64', voiced_only: bool = False,
+                 max_voiced_gap: float = VOICED_MAX_GAP_SECONDS):
         """
         Args:
             tolerance_cents: Độ lệch cho phép tính bằng cents (75 cents mặc định - dễ hơn)
             difficulty_mode: 'easy', 'normal', 'hard' - điều chỉnh độ khó chấm điểm
+            precision: 'float64' hoặc 'float32' cho timeline, tần số, cents và độ lệch
+            voiced_only: Chỉ căn chỉnh và chấm trong các đoạn cả hai bên cùng có pitch,
+                         không nội suy qua khoảng lặng (mặc định False - giữ cách chấm cũ)
+            max_voiced_gap: Khoảng trống tối đa (giây) trong một đoạn có pitch
         """
         self.tolerance_cents = tolerance_cents
         self.difficulty_mode = difficulty_mode
+        self.precision = precision
+        self.dtype = resolve_precision(precision)
+        self.voiced_only = voiced_only
+        self.max_voiced_gap = max_voiced_gap
     
     def interpolate_pitch(self, time: np.ndarray, frequency: np.ndarray, 
                          target_times: np.ndarray) -> np.ndarray:
@@ -35,12 +222,12 @@ class PitchMatcher:
             Mảng tần số đã nội suy
         """
         if len(time) == 0 or len(frequency) == 0:
-            return np.zeros_like(target_times)
+            return np.zeros_like(target_times, dtype=self.dtype)
         
         # Loại bỏ các giá trị NaN hoặc Inf
         mask = np.isfinite(frequency) & (frequency > 0)
         if np.sum(mask) == 0:
-            return np.zeros_like(target_times)
+            return np.zeros_like(target_times, dtype=self.dtype)
         
         time_clean = time[mask]
         freq_clean = frequency[mask]
@@ -50,24 +237,106 @@ class PitchMatcher:
                                  left=freq_clean[0] if len(freq_clean) > 0 else 0,
                                  right=freq_clean[-1] if len(freq_clean) > 0 else 0)
         
-        return interpolated
+        # np.interp luôn trả về float64
+        return interpolated.astype(self.dtype, copy=False)
+    
+    def interpolate_segments(self, time: np.ndarray, frequency: np.ndarray,
+                             target_times: np.ndarray, segments: np.ndarray) -> np.ndarray:
+        """
+        Nội suy pitch chỉ bên trong các đoạn có pitch
+        
+        Điểm đích ngoài mọi đoạn nhận 0 (không có pitch). Trong một đoạn, chỉ các frame
+        thuộc đoạn đó được dùng: giữa hai frame nội suy tuyến tính, ở mép đoạn giữ
+        nguyên giá trị frame gần nhất (không kéo pitch của đoạn bên cạnh sang).
+        
+        Args:
+            time: Mảng thời gian gốc
+            frequency: Mảng tần số gốc
+            target_times: Mảng thời gian đích (tăng dần)
+            segments: Các đoạn (start, end) từ find_voiced_segments
+        
+        Returns:
+            Mảng tần số đã nội suy
+        """
+        target = np.asarray(target_times, dtype=np.float64)
+        result = np.zeros(len(target), dtype=self.dtype)
+        mask = np.isfinite(frequency) & (frequency > 0)
+        if len(segments) == 0 or not np.any(mask):
+            return result
+        time_clean = np.asarray(time, dtype=np.float64)[mask]
+        freq_clean = np.asarray(frequency, dtype=np.float64)[mask]
+        
+        # Đoạn chứa từng điểm đích
+        seg = np.searchsorted(segments[:, 0], target, side='right') - 1
+        seg_start = segments[np.clip(seg, 0, None), 0]
+        seg_end = segments[np.clip(seg, 0, None), 1]
+        inside = (seg >= 0) & (target <= seg_end)
+        
+        # Frame trước / sau điểm đích, chỉ tính nếu cùng đoạn. Frame nằm đúng mép cuối
+        # thường là frame đầu của đoạn kế tiếp (nốt MIDI liền nhau) nên không được dùng
+        hi = np.searchsorted(time_clean, target, side='left')
+        lo = hi - 1
+        hi_c = np.clip(hi, 0, len(time_clean) - 1)
+        lo_c = np.clip(lo, 0, len(time_clean) - 1)
+        exact = (hi < len(time_clean)) & (time_clean[hi_c] == target)
+        has_lo = (lo >= 0) & (time_clean[lo_c] >= seg_start)
+        has_hi = (hi < len(time_clean)) & (time_clean[hi_c] < seg_end)
+        
+        span = time_clean[hi_c] - time_clean[lo_c]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(span > 0, (target - time_clean[lo_c]) / span, 1.0)
+        value = np.where(has_lo & has_hi,
+                         freq_clean[lo_c] + weight * (freq_clean[hi_c] - freq_clean[lo_c]),
+                         np.where(has_lo, freq_clean[lo_c], np.where(has_hi, freq_clean[hi_c], 0.0)))
+        value = np.where(exact, freq_clean[hi_c], value)
+        result[inside] = value[inside]
+        return result
+    
+    def voiced_grid(self, segments: np.ndarray, sample_rate: float) -> np.ndarray:
+        """Các mốc k / sample_rate nằm trong các đoạn (lưới chung, bỏ qua khoảng lặng)"""
+        if len(segments) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        first = np.ceil(segments[:, 0] * sample_rate - 1e-9).astype(np.int64)
+        last = np.floor(segments[:, 1] * sample_rate + 1e-9).astype(np.int64)
+        counts = np.maximum(last - first + 1, 0)
+        # Ghép arange của từng đoạn mà không cần vòng lặp Python
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        # Hai đoạn chạm mép nhau cùng chứa mốc ở mép, chỉ giữ một
+        steps = np.unique(np.repeat(first, counts) + offsets)
+        return (steps / sample_rate).astype(self.dtype, copy=False)
     
     def align_time_series(self, time1: np.ndarray, freq1: np.ndarray,
                          time2: np.ndarray, freq2: np.ndarray,
-                         sample_rate: float = 10.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+                         sample_rate: float = 10.0,
+                         segments2: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Căn chỉnh hai chuỗi pitch về cùng resolution thời gian
         
+        Với voiced_only, timeline chỉ gồm các mốc nằm trong đoạn mà cả hai chuỗi
+        cùng có pitch (không còn đều nhau), khoảng lặng bị bỏ qua hoàn toàn.
+        
         Args:
             time1: Thời gian của pitch 1
             freq1: Tần số của pitch 1
             time2: Thời gian của pitch 2
             freq2: Tần số của pitch 2
             sample_rate: Số điểm mẫu mỗi giây (Hz)
+            segments2: Các đoạn có pitch của chuỗi 2 nếu đã biết trước (ví dụ các nốt
+                       MIDI), None = tự tìm từ contour. Chỉ dùng với voiced_only
         
         Returns:
             (aligned_time, aligned_freq1, aligned_freq2)
         """
+        if self.voiced_only:
+            segments1 = find_voiced_segments(time1, freq1, self.max_voiced_gap)
+            if segments2 is None:
+                segments2 = find_voiced_segments(time2, freq2, self.max_voiced_gap)
+            segments2 = merge_segments(segments2)
+            aligned_time = self.voiced_grid(intersect_segments(segments1, segments2), sample_rate)
+            return (aligned_time,
+                    self.interpolate_segments(time1, freq1, aligned_time, segments1),
+                    self.interpolate_segments(time2, freq2, aligned_time, segments2))
+        
         # Tìm khoảng thời gian chung
         start_time = max(time1[0] if len(time1) > 0 else 0, 
                         time2[0] if len(time2) > 0 else 0)
@@ -83,7 +352,8 @@ class PitchMatcher:
         
         # Tạo timeline mới với resolution cố định
         dt = 1.0 / sample_rate
-        aligned_time = np.arange(start_time, end_time + dt, dt)
+        # Tính trong float64 rồi mới ép kiểu để mốc thời gian không bị trôi theo độ dài bài
+        aligned_time = np.arange(start_time, end_time + dt, dt).astype(self.dtype, copy=False)
         
         # Nội suy cả hai chuỗi về timeline mới
         aligned_freq1 = self.interpolate_pitch(time1, freq1, aligned_time)
@@ -93,18 +363,21 @@ class PitchMatcher:
     
     def hz_to_cents(self, hz: np.ndarray, reference_hz: float = 440.0) -> np.ndarray:
         """Chuyển đổi Hz sang Cents"""
+        hz = np.asarray(hz, dtype=self.dtype)
         with np.errstate(divide='ignore', invalid='ignore'):
-            cents = 1200 * np.log2(hz / reference_hz)
+            cents = 1200 * np.log2(hz / self.dtype(reference_hz))
             cents = np.nan_to_num(cents, nan=0.0, posinf=0.0, neginf=0.0)
         return cents
     
-    def calculate_dtw_distance(self, pitch1: np.ndarray, pitch2: np.ndarray) -> Tuple[float, list]:
+    def calculate_dtw_distance(self, pitch1: np.ndarray, pitch2: np.ndarray,
+                               cancel_token: Optional[CancellationToken] = None) -> Tuple[float, list]:
         """
         Tính khoảng cách DTW giữa hai chuỗi pitch
         
         Args:
             pitch1: Chuỗi pitch 1 (đã chuyển sang cents)
             pitch2: Chuỗi pitch 2 (đã chuyển sang cents)
+            cancel_token: Token hủy, kiểm tra định kỳ trong lúc fastdtw chạy
         
         Returns:
             (distance, path): Khoảng cách DTW và đường đi
@@ -119,47 +392,35 @@ class PitchMatcher:
         pitch1_clean = pitch1[mask1]
         pitch2_clean = pitch2[mask2]
         
-        # Reshape cho fastdtw (cần 2D array)
-        pitch1_2d = pitch1_clean.reshape(-1, 1)
-        pitch2_2d = pitch2_clean.reshape(-1, 1)
+        # Reshape cho fastdtw (cần 2D array); float64 để tổng khoảng cách cộng dồn không mất chính xác
+        pitch1_2d = pitch1_clean.reshape(-1, 1).astype(np.float64, copy=False)
+        pitch2_2d = pitch2_clean.reshape(-1, 1).astype(np.float64, copy=False)
+        
+        dist = euclidean
+        if cancel_token is not None:
+            # fastdtw không có điểm dừng, kiểm tra token trong hàm khoảng cách
+            calls = itertools.count()
+            
+            def dist(u, v):
+                if next(calls) % DTW_CANCEL_CHECK_INTERVAL == 0:
+                    cancel_token.raise_if_cancelled()
+                return euclidean(u, v)
         
         # Tính DTW
-        distance, path = fastdtw(pitch1_2d, pitch2_2d, dist=euclidean)
+        distance, path = fastdtw(pitch1_2d, pitch2_2d, dist=dist)
         
         return distance, path
     
-    def calculate_accuracy(self, pitch_user: np.ndarray, pitch_reference: np.ndarray) -> float:
+    def graded_scores(self, deviation: np.ndarray) -> np.ndarray:
         """
-        Tính độ chính xác pitch với điểm trung gian (graded scoring)
+        Điểm (0-1) cho từng độ lệch (cents, không âm) theo các mức tolerance
         
         Args:
-            pitch_user: Pitch người hát (cents)
-            pitch_reference: Pitch chuẩn (cents)
+            deviation: Mảng độ lệch tuyệt đối (cents)
         
         Returns:
-            Độ chính xác (0-1) với điểm trung gian
+            Mảng điểm cùng shape với deviation
         """
-        if len(pitch_user) == 0 or len(pitch_reference) == 0:
-            return 0.0
-        
-        # Căn chỉnh về cùng độ dài
-        min_len = min(len(pitch_user), len(pitch_reference))
-        pitch_user_aligned = pitch_user[:min_len]
-        pitch_reference_aligned = pitch_reference[:min_len]
-        
-        # Loại bỏ các điểm không có pitch (0 hoặc NaN)
-        mask = (pitch_user_aligned != 0) & (pitch_reference_aligned != 0) & \
-               np.isfinite(pitch_user_aligned) & np.isfinite(pitch_reference_aligned)
-        
-        if np.sum(mask) == 0:
-            return 0.0
-        
-        pitch_user_valid = pitch_user_aligned[mask]
-        pitch_reference_valid = pitch_reference_aligned[mask]
-        
-        # Tính độ lệch
-        deviation = np.abs(pitch_user_valid - pitch_reference_valid)
-        
         # Tính điểm với hệ thống điểm trung gian (graded scoring) - CẢI THIỆN ĐỂ DỄ HƠN
         # Điểm giảm dần theo độ lệch thay vì chỉ đúng/sai
         # Mở rộng phạm vi để cho điểm cao hơn
@@ -193,14 +454,87 @@ class PitchMatcher:
             scores[mask_very_loose] = 0.39 - 0.29 * (deviation[mask_very_loose] - tolerance_loose) / (tolerance_very_loose - tolerance_loose)
         
         # Điểm 0 nếu ngoài tolerance_very_loose (nhưng không bị trừ điểm)
+        return scores
+    
+    def calculate_accuracy(self, pitch_user: np.ndarray, pitch_reference: np.ndarray) -> float:
+        """
+        Tính độ chính xác pitch với điểm trung gian (graded scoring)
+        
+        Args:
+            pitch_user: Pitch người hát (cents)
+            pitch_reference: Pitch chuẩn (cents)
         
-        # Tính accuracy trung bình
-        accuracy = np.mean(scores)
+        Returns:
+            Độ chính xác (0-1) với điểm trung gian
+        """
+        if len(pitch_user) == 0 or len(pitch_reference) == 0:
+            return 0.0
+        
+        # Căn chỉnh về cùng độ dài
+        min_len = min(len(pitch_user), len(pitch_reference))
+        pitch_user_aligned = pitch_user[:min_len]
+        pitch_reference_aligned = pitch_reference[:min_len]
+        
+        # Loại bỏ các điểm không có pitch (0 hoặc NaN)
+        mask = (pitch_user_aligned != 0) & (pitch_reference_aligned != 0) & \
+               np.isfinite(pitch_user_aligned) & np.isfinite(pitch_reference_aligned)
+        
+        if np.sum(mask) == 0:
+            return 0.0
+        
+        pitch_user_valid = pitch_user_aligned[mask]
+        pitch_reference_valid = pitch_reference_aligned[mask]
+        
+        # Tính độ lệch
+        deviation = np.abs(pitch_user_valid - pitch_reference_valid)
+        
+        scores = self.graded_scores(deviation)
+        
+        # Tính accuracy trung bình (cộng dồn trong float64)
+        accuracy = float(np.mean(scores, dtype=np.float64))
         return accuracy
     
+    def align_cents(self, time_user: np.ndarray, freq_user: np.ndarray,
+                    time_reference: np.ndarray, freq_reference: np.ndarray,
+                    sample_rate: float = 10.0,
+                    cancel_token: Optional[CancellationToken] = None,
+                    reference_segments: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Căn chỉnh hai chuỗi pitch về cùng timeline và chuyển sang cents
+        
+        Args:
+            time_user: Thời gian pitch người hát
+            freq_user: Tần số pitch người hát (Hz)
+            time_reference: Thời gian pitch chuẩn
+            freq_reference: Tần số pitch chuẩn (Hz)
+            sample_rate: Resolution thời gian (Hz)
+            cancel_token: Token hủy (kiểm tra trước mỗi bước)
+            reference_segments: Các đoạn có pitch của reference (voiced_only), ví dụ
+                                onset / offset các nốt MIDI; None = tự tìm từ contour
+        
+        Returns:
+            (aligned_time, cents_user, cents_reference) - 0 cents = không có pitch
+        """
+        # Căn chỉnh về cùng timeline
+        check_cancelled(cancel_token)
+        with stage('align') as record:
+            aligned_time, aligned_freq_user, aligned_freq_reference = \
+                self.align_time_series(time_user, freq_user, 
+                                     time_reference, freq_reference, 
+                                     sample_rate, segments2=reference_segments)
+            record.frames = len(aligned_time)
+        
+        # Chuyển sang Cents
+        with stage('cents', frames=len(aligned_time)):
+            cents_user = self.hz_to_cents(aligned_freq_user)
+            cents_reference = self.hz_to_cents(aligned_freq_reference)
+        return aligned_time, cents_user, cents_reference
+    
     def calculate_score(self, time_user: np.ndarray, freq_user: np.ndarray,
                        time_reference: np.ndarray, freq_reference: np.ndarray,
-                       sample_rate: float = 10.0) -> dict:
+                       sample_rate: float = 10.0,
+                       cancel_token: Optional[CancellationToken] = None,
+                       reference_segments: Optional[np.ndarray] = None) -> dict:
         """
         Tính điểm số tổng hợp
         
@@ -210,25 +544,41 @@ class PitchMatcher:
             time_reference: Thời gian pitch chuẩn
             freq_reference: Tần số pitch chuẩn (Hz)
             sample_rate: Resolution thời gian (Hz)
+            cancel_token: Token hủy (ném ScoringCancelled)
+            reference_segments: Xem align_cents
         
         Returns:
             Dictionary chứa các điểm số và metrics
         """
-        # Căn chỉnh về cùng timeline
-        aligned_time, aligned_freq_user, aligned_freq_reference = \
-            self.align_time_series(time_user, freq_user, 
-                                 time_reference, freq_reference, 
-                                 sample_rate)
+        aligned_time, cents_user, cents_reference = \
+            self.align_cents(time_user, freq_user, time_reference, freq_reference, sample_rate,
+                             cancel_token=cancel_token, reference_segments=reference_segments)
+        return self.score_aligned(aligned_time, cents_user, cents_reference, cancel_token=cancel_token)
+    
+    def score_aligned(self, aligned_time: np.ndarray, cents_user: np.ndarray,
+                      cents_reference: np.ndarray,
+                      cancel_token: Optional[CancellationToken] = None) -> dict:
+        """
+        Tính điểm từ pitch đã căn chỉnh (kết quả của align_cents)
         
-        # Chuyển sang Cents
-        cents_user = self.hz_to_cents(aligned_freq_user)
-        cents_reference = self.hz_to_cents(aligned_freq_reference)
+        Args:
+            aligned_time: Timeline chung
+            cents_user: Pitch người hát (cents)
+            cents_reference: Pitch chuẩn (cents)
+            cancel_token: Token hủy, kiểm tra cả trong DTW
         
+        Returns:
+            Dictionary chứa các điểm số và metrics
+        """
         # Tính accuracy
-        accuracy = self.calculate_accuracy(cents_user, cents_reference)
+        check_cancelled(cancel_token)
+        with stage('accuracy', frames=len(aligned_time)):
+            accuracy = self.calculate_accuracy(cents_user, cents_reference)
         
         # Tính DTW distance
-        dtw_distance, dtw_path = self.calculate_dtw_distance(cents_user, cents_reference)
+        with stage('dtw', frames=len(aligned_time)):
+            dtw_distance, dtw_path = self.calculate_dtw_distance(cents_user, cents_reference,
+                                                                 cancel_token=cancel_token)
         
         # Normalize DTW distance thành điểm (0-100)
         # Cải thiện công thức để dễ đạt điểm cao hơn
@@ -258,7 +608,7 @@ class PitchMatcher:
         mask = (cents_user != 0) & (cents_reference != 0) & \
                np.isfinite(cents_user) & np.isfinite(cents_reference)
         if np.sum(mask) > 0:
-            mae_cents = np.mean(np.abs(cents_user[mask] - cents_reference[mask]))
+            mae_cents = float(np.mean(np.abs(cents_user[mask] - cents_reference[mask]), dtype=np.float64))
         else:
             mae_cents = float('inf')
         
@@ -294,6 +644,86 @@ class PitchMatcher:
             'dtw_score': round(dtw_score, 2),
             'dtw_distance': round(dtw_distance, 2),
             'mae_cents': round(mae_cents, 2),
-            'duration': round(aligned_time[-1] - aligned_time[0], 2) if len(aligned_time) > 0 else 0.0
+            'duration': round(float(aligned_time[-1] - aligned_time[0]), 2) if len(aligned_time) > 0 else 0.0
         }
 
+    
+    def score_notes(self, time_user: np.ndarray, freq_user: np.ndarray, notes: np.ndarray,
+                    cancel_token: Optional[CancellationToken] = None) -> dict:
+        """
+        Chấm điểm theo từng nốt của reference (không cần DTW)
+        
+        Frame của người hát nằm trong cửa sổ [onset, offset) của mỗi nốt được gộp
+        thành median cents; điểm nốt = graded_scores(|median - cao độ nốt|) x độ phủ
+        (tỷ lệ thời gian nốt có pitch của người hát). Chi phí O(số nốt + số frame).
+        
+        Args:
+            time_user: Thời gian pitch người hát (tăng dần)
+            freq_user: Tần số pitch người hát (Hz)
+            notes: Nốt reference shape (N, 3) từ segment_notes / extract_notes_from_midi
+            cancel_token: Token hủy
+        
+        Returns:
+            Dictionary: final_score, accuracy (% nốt hát đúng), mae_cents (None nếu
+            không hát nốt nào), duration, notes_total, notes_sung, notes_hit và notes
+            (kết quả từng nốt cho UI)
+        """
+        check_cancelled(cancel_token)
+        notes = np.asarray(notes, dtype=np.float64).reshape(-1, 3)
+        time_user = np.asarray(time_user, dtype=np.float64)
+        voiced = np.isfinite(freq_user) & (freq_user > 0)
+        time_voiced = time_user[voiced]
+        cents_voiced = self.hz_to_cents(freq_user[voiced])
+        steps = np.diff(time_voiced)
+        small_steps = steps[steps <= VOICED_MAX_GAP_SECONDS]
+        hop = float(np.median(small_steps)) if len(small_steps) else 0.0
+        
+        with stage('notes', frames=len(notes)):
+            # Vị trí frame đầu / cuối (exclusive) của mỗi cửa sổ nốt
+            first = np.searchsorted(time_voiced, notes[:, 0], side='left')
+            last = np.searchsorted(time_voiced, notes[:, 1], side='left')
+            counts = last - first
+            # Median từng cửa sổ không cần vòng lặp Python: ghép chỉ số frame của mọi
+            # cửa sổ, sắp xếp theo (nốt, cents) rồi lấy (trung bình) phần tử giữa
+            owner = np.repeat(np.arange(len(notes)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            window_cents = cents_voiced[np.repeat(first, counts) + offsets]
+            window_cents = window_cents[np.lexsort((window_cents, owner))]
+            starts = np.cumsum(counts) - counts
+            sung_mask = counts > 0
+            sung = np.full(len(notes), np.nan)
+            lower = starts[sung_mask] + (counts[sung_mask] - 1) // 2
+            upper = starts[sung_mask] + counts[sung_mask] // 2
+            sung[sung_mask] = (window_cents[lower] + window_cents[upper]) / 2
+            
+            duration = notes[:, 1] - notes[:, 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                coverage = np.where(duration > 0, np.clip(counts * hop / duration, 0.0, 1.0),
+                                    (counts > 0).astype(np.float64))
+            deviation = np.abs(sung - notes[:, 2])
+            scores = np.where(counts > 0, self.graded_scores(np.nan_to_num(deviation, nan=np.inf)), 0.0) * coverage
+            # Nốt "đúng": trong mức tolerance_normal và được hát ít nhất nửa thời gian
+            hit = (counts > 0) & (deviation <= self.tolerance_cents * 1.2) & (coverage >= 0.5)
+        
+        weights = duration if duration.sum() > 0 else np.ones(len(notes))
+        final_score = 100 * float(np.sum(scores * weights) / np.sum(weights)) if len(notes) else 0.0
+        per_note = [{
+            'onset': round(float(notes[i, 0]), 3),
+            'offset': round(float(notes[i, 1]), 3),
+            'target_cents': round(float(notes[i, 2]), 2),
+            'sung_cents': round(float(sung[i]), 2) if sung_mask[i] else None,
+            'deviation_cents': round(float(sung[i] - notes[i, 2]), 2) if sung_mask[i] else None,
+            'coverage': round(float(coverage[i]), 3),
+            'score': round(float(scores[i]) * 100, 2),
+        } for i in range(len(notes))]
+        
+        return {
+            'final_score': round(final_score, 2),
+            'accuracy': round(100 * float(np.mean(hit)), 2) if len(notes) else 0.0,
+            'mae_cents': round(float(np.mean(deviation[sung_mask])), 2) if np.any(sung_mask) else None,
+            'duration': round(float(notes[:, 1].max() - notes[:, 0].min()), 2) if len(notes) else 0.0,
+            'notes_total': len(notes),
+            'notes_sung': int(np.sum(sung_mask)),
+            'notes_hit': int(np.sum(hit)),
+            'notes': per_note
+        }
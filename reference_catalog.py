@@ -0,0 +1,365 @@
+"""
+Kho contour reference dùng chung cho cả catalog bài hát (một file, append-only, memory-mapped)
+
+Tính sẵn contour của hàng nghìn bài một lần; worker mới khởi động chỉ cần mmap file
+catalog và tra theo song ID, không phải đọc hay decode audio reference.
+
+Bố cục file (little-endian):
+    Header file 16 byte: magic b'KCAT', version u16, reserved (10 byte)
+    Các record nối tiếp nhau, mỗi record căn theo 8 byte:
+        Header record 40 byte:
+            magic        4s   b'KREC'
+            record_size  u32  tổng số byte của record (kể cả header và padding)
+            id_len       u16  độ dài song ID (UTF-8)
+            flags        u16  FLAG_TIME_FLOAT32 nếu time lưu dạng float32
+            frame_count  u32
+            note_count   u32
+            meta_len     u32  độ dài metadata JSON (UTF-8)
+            t0           f64  thời điểm frame đầu tiên (giây)
+            reserved     u64
+        song ID, metadata JSON, padding
+        time:  uint16[frame_count] delta (ms) so với frame trước, frame đầu = t0
+               (float32 tuyệt đối nếu có khoảng trống > 65.535 giây)
+        cents: int16[frame_count], đơn vị 1/CENTS_SCALE cent so với A4
+        notes: float32[note_count, 3] (onset, offset, cents) - nốt MIDI hoặc tách từ contour audio
+
+Song ID xuất hiện nhiều lần thì record cuối cùng được dùng. Record ghi dở (process
+bị kill khi đang ghi) bị bỏ qua khi mở.
+
+Xây catalog:
+    python reference_catalog.py build songs/ catalog.kcat --method crepe
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FILE_MAGIC = b'KCAT'
+RECORD_MAGIC = b'KREC'
+FORMAT_VERSION = 1
+FILE_HEADER_FORMAT = '<4sH10x'
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER_FORMAT)
+RECORD_HEADER_FORMAT = '<4sIHHIIIdQ'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+
+FLAG_TIME_FLOAT32 = 1
+
+# Cents lưu với độ phân giải 0.25 cent: int16 chứa được khoảng ±8191 cents (~4 Hz - 47 kHz)
+CENTS_SCALE = 4.0
+TIME_QUANTUM = 0.001
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a')
+MIDI_EXTENSIONS = ('.mid', '.midi')
+
+_ALIGN = 8
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def encode_record(song_id: str, time: np.ndarray, frequency: np.ndarray,
+                  notes: Optional[np.ndarray] = None, metadata: Optional[Dict] = None) -> bytes:
+    """
+    Mã hóa contour một bài thành record catalog
+
+    Args:
+        song_id: ID bài hát
+        time: Thời điểm các frame (giây, tăng dần)
+        frequency: Tần số (Hz) - frame <= 0 Hz bị bỏ
+        notes: Mảng (N, 3) onset, offset, cents (tùy chọn)
+        metadata: Dictionary JSON được (nguồn, tham số trích xuất, ...)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    frequency = np.asarray(frequency, dtype=np.float64)
+    voiced = frequency > 0
+    time, frequency = time[voiced], frequency[voiced]
+
+    cents = 1200.0 * np.log2(frequency / 440.0)
+    cents_q = np.clip(np.rint(cents * CENTS_SCALE), -32767, 32767).astype('<i2')
+
+    frame_count = len(time)
+    t0 = float(time[0]) if frame_count else 0.0
+    ticks = np.rint((time - t0) / TIME_QUANTUM).astype(np.int64)
+    deltas = np.diff(ticks, prepend=0)
+    flags = 0
+    if frame_count and (deltas.min() < 0 or deltas.max() > 0xFFFF):
+        flags |= FLAG_TIME_FLOAT32
+        time_column = time.astype('<f4')
+    else:
+        time_column = deltas.astype('<u2')
+
+    notes_column = np.asarray(notes if notes is not None else np.empty((0, 3)), dtype='<f4').reshape(-1, 3)
+    id_bytes = song_id.encode('utf-8')
+    meta_bytes = json.dumps(metadata or {}, ensure_ascii=False).encode('utf-8')
+
+    parts = [id_bytes, meta_bytes]
+    offset = RECORD_HEADER_SIZE + len(id_bytes) + len(meta_bytes)
+    for column in (time_column, cents_q, notes_column):
+        padded = _aligned(offset)
+        parts.append(b'\0' * (padded - offset))
+        parts.append(column.tobytes())
+        offset = padded + column.nbytes
+    record_size = _aligned(offset)
+    parts.append(b'\0' * (record_size - offset))
+
+    header = struct.pack(RECORD_HEADER_FORMAT, RECORD_MAGIC, record_size, len(id_bytes), flags,
+                         frame_count, len(notes_column), len(meta_bytes), t0, 0)
+    return header + b''.join(parts)
+
+
+class ReferenceCatalog:
+    """
+    Đọc / ghi catalog contour reference
+
+    Đọc qua mmap nên nhiều worker process dùng chung page cache của OS. Có thể gọi
+    add() trong lúc process khác đang đọc; reader gọi refresh() để thấy record mới.
+    """
+
+    def __init__(self, path: str, create: bool = True):
+        """
+        Args:
+            path: Đường dẫn file catalog
+            create: Tạo file mới nếu chưa có
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._index: Dict[str, int] = {}
+        self._mmap = None
+        self._mapped_size = 0
+
+        if not os.path.exists(path):
+            if not create:
+                raise FileNotFoundError(f"Catalog not found: {path}")
+            with open(path, 'wb') as f:
+                f.write(struct.pack(FILE_HEADER_FORMAT, FILE_MAGIC, FORMAT_VERSION))
+        self.refresh()
+
+    def refresh(self):
+        """Map lại file và đọc thêm các record mới được ghi vào cuối"""
+        with self._lock:
+            size = os.path.getsize(self.path)
+            if size == self._mapped_size:
+                return
+            # Không close() mmap cũ: thread khác có thể còn đang đọc qua view NumPy,
+            # vùng map cũ được giải phóng khi không còn ai tham chiếu
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version = struct.unpack_from(FILE_HEADER_FORMAT, self._mmap, 0)
+            if magic != FILE_MAGIC:
+                raise ValueError(f"Not a reference catalog: {self.path}")
+            if version > FORMAT_VERSION:
+                raise ValueError(f"Unsupported catalog version: {version}")
+
+            offset = max(self._mapped_size, FILE_HEADER_SIZE)
+            self._scan(offset, size)
+            self._mapped_size = size
+
+    def _scan(self, offset: int, size: int):
+        while offset + RECORD_HEADER_SIZE <= size:
+            magic, record_size, id_len = struct.unpack_from('<4sIH', self._mmap, offset)
+            if magic != RECORD_MAGIC or record_size < RECORD_HEADER_SIZE or offset + record_size > size:
+                break  # record ghi dở
+            start = offset + RECORD_HEADER_SIZE
+            song_id = self._mmap[start:start + id_len].decode('utf-8')
+            self._index[song_id] = offset
+            offset += record_size
+        return offset
+
+    def _record(self, song_id: str) -> Tuple:
+        with self._lock:
+            offset = self._index.get(song_id)
+            if offset is None:
+                self.refresh()
+                offset = self._index.get(song_id)
+            if offset is None:
+                raise KeyError(f"Song not found in catalog: {song_id}")
+            return offset, self._mmap
+
+    def _columns(self, song_id: str):
+        offset, buffer = self._record(song_id)
+        (_magic, _size, id_len, flags, frame_count, note_count,
+         meta_len, t0, _reserved) = struct.unpack_from(RECORD_HEADER_FORMAT, buffer, offset)
+        position = offset + RECORD_HEADER_SIZE + id_len
+        metadata = buffer[position:position + meta_len]
+        position += meta_len
+
+        time_dtype = '<f4' if flags & FLAG_TIME_FLOAT32 else '<u2'
+        columns = []
+        for dtype, count in ((time_dtype, frame_count), ('<i2', frame_count), ('<f4', note_count * 3)):
+            position = _aligned(position)
+            column = np.frombuffer(buffer, dtype=dtype, count=count, offset=position)
+            columns.append(column)
+            position += column.nbytes
+        return flags, t0, metadata, columns
+
+    def get_contour(self, song_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Contour reference của bài hát
+
+        Returns:
+            (time, frequency): Mảng thời gian (giây) và tần số (Hz)
+        """
+        flags, t0, _metadata, (time_column, cents_q, _notes) = self._columns(song_id)
+        if flags & FLAG_TIME_FLOAT32:
+            time = time_column.astype(np.float64)
+        else:
+            time = t0 + np.cumsum(time_column, dtype=np.int64) * TIME_QUANTUM
+        frequency = 440.0 * np.power(2.0, cents_q / (1200.0 * CENTS_SCALE))
+        return time, frequency
+
+    def get_notes(self, song_id: str) -> np.ndarray:
+        """Các nốt (onset, offset, cents) đã lưu, mảng rỗng (0, 3) nếu không có"""
+        _flags, _t0, _metadata, (_time, _cents, notes) = self._columns(song_id)
+        return notes.reshape(-1, 3).astype(np.float64)
+
+    def get_metadata(self, song_id: str) -> Dict:
+        """Metadata lưu kèm record (nguồn, tham số trích xuất, ...)"""
+        _flags, _t0, metadata, _columns = self._columns(song_id)
+        return json.loads(bytes(metadata).decode('utf-8'))
+
+    def add(self, song_id: str, time: np.ndarray, frequency: np.ndarray,
+            notes: Optional[np.ndarray] = None, metadata: Optional[Dict] = None):
+        """Ghi thêm (hoặc thay thế) contour của một bài vào cuối file"""
+        record = encode_record(song_id, time, frequency, notes, metadata)
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+
+    def song_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._index)
+
+    def __contains__(self, song_id: str) -> bool:
+        with self._lock:
+            if song_id not in self._index:
+                self.refresh()
+            return song_id in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+                self._mapped_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_song_files(song_dir: str) -> Iterable[Tuple[str, str]]:
+    """Liệt kê (song_id, đường dẫn) trong thư mục; song ID là đường dẫn tương đối bỏ phần mở rộng"""
+    root = Path(song_dir)
+    for path in sorted(root.rglob('*')):
+        if path.is_file() and path.suffix.lower() in AUDIO_EXTENSIONS + MIDI_EXTENSIONS:
+            yield path.relative_to(root).with_suffix('').as_posix(), str(path)
+
+
+def build_catalog(song_dir: str, catalog_path: str, session=None, rebuild: bool = False) -> Dict:
+    """
+    Tính contour cho mọi bài trong song_dir và ghi vào catalog
+
+    Bài đã có trong catalog với cùng kích thước / thời gian sửa file và cùng tham số
+    trích xuất (session.reference_params) được bỏ qua, nên chạy lại sau khi thêm bài
+    mới chỉ xử lý phần mới; đổi method / step size / ngưỡng confidence thì tính lại.
+
+    Args:
+        song_dir: Thư mục chứa audio (WAV, MP3, FLAC...) và MIDI
+        catalog_path: File catalog (tạo mới nếu chưa có)
+        session: KaraokeSession dùng để trích xuất (mặc định: KaraokeSession())
+        rebuild: Tính lại cả những bài đã có
+
+    Returns:
+        Thống kê: added, skipped, failed
+    """
+    if session is None:
+        from library_interface import KaraokeSession
+        session = KaraokeSession()
+
+    stats = {'added': 0, 'skipped': 0, 'failed': 0}
+    with ReferenceCatalog(catalog_path) as catalog:
+        for song_id, path in iter_song_files(song_dir):
+            stat = os.stat(path)
+            metadata = {'source': os.path.basename(path), 'size': stat.st_size,
+                        'mtime_ns': stat.st_mtime_ns, **session.reference_params(path)}
+            if not rebuild and song_id in catalog:
+                existing = catalog.get_metadata(song_id)
+                # So sánh sau khi qua JSON như metadata đã lưu (tuple -> list)
+                if all(existing.get(key) == value for key, value in json.loads(json.dumps(metadata)).items()):
+                    stats['skipped'] += 1
+                    continue
+            try:
+                time_ref, freq_ref = session.get_reference_contour(path)
+                # Nốt MIDI hoặc nốt tách từ contour audio, dùng cho chấm theo nốt
+                notes = session.get_reference_notes(path)
+                catalog.add(song_id, time_ref, freq_ref, notes=notes, metadata=metadata)
+                stats['added'] += 1
+                print(f"✅ {song_id}: {len(time_ref)} frame, {len(notes)} nốt")
+            except Exception as e:
+                stats['failed'] += 1
+                print(f"❌ {song_id}: {e}")
+            finally:
+                # Không giữ contour trong cache của session khi xây catalog lớn
+                session.clear_cache()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Quản lý catalog contour reference')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Tính contour cho thư mục bài hát và ghi vào catalog')
+    build.add_argument('song_dir', help='Thư mục chứa audio / MIDI reference')
+    build.add_argument('catalog', help='File catalog (tạo mới nếu chưa có)')
+    build.add_argument('--method', default='crepe', choices=['crepe', 'basic_pitch'],
+                       help='Phương pháp trích xuất pitch (default: crepe)')
+    build.add_argument('--crepe-capacity', default='tiny',
+                       choices=['tiny', 'small', 'medium', 'large', 'full'],
+                       help='CREPE model capacity (default: tiny)')
+    build.add_argument('--crepe-step-size', type=int, default=50,
+                       help='CREPE step size (ms, default: 50)')
+    build.add_argument('--midi-track', default='auto', help='Lọc track MIDI (default: auto)')
+    build.add_argument('--rebuild', action='store_true', help='Tính lại cả những bài đã có')
+
+    listing = subparsers.add_parser('list', help='Liệt kê các bài trong catalog')
+    listing.add_argument('catalog', help='File catalog')
+
+    args = parser.parse_args(argv)
+    if args.command == 'list':
+        with ReferenceCatalog(args.catalog, create=False) as catalog:
+            for song_id in sorted(catalog.song_ids()):
+                time, _ = catalog.get_contour(song_id)
+                print(f"{song_id}\t{len(time)} frame\t{len(catalog.get_notes(song_id))} nốt")
+        return 0
+
+    if not os.path.isdir(args.song_dir):
+        print(f"❌ Không tìm thấy thư mục: {args.song_dir}")
+        return 1
+    from library_interface import KaraokeSession
+    session = KaraokeSession(method=args.method, model_capacity=args.crepe_capacity,
+                             step_size=args.crepe_step_size, midi_track_filter=args.midi_track)
+    stats = build_catalog(args.song_dir, args.catalog, session=session, rebuild=args.rebuild)
+    print(f"\n📚 Catalog {args.catalog}: thêm {stats['added']}, bỏ qua {stats['skipped']}, "
+          f"lỗi {stats['failed']}")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
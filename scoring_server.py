@@ -0,0 +1,339 @@
+"""
+HTTP server chấm điểm karaoke dùng chung cho cả quán (chạy trên localhost)
+
+Giữ model luôn sẵn sàng trong N worker process (KaraokeWorkerPool: worker fork
+sẵn, reference dùng chung qua shared memory), nhận request qua HTTP và trả về
+cùng JSON schema với score_karaoke_and_get_json. Khi hàng đợi đầy, server trả
+429 (kèm Retry-After) thay vì nhận thêm việc; khi worker pool hỏng trả 503.
+
+Endpoints:
+    GET  /health              Trạng thái server và hàng đợi
+    GET  /metrics             Số liệu Prometheus (text): bài đã chấm, lỗi, cache, độ trễ
+                              từng stage, độ sâu hàng đợi, thời gian load model
+    POST /score               Body JSON: {"user_audio_path": ..., "reference_path": ..., ...}
+                              (hoặc "song_id" thay cho reference_path khi chạy với --catalog)
+    POST /score/pcm?...       Body là PCM thô, tham số qua query string:
+                              reference_path, sample_rate, dtype (mặc định float32),
+                              method, tolerance_cents, difficulty_mode, include_advice,
+                              include_timings, profile_memory, song_id, scoring_mode,
+                              start, end (giây, chỉ chấm đoạn đó của bài)
+
+Chạy:
+    python scoring_server.py --port 8765 --workers 2 --max-queue 8 --preload songs/*.mid
+"""
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from library_interface import DEFAULT_RESULT_CACHE_SIZE, KaraokeWorkerPool, build_error_result
+from metrics import REGISTRY
+
+
+# Tham số được phép truyền từ request vào KaraokeSession.score
+_SCORE_PARAMS = {
+    'method': str,
+    'tolerance_cents': float,
+    'difficulty_mode': str,
+    'include_advice': lambda value: str(value).lower() in ('1', 'true', 'yes'),
+    'include_timings': lambda value: str(value).lower() in ('1', 'true', 'yes'),
+    'profile_memory': lambda value: str(value).lower() in ('1', 'true', 'yes'),
+    'song_id': str,
+    'scoring_mode': str,
+    'start': float,
+    'end': float,
+}
+
+# Giới hạn kích thước body (PCM 10 phút float32 44.1kHz ~ 106MB)
+MAX_BODY_BYTES = 256 * 1024 * 1024
+
+class ScoringServer:
+    """Server HTTP chấm điểm với worker pool và hàng đợi giới hạn"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, workers: int = 2,
+                 max_queue: int = 8, request_timeout: Optional[float] = None,
+                 preload=(), **session_kwargs):
+        """
+        Args:
+            host: Địa chỉ lắng nghe (mặc định chỉ localhost)
+            port: Cổng (0 = tự chọn cổng trống)
+            workers: Số worker process giữ model
+            max_queue: Số request được phép chờ khi tất cả worker đều bận
+            request_timeout: Thời gian tối đa (giây) chờ một request, None = không giới hạn
+            preload: Reference được trích xuất một lần lúc start và giữ trong shared memory
+            **session_kwargs: Cấu hình KaraokeSession cho worker (method, model_capacity, ...).
+                              Cache kết quả bật sẵn (DEFAULT_RESULT_CACHE_SIZE) để app gửi
+                              lại cùng một bài được trả ngay; result_cache_size=0 để tắt
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.preload = list(preload)
+        self.session_kwargs = dict(session_kwargs)
+        self.session_kwargs.setdefault('result_cache_size', DEFAULT_RESULT_CACHE_SIZE)
+
+        self._pool = None
+        self._httpd = None
+        self._thread = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._accepting = False
+
+    @property
+    def capacity(self) -> int:
+        """Tổng số request đang chạy + đang chờ tối đa"""
+        return self.workers + self.max_queue
+
+    @property
+    def address(self):
+        """(host, port) thực tế sau khi start"""
+        return self._httpd.server_address if self._httpd else (self.host, self.port)
+
+    def start(self):
+        """Khởi động worker pool (đã warm) và HTTP server trên thread nền"""
+        # Process server không load model: worker fork xong mới load (TensorFlow không an toàn khi fork)
+        self._pool = KaraokeWorkerPool(workers=self.workers, references=self.preload,
+                                       **self.session_kwargs).start()
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._accepting = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """Khởi động và chạy cho tới khi bị ngắt (Ctrl+C)"""
+        self.start()
+        host, port = self.address
+        print(f"🎤 Scoring server đang chạy tại http://{host}:{port} "
+              f"({self.workers} worker, hàng đợi {self.max_queue})")
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Dừng nhận request, tắt HTTP server và worker pool"""
+        self._accepting = False
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def try_acquire_slot(self) -> bool:
+        """Giữ một chỗ trong hàng đợi, False nếu đã đầy"""
+        with self._pending_lock:
+            if self._pending >= self.capacity:
+                REGISTRY.inc('karaoke_score_errors_total', type='QueueFull')
+                return False
+            self._pending += 1
+            REGISTRY.set('karaoke_queue_depth', self._pending, queue='server')
+            return True
+
+    def release_slot(self):
+        """Trả lại chỗ trong hàng đợi"""
+        with self._pending_lock:
+            self._pending -= 1
+            REGISTRY.set('karaoke_queue_depth', self._pending, queue='server')
+
+    def health(self) -> Dict:
+        """Thông tin trạng thái cho GET /health"""
+        with self._pending_lock:
+            pending = self._pending
+        return {
+            'status': 'ok' if self._accepting else 'unavailable',
+            'workers': self.workers,
+            'pending': pending,
+            'capacity': self.capacity,
+            'shared_references': self._pool.stats()['shared_references'] if self._pool else 0
+        }
+
+    def submit(self, user_audio, reference_path: Optional[str], kwargs: Dict):
+        """
+        Gửi một job vào worker pool (caller đã giữ slot bằng try_acquire_slot)
+
+        Slot chỉ được trả lại khi job thực sự kết thúc, kể cả khi request đã
+        timeout, để số job trong pool không vượt quá capacity.
+
+        Returns:
+            (status, payload): HTTP status và dict kết quả
+        """
+        if not self._accepting or self._pool is None:
+            self.release_slot()
+            return 503, build_error_result(RuntimeError('Server is shutting down'))
+        try:
+            future = self._pool.submit(user_audio, reference_path, **kwargs)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._accepting = False
+            self.release_slot()
+            return 503, build_error_result(e)
+        future.add_done_callback(self._job_done)
+
+        try:
+            return 200, future.result(timeout=self.request_timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            REGISTRY.inc('karaoke_score_errors_total', type='TimeoutError')
+            return 504, build_error_result(TimeoutError('Scoring request timed out'))
+        except BrokenProcessPool as e:
+            self._accepting = False
+            return 503, build_error_result(e)
+        except Exception as e:
+            # Lỗi ngoài KaraokeSession.score (ví dụ kết quả không pickle được) vẫn có phản hồi
+            REGISTRY.inc('karaoke_score_errors_total', type=type(e).__name__)
+            return 500, build_error_result(e)
+
+
+    def _job_done(self, future):
+        """Trả slot khi job kết thúc (cả khi request đã timeout), metrics worker đã được pool gộp"""
+        self.release_slot()
+
+
+def _parse_score_kwargs(params: Dict) -> Dict:
+    """Lấy các tham số chấm điểm hợp lệ từ request"""
+    kwargs = {}
+    for name, convert in _SCORE_PARAMS.items():
+        if name in params and params[name] is not None:
+            kwargs[name] = convert(params[name])
+    return kwargs
+
+
+def _make_handler(server: ScoringServer):
+    """Tạo class handler gắn với một ScoringServer"""
+
+    class ScoringRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            # Không in log mỗi request ra console
+            pass
+
+        def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self) -> Optional[bytes]:
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                # Không biết body dài bao nhiêu: không đọc tiếp request trên kết nối này
+                self.close_connection = True
+                self._send_json(400, build_error_result(ValueError('Invalid Content-Length header')),
+                                headers={'Connection': 'close'})
+                return None
+            if length > MAX_BODY_BYTES:
+                # Body chưa được đọc, giữ kết nối sẽ parse nhầm body thành request tiếp theo
+                self.close_connection = True
+                self._send_json(413, build_error_result(ValueError(f'Request body larger than {MAX_BODY_BYTES} bytes')),
+                                headers={'Connection': 'close'})
+                return None
+            return self.rfile.read(length) if length > 0 else b''
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                health = server.health()
+                self._send_json(200 if health['status'] == 'ok' else 503, health)
+            elif path == '/metrics':
+                body = REGISTRY.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, build_error_result(ValueError(f'Unknown endpoint: {self.path}')))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path not in ('/score', '/score/pcm'):
+                self._send_json(404, build_error_result(ValueError(f'Unknown endpoint: {url.path}')))
+                return
+
+            body = self._read_body()
+            if body is None:
+                return
+
+            try:
+                if url.path == '/score':
+                    params = json.loads(body.decode('utf-8') or '{}')
+                    if not isinstance(params, dict):
+                        raise ValueError('JSON body must be an object')
+                    user_audio = params['user_audio_path']
+                    kwargs = _parse_score_kwargs(params)
+                else:
+                    params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    user_audio = body
+                    kwargs = _parse_score_kwargs(params)
+                    kwargs['sample_rate'] = int(params['sample_rate'])
+                    kwargs['dtype'] = params.get('dtype', 'float32')
+                reference_path = params.get('reference_path')
+                if not reference_path and 'song_id' not in kwargs:
+                    raise KeyError('reference_path')
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json(400, build_error_result(ValueError(f'Invalid request: {e}')))
+                return
+
+            if not server.try_acquire_slot():
+                self._send_json(429, build_error_result(RuntimeError('Scoring queue is full, retry later')),
+                                headers={'Retry-After': '1'})
+                return
+            status, payload = server.submit(user_audio, reference_path, kwargs)
+            self._send_json(status, payload)
+
+    return ScoringRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP server chấm điểm karaoke (localhost)')
+    parser.add_argument('--host', default='127.0.0.1', help='Địa chỉ lắng nghe (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Cổng (default: 8765)')
+    parser.add_argument('--workers', type=int, default=2, help='Số worker process (default: 2)')
+    parser.add_argument('--max-queue', type=int, default=8,
+                        help='Số request được chờ khi worker bận, vượt quá trả 429 (default: 8)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Thời gian tối đa cho một request (giây), vượt quá trả 504')
+    parser.add_argument('--method', default='crepe', choices=['crepe', 'basic_pitch'],
+                        help='Phương pháp trích xuất pitch (default: crepe)')
+    parser.add_argument('--crepe-capacity', default='tiny',
+                        choices=['tiny', 'small', 'medium', 'large', 'full'],
+                        help='CREPE model capacity (default: tiny)')
+    parser.add_argument('--catalog', default=os.environ.get('KARAOKE_CATALOG'),
+                        help='Catalog contour reference (reference_catalog.py) để chấm theo song_id')
+    parser.add_argument('--preload', nargs='*', default=[], metavar='REFERENCE',
+                        help='Reference trích xuất sẵn lúc khởi động, dùng chung cho mọi worker qua shared memory')
+    parser.add_argument('--result-cache', type=int, default=DEFAULT_RESULT_CACHE_SIZE, metavar='N',
+                        help='Số kết quả giữ trong cache mỗi worker để trả ngay bài gửi lại, 0 = tắt '
+                             f'(default: {DEFAULT_RESULT_CACHE_SIZE})')
+    args = parser.parse_args()
+
+    server = ScoringServer(host=args.host, port=args.port, workers=args.workers,
+                           max_queue=args.max_queue, request_timeout=args.timeout,
+                           method=args.method, model_capacity=args.crepe_capacity,
+                           preload=args.preload, catalog_path=args.catalog,
+                           result_cache_size=args.result_cache)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""
+Test benchmark với audio tổng hợp (backend contour, không cần model)
+"""
+import copy
+
+import benchmark
+
+
+def test_benchmark_reports_stages_and_detects_regressions(tmp_path):
+    """Mỗi case có thời gian từng stage; stage chậm hơn baseline bị báo regression"""
+    report = benchmark.run_benchmark(['contour'], [2.0], signals=['vibrato'],
+                                     repeat=1, work_dir=str(tmp_path))
+    assert [case['variant'] for case in report['cases']] == list(benchmark.VARIANTS)
+    detuned = report['cases'][0]
+    assert {'extract_user.decode', 'extract_user.resample', 'match.dtw', 'advice', 'total'} \
+        <= set(detuned['stages'])
+    assert detuned['final_score'] > report['cases'][1]['final_score']  # lệch 35 cents vẫn hơn trễ nhịp
+
+    assert benchmark.compare_to_baseline(report, report) == []
+
+    baseline = copy.deepcopy(report)
+    baseline['cases'][0]['stages']['total'] = detuned['stages']['total'] / 10
+    regressions = benchmark.compare_to_baseline(report, baseline, threshold=0.25, min_delta=0.0)
+    assert [(item['stage'], item['case']) for item in regressions] == \
+        [('total', 'contour/vibrato/detuned/2s')]
@@ -0,0 +1,75 @@
+"""
+Test hủy giữa chừng và báo tiến độ (cancellation.py)
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from cancellation import CancellationToken, ScoringCancelled
+from library_interface import KaraokeSession
+from pitch_extractor import CREPE_BATCH_FRAMES, PitchExtractor
+from pitch_matcher import PitchMatcher
+from test_karaoke_scorer import _write_midi
+
+
+class _FakeCrepeModel:
+    """Model giả: activation đỉnh ở bin 100 cho mọi frame"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, frames, verbose=0):
+        assert frames.shape[1] == 1024 and len(frames) <= CREPE_BATCH_FRAMES
+        self.batches.append(len(frames))
+        activation = np.zeros((len(frames), 360), dtype=np.float32)
+        activation[:, 100] = 0.9
+        return activation
+
+
+def _fake_crepe(model):
+    core = SimpleNamespace(
+        build_and_load_model=lambda capacity: model,
+        to_local_average_cents=lambda activation: np.full(len(activation), 4000.0),
+        to_viterbi_cents=lambda activation: np.full(len(activation), 4000.0))
+    return SimpleNamespace(core=core)
+
+
+def test_crepe_batches_report_progress_and_cancel():
+    """Suy luận theo batch, báo tiến độ từng batch và dừng ngay sau batch khi bị hủy"""
+    model = _FakeCrepeModel()
+    extractor = PitchExtractor(method='crepe', normalize_audio=False)
+    extractor._crepe_model = _fake_crepe(model)
+    audio = np.random.default_rng(0).standard_normal(16000 * 30).astype(np.float32)
+
+    reports = []
+    time, freq = extractor.extract_pitch(audio, sample_rate=16000, step_size=10,
+                                         progress=lambda stage, fraction: reports.append((stage, fraction)))
+    assert len(time) == 3001 and sum(model.batches) == 3001
+    np.testing.assert_allclose(freq, 10 * 2 ** (4000 / 1200))
+    fractions = [fraction for stage, fraction in reports if stage == 'crepe_inference']
+    assert len(fractions) == len(model.batches) and fractions[-1] == 1.0
+    assert fractions == sorted(fractions)
+
+    model.batches.clear()
+    token = CancellationToken()
+    with pytest.raises(ScoringCancelled):
+        extractor.extract_pitch(audio, sample_rate=16000, step_size=10, cancel_token=token,
+                                progress=lambda stage, fraction: token.cancel())
+    assert model.batches == [CREPE_BATCH_FRAMES]
+
+
+def test_matcher_and_session_cancel(tmp_path):
+    """DTW dừng khi token bị hủy, session trả về error payload có "cancelled" """
+    token = CancellationToken()
+    token.cancel()
+    time = np.arange(0, 60, 0.05)
+    freq = np.full_like(time, 262.0)
+    with pytest.raises(ScoringCancelled):
+        PitchMatcher().calculate_score(time, freq, time, freq, cancel_token=token)
+
+    ref_path = tmp_path / 'ref.mid'
+    _write_midi(ref_path)
+    user = (262.0 * np.ones(16000)).astype(np.float32)
+    result = KaraokeSession().score(user, str(ref_path), sample_rate=16000, cancel_token=token)
+    assert result['cancelled'] and result['final_score'] == 0.0
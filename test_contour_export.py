@@ -0,0 +1,46 @@
+"""
+Test định dạng contour nhị phân KSPC
+"""
+import numpy as np
+import pytest
+
+from contour_export import (DEVIATION_INVALID, HEADER_SIZE, pack_contours,
+                            read_contours, unpack_contours, write_contours)
+
+
+def _contours():
+    time = np.arange(0, 1.0, 0.1)
+    cents_ref = np.full_like(time, 500.0)
+    cents_user = cents_ref + np.linspace(-120.4, 80.6, len(time))
+    cents_user[3] = 0.0  # không có pitch
+    cents_user[4] = 500.0 + 40000.0  # vượt ngưỡng int16
+    return time, cents_user, cents_ref
+
+
+def test_pack_unpack_round_trip():
+    """Các cột đọc lại đúng giá trị, frame không có pitch thành NaN / DEVIATION_INVALID"""
+    time, cents_user, cents_ref = _contours()
+    data = pack_contours(time, cents_user, cents_ref, grid_rate=10.0)
+    assert data[:4] == b'KSPC' and HEADER_SIZE == 40
+
+    contours = unpack_contours(data)
+    assert contours['grid_rate'] == 10.0
+    np.testing.assert_allclose(contours['time'], time, atol=1e-6)
+    np.testing.assert_allclose(contours['cents_reference'], cents_ref)
+    assert np.isnan(contours['cents_user'][3])
+    assert contours['deviation'][0] == -120
+    assert contours['deviation'][3] == DEVIATION_INVALID
+    assert contours['deviation'][4] == 32767
+    # Các cột là view vào buffer, không copy
+    assert not contours['time'].flags.owndata
+
+
+def test_write_and_read_file(tmp_path):
+    """write_contours ghi file, read_contours đọc lại qua memmap"""
+    path = str(tmp_path / 'take.kspc')
+    assert write_contours(path, *_contours()) == 10
+    contours = read_contours(path)
+    assert len(contours['cents_user']) == 10
+
+    with pytest.raises(ValueError):
+        unpack_contours(b'JUNK' + bytes(HEADER_SIZE))
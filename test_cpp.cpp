@@ -1,6 +1,55 @@
 #include "KaraokeScorer.h"
 #include <iostream>
 #include <iomanip>
+#include <thread>
+#include <vector>
+#include <future>
+#include <cmath>
+#include <cstring>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <fstream>
+
+// Ghi file WAV PCM 16-bit mono chứa một âm sine (dùng cho test chấm điểm thật)
+static bool writeSineWav(const std::string& path, double freq_hz, double seconds, int sample_rate) {
+    std::ofstream file(path.c_str(), std::ios::binary);
+    if (!file) {
+        return false;
+    }
+    const uint32_t num_samples = static_cast<uint32_t>(seconds * sample_rate);
+    const uint32_t data_size = num_samples * 2;
+    const uint32_t riff_size = 36 + data_size;
+    const uint32_t fmt_size = 16;
+    const uint16_t format = 1, channels = 1, block_align = 2, bits = 16;
+    const uint32_t rate = static_cast<uint32_t>(sample_rate), byte_rate = rate * 2;
+    file.write("RIFF", 4);
+    file.write(reinterpret_cast<const char*>(&riff_size), 4);
+    file.write("WAVEfmt ", 8);
+    file.write(reinterpret_cast<const char*>(&fmt_size), 4);
+    file.write(reinterpret_cast<const char*>(&format), 2);
+    file.write(reinterpret_cast<const char*>(&channels), 2);
+    file.write(reinterpret_cast<const char*>(&rate), 4);
+    file.write(reinterpret_cast<const char*>(&byte_rate), 4);
+    file.write(reinterpret_cast<const char*>(&block_align), 2);
+    file.write(reinterpret_cast<const char*>(&bits), 2);
+    file.write("data", 4);
+    file.write(reinterpret_cast<const char*>(&data_size), 4);
+    for (uint32_t i = 0; i < num_samples; i++) {
+        int16_t sample = static_cast<int16_t>(16000.0 * std::sin(2.0 * 3.14159265358979 * freq_hz * i / sample_rate));
+        file.write(reinterpret_cast<const char*>(&sample), 2);
+    }
+    return static_cast<bool>(file);
+}
+
+// final_score trong JSON thô (-1 nếu không có)
+static double jsonFinalScore(const std::string& json) {
+    size_t pos = json.find("\"final_score\":");
+    if (pos == std::string::npos) {
+        return -1.0;
+    }
+    return std::atof(json.c_str() + pos + std::strlen("\"final_score\":"));
+}
 
 /**
  * Test program để kiểm tra thư viện KaraokeScorer hoạt động
@@ -81,6 +130,143 @@ int main() {
     }
     std::cout << "✅ PASS: Parse kết quả thành công" << std::endl << std::endl;
     
+    // --- Test 5: Chấm điểm từ PCM trong bộ nhớ ---
+    std::cout << "[TEST 5] Kiểm tra chấm điểm từ buffer PCM (không ghi file tạm)..." << std::endl;
+    const int pcm_sample_rate = 16000;
+    std::vector<float> pcm(pcm_sample_rate);
+    for (size_t i = 0; i < pcm.size(); i++) {
+        pcm[i] = 0.5f * static_cast<float>(std::sin(2.0 * 3.14159265358979 * 220.0 * i / pcm_sample_rate));
+    }
+    json_result = scorer.scoreAsJson(pcm.data(), pcm.size(), pcm_sample_rate, "non_existent_ref.wav");
+    std::cout << "Kết quả JSON:" << std::endl;
+    std::cout << json_result << std::endl;
+    if (json_result.find("Reference file not found") != std::string::npos) {
+        std::cout << "✅ PASS: Buffer PCM được chuyển sang Python (lỗi reference như mong đợi)" << std::endl << std::endl;
+    } else {
+        std::cout << "⚠️  WARNING: Kết quả PCM không như mong đợi" << std::endl << std::endl;
+    }
+    
+    // start / end phải tới được Python qua kwargs: nếu Python từ chối kwargs (TypeError) thì lời gọi
+    // thất bại ("Python function call failed", không có final_score); nếu tới được thì Python trả
+    // payload lỗi "not found" đầy đủ các trường
+    std::cout << "  - PCM + file contour với đoạn [0.25, 0.75] giây:" << std::endl;
+    json_result = scorer.scoreAsJson(pcm.data(), pcm.size(), pcm_sample_rate, "non_existent_ref.wav",
+                                     "crepe", 200.0, "easy", 0.25, 0.75);
+    std::map<std::string, double> windowed = scorer.scoreWithContours(
+        "non_existent_user.wav", "non_existent_ref.wav", "non_existent.kspc", "crepe", 200.0, "easy", 0.25, 0.75);
+    if (json_result.find("Reference file not found") != std::string::npos &&
+        windowed.find("final_score") != windowed.end() &&
+        scorer.getLastError().find("Python function call failed") == std::string::npos) {
+        std::cout << "✅ PASS: start / end được truyền qua các overload PCM và contour" << std::endl << std::endl;
+    } else {
+        std::cerr << "❌ LỖI: start / end không được truyền đúng: " << json_result << std::endl;
+        return 1;
+    }
+    
+    // --- Test 6: Chấm điểm đồng thời từ nhiều thread ---
+    std::cout << "[TEST 6] Kiểm tra chấm điểm đồng thời (nhiều thread + scoreAsync)..." << std::endl;
+    const int num_threads = 4;
+    if (!writeSineWav("cpp_test_user.wav", 262.0, 2.0, 16000) ||
+        !writeSineWav("cpp_test_ref.wav", 262.0, 2.0, 16000)) {
+        std::cerr << "❌ LỖI: Không ghi được file WAV test" << std::endl;
+        return 1;
+    }
+    std::vector<std::future<std::map<std::string, double> > > futures;
+    for (int i = 0; i < num_threads; i++) {
+        futures.push_back(scorer.scoreAsync("cpp_test_user.wav", "cpp_test_ref.wav"));
+    }
+    
+    std::vector<std::string> thread_results(num_threads);
+    std::vector<std::thread> threads;
+    for (int i = 0; i < num_threads; i++) {
+        threads.push_back(std::thread([&scorer, &thread_results, i]() {
+            thread_results[i] = scorer.scoreAsJson("cpp_test_user.wav", "cpp_test_ref.wav");
+        }));
+    }
+    for (size_t i = 0; i < threads.size(); i++) {
+        threads[i].join();
+    }
+    
+    // Máy không cài CREPE: mọi lần chấm đều trả lỗi load model, không kiểm tra được điểm
+    bool model_missing = true;
+    for (size_t i = 0; i < thread_results.size(); i++) {
+        if (thread_results[i].find("load CREPE model") == std::string::npos) {
+            model_missing = false;
+        }
+    }
+    
+    // Map bỏ các giá trị chuỗi nên không thấy "error"; payload lỗi có duration = 0
+    bool concurrent_ok = true;
+    for (size_t i = 0; i < futures.size(); i++) {
+        std::map<std::string, double> async_result = futures[i].get();
+        if (model_missing) {
+            continue;
+        }
+        if (async_result.find("final_score") == async_result.end() ||
+            async_result["final_score"] < 0.0 || async_result["final_score"] > 100.0 ||
+            async_result["duration"] <= 0.0) {
+            concurrent_ok = false;
+        }
+    }
+    for (size_t i = 0; i < thread_results.size() && !model_missing; i++) {
+        double thread_score = jsonFinalScore(thread_results[i]);
+        if (thread_results[i].find("\"error\"") != std::string::npos ||
+            thread_score < 0.0 || thread_score > 100.0) {
+            std::cerr << "   Kết quả: " << thread_results[i] << std::endl;
+            concurrent_ok = false;
+        }
+    }
+    std::remove("cpp_test_user.wav");
+    std::remove("cpp_test_ref.wav");
+    
+    if (model_missing) {
+        std::cout << "⚠️  WARNING: Chưa cài CREPE, bỏ qua kiểm tra điểm khi chấm đồng thời" << std::endl << std::endl;
+    } else if (concurrent_ok) {
+        std::cout << "✅ PASS: " << num_threads * 2 << " lần chấm đồng thời đều trả về kết quả" << std::endl << std::endl;
+    } else {
+        std::cerr << "❌ LỖI: Có lần chấm đồng thời không trả về kết quả hợp lệ" << std::endl;
+        return 1;
+    }
+    
+    // --- Test 7: Map contour nhị phân KSPC ---
+    std::cout << "[TEST 7] Kiểm tra map file contour nhị phân (KSPC)..." << std::endl;
+    const uint32_t frames = 3;
+    KaraokeContourHeader header;
+    std::memcpy(header.magic, "KSPC", 4);
+    header.version = 1;
+    header.header_size = sizeof(header);
+    header.frame_count = frames;
+    header.flags = 0;
+    header.grid_rate = 10.0f;
+    header.time_offset = 40;
+    header.user_offset = 56;
+    header.ref_offset = 72;
+    header.dev_offset = 88;
+    header.reserved = 0;
+    std::vector<char> contour_buffer(96, 0);
+    const float times[frames] = {0.0f, 0.1f, 0.2f};
+    const float user_cents[frames] = {100.0f, 250.0f, NAN};
+    const float ref_cents[frames] = {100.0f, 200.0f, 200.0f};
+    const int16_t deviations[frames] = {0, 50, KARAOKE_DEVIATION_INVALID};
+    std::memcpy(contour_buffer.data(), &header, sizeof(header));
+    std::memcpy(contour_buffer.data() + header.time_offset, times, sizeof(times));
+    std::memcpy(contour_buffer.data() + header.user_offset, user_cents, sizeof(user_cents));
+    std::memcpy(contour_buffer.data() + header.ref_offset, ref_cents, sizeof(ref_cents));
+    std::memcpy(contour_buffer.data() + header.dev_offset, deviations, sizeof(deviations));
+    
+    KaraokeContourView view;
+    std::string contour_error;
+    bool mapped = mapContours(contour_buffer.data(), contour_buffer.size(), view, &contour_error);
+    bool truncated_rejected = !mapContours(contour_buffer.data(), 80, view, NULL);
+    mapContours(contour_buffer.data(), contour_buffer.size(), view, NULL);
+    if (mapped && truncated_rejected && view.frame_count == frames &&
+        view.deviation[1] == 50 && std::isnan(view.cents_user[2])) {
+        std::cout << "✅ PASS: Đọc được " << view.frame_count << " frame không cần parse" << std::endl << std::endl;
+    } else {
+        std::cerr << "❌ LỖI: Không map được contour: " << contour_error << std::endl;
+        return 1;
+    }
+    
     // --- Hướng dẫn sử dụng với file thật ---
     std::cout << "=" << std::string(60, '=') << std::endl;
     std::cout << "HƯỚNG DẪN SỬ DỤNG VỚI FILE THẬT" << std::endl;
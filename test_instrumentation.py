@@ -0,0 +1,85 @@
+"""
+Test lớp đo thời gian từng stage (instrumentation.py)
+"""
+import tracemalloc
+
+import numpy as np
+
+from instrumentation import add_timing_hook, collect_timings, remove_timing_hook, stage
+from library_interface import KaraokeSession
+from test_karaoke_scorer import _fake_extract_user, _write_midi
+
+
+def test_nested_stages_and_hooks():
+    """Stage lồng nhau có tên dạng cha.con, hook nhận từng lần đo"""
+    events = []
+    hook = lambda name, seconds, frames: events.append((name, frames))
+    add_timing_hook(hook)
+    try:
+        with collect_timings() as timings:
+            with stage('outer'):
+                for _ in range(2):
+                    with stage('inner', frames=10):
+                        pass
+                with stage('late') as record:
+                    record.frames = 3
+    finally:
+        remove_timing_hook(hook)
+
+    result = timings.as_dict()
+    assert result['outer.inner']['calls'] == 2 and result['outer.inner']['frames'] == 20
+    assert result['outer.late']['frames'] == 3
+    assert result['outer']['frames'] is None
+    assert result['outer']['seconds'] >= result['outer.inner']['seconds']
+    assert events[-1] == ('outer', None) and ('outer.inner', 10) in events
+
+    # Không có collector và hook: stage() không ghi lại gì
+    with stage('ignored'):
+        pass
+    assert 'ignored' not in timings
+
+
+def test_memory_profile_per_stage():
+    """Bộ nhớ đỉnh của stage con được tính vào stage cha, phần giữ lại được ghi riêng"""
+    with collect_timings(profile_memory=True) as timings:
+        with stage('outer'):
+            with stage('temporary'):
+                temporary = np.ones(2_000_000)  # ~16 MB, giải phóng ngay
+                del temporary
+            with stage('kept'):
+                kept = np.ones(500_000)  # ~4 MB, còn giữ sau stage
+    result = timings.as_dict()
+    assert not tracemalloc.is_tracing()
+
+    assert result['outer.temporary']['memory']['peak_bytes'] >= 16_000_000
+    assert result['outer.temporary']['memory']['retained_bytes'] < 1_000_000
+    assert result['outer.kept']['memory']['retained_bytes'] >= 4_000_000
+    assert result['outer']['memory']['peak_bytes'] >= 16_000_000
+    assert result['outer']['memory']['retained_bytes'] >= 4_000_000
+    del kept
+
+
+def test_session_score_includes_timings(tmp_path, monkeypatch):
+    """KaraokeSession.score(include_timings=True) trả về thời gian và số frame từng stage"""
+    monkeypatch.setattr(KaraokeSession, 'extract_user', _fake_extract_user)
+    user_path = tmp_path / 'take.wav'
+    user_path.touch()
+    ref_path = tmp_path / 'ref.mid'
+    _write_midi(ref_path)
+
+    session = KaraokeSession()
+    result = session.score(str(user_path), str(ref_path), include_timings=True)
+    timings = result['timings']
+    assert 'error' not in result
+    assert timings['extract_user']['frames'] == 80
+    assert timings['reference.midi_parse']['calls'] == 1
+    assert {'match.align', 'match.cents', 'match.accuracy', 'match.dtw'} <= set(timings)
+    assert timings['total']['seconds'] >= timings['match']['seconds']
+
+    # Lần sau reference lấy từ cache nên không parse MIDI lại; mặc định không có timings
+    result = session.score(str(user_path), str(ref_path), include_timings=True)
+    assert 'reference.midi_parse' not in result['timings']
+    assert 'timings' not in session.score(str(user_path), str(ref_path))
+
+    result = session.score(str(user_path), str(ref_path), profile_memory=True)
+    assert result['timings']['match.dtw']['memory']['peak_bytes'] > 0
@@ -0,0 +1,94 @@
+"""
+Test chế độ chấm hàng loạt (--batch) của karaoke_scorer.py
+"""
+import json
+
+import numpy as np
+
+import karaoke_scorer
+from library_interface import KaraokeSession
+
+
+def _fake_extract_user(self, user_audio, method=None, sample_rate=None, dtype='float32', **kwargs):
+    """Contour người hát tổng hợp (không cần model pitch)"""
+    time = np.arange(0, 4, 0.05)
+    return time, np.full_like(time, 262.0)
+
+
+def _write_midi(path):
+    from mido import Message, MidiFile, MidiTrack
+    midi = MidiFile()
+    track = MidiTrack()
+    midi.tracks.append(track)
+    for note in (60, 60, 60, 60):
+        track.append(Message('note_on', note=note, velocity=64, time=0))
+        track.append(Message('note_off', note=note, velocity=64, time=midi.ticks_per_beat))
+    midi.save(str(path))
+
+
+def test_batch_streams_jsonl_and_resumes(tmp_path, monkeypatch):
+    """Kết quả được ghi ra JSONL, chạy lại chỉ chấm các dòng chưa xong"""
+    monkeypatch.setattr(KaraokeSession, 'extract_user', _fake_extract_user)
+    ref_path = tmp_path / 'ref.mid'
+    _write_midi(ref_path)
+    for name in ('take_a.wav', 'take_b.wav', 'take_c.wav'):
+        (tmp_path / name).touch()
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        "id,user,reference\n"
+        f"a,take_a.wav,{ref_path}\n"
+        f"b,take_b.wav,{ref_path}\n"
+        f"c,take_c.wav,{tmp_path / 'missing.mid'}\n",
+        encoding='utf-8')
+    output = tmp_path / 'results.jsonl'
+    # Lần chạy trước đã chấm xong "a" và bị kill khi đang ghi dòng tiếp theo
+    output.write_text(json.dumps({'id': 'a', 'final_score': 99.0}) + '\n{"id": "b", "fin',
+                      encoding='utf-8')
+
+    stats = karaoke_scorer.run_batch(str(manifest), str(output), workers=0)
+
+    assert stats['total'] == 3 and stats['skipped'] == 1
+    assert stats['scored'] == 1 and stats['failed'] == 1
+    assert stats['takes_per_minute'] > 0
+    assert {'extract_user', 'reference', 'match.dtw'} <= set(stats['stage_totals'])
+
+    records = {}
+    for line in output.read_text(encoding='utf-8').splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        records[record['id']] = record
+    assert records['a']['final_score'] == 99.0
+    assert records['b']['final_score'] > 0 and records['b']['timings']['match']['calls'] == 1
+    assert 'Reference file not found' in records['c']['error']
+
+    # Chạy lại: chỉ còn dòng lỗi "c" được chấm lại
+    stats = karaoke_scorer.run_batch(str(manifest), str(output), workers=0)
+    assert stats['skipped'] == 2 and stats['failed'] == 1
+
+
+def test_batch_bad_row_does_not_abort(tmp_path, monkeypatch):
+    """Dòng manifest hỏng (tolerance / start không phải số) chỉ ghi lỗi cho dòng đó, các dòng khác vẫn chấm"""
+    monkeypatch.setattr(KaraokeSession, 'extract_user', _fake_extract_user)
+    ref_path = tmp_path / 'ref.mid'
+    _write_midi(ref_path)
+    (tmp_path / 'take.wav').touch()
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        "id,user,reference,tolerance,start\n"
+        f"good1,take.wav,{ref_path},50,\n"
+        f"bad_tolerance,take.wav,{ref_path},fifty,\n"
+        f"bad_start,take.wav,{ref_path},,0.5s\n"
+        f"good2,take.wav,{ref_path},,0.5\n",
+        encoding='utf-8')
+    output = tmp_path / 'results.jsonl'
+
+    stats = karaoke_scorer.run_batch(str(manifest), str(output), workers=0)
+
+    assert stats['scored'] == 2 and stats['failed'] == 2
+    records = {r['id']: r for r in map(json.loads, output.read_text(encoding='utf-8').splitlines())}
+    assert 'could not convert' in records['bad_tolerance']['error']
+    assert 'could not convert' in records['bad_start']['error']
+    assert records['bad_start']['final_score'] == 0.0
+    assert 'error' not in records['good1'] and 'error' not in records['good2']
@@ -4,13 +4,23 @@ Test script để kiểm tra thư viện library_interface hoạt động đúng
 import sys
 import json
 import io
+import time
+import asyncio
 
 # Fix encoding for Windows console
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-from library_interface import score_karaoke_and_get_json
+import numpy as np
+import pytest
+
+from library_interface import (score_karaoke_and_get_json, score_karaoke_pcm_and_get_json,
+                               KaraokeSession, AsyncKaraokeSession, KaraokeWorkerPool,
+                               DEFAULT_RESULT_CACHE_SIZE)
+from metrics import REGISTRY
+from cancellation import ScoringCancelled, check_cancelled
+from pitch_extractor import pcm_to_float
 
 def test_error_handling():
     """Test xử lý lỗi khi file không tồn tại"""
@@ -103,6 +113,254 @@ def test_json_format():
     
     print()
 
+def _write_midi(path, notes):
+    """Tạo file MIDI đơn giản (mỗi nốt dài 1 beat) để test không cần audio"""
+    from mido import Message, MidiFile, MidiTrack
+    midi = MidiFile()
+    track = MidiTrack()
+    midi.tracks.append(track)
+    for note in notes:
+        track.append(Message('note_on', note=note, velocity=64, time=0))
+        track.append(Message('note_off', note=note, velocity=64, time=midi.ticks_per_beat))
+    midi.save(str(path))
+
+
+def test_session_score_returns_dict():
+    """KaraokeSession.score trả về dict, score_json trả về JSON cùng nội dung"""
+    session = KaraokeSession()
+    result = session.score("non_existent_user.wav", "non_existent_ref.wav")
+    assert isinstance(result, dict)
+    assert "error" in result and result["final_score"] == 0.0
+    assert json.loads(session.score_json("non_existent_user.wav", "non_existent_ref.wav")) == result
+
+
+def test_advice_reuses_matcher_alignment(tmp_path, monkeypatch):
+    """include_advice dùng lại contour đã căn chỉnh của matcher (chỉ căn chỉnh một lần)"""
+    from pitch_advisor import PitchAdvisor
+    from pitch_matcher import PitchMatcher
+
+    def fake_extract_user(self, user_audio, method=None, **kwargs):
+        time_user = np.arange(0, 3, 0.05)
+        return time_user, np.where(time_user < 1.5, 262.0, 330.0)
+
+    align_calls = []
+    align_cents = PitchMatcher.align_cents
+
+    def counting_align_cents(self, *args, **kwargs):
+        align_calls.append(args)
+        return align_cents(self, *args, **kwargs)
+
+    monkeypatch.setattr(KaraokeSession, 'extract_user', fake_extract_user)
+    monkeypatch.setattr(PitchMatcher, 'align_cents', counting_align_cents)
+    _write_midi(tmp_path / "ref.mid", [60, 62, 64])
+    (tmp_path / "take.wav").touch()
+    session = KaraokeSession()
+    result = session.score(str(tmp_path / "take.wav"), str(tmp_path / "ref.mid"), include_advice=True)
+    assert 'error' not in result and len(align_calls) == 1
+
+    time_ref, freq_ref = session.get_reference_contour(str(tmp_path / "ref.mid"))
+    expected = PitchAdvisor(tolerance_cents=session.tolerance_cents).analyze_pitch_contour(
+        *fake_extract_user(session, None), time_ref, freq_ref)
+    assert result['advice'] == expected
+
+
+def test_session_caches_reference_contour(tmp_path):
+    """Reference chỉ được trích xuất lại khi file thay đổi"""
+    ref_path = tmp_path / "ref.mid"
+    _write_midi(ref_path, [60, 62, 64])
+    session = KaraokeSession()
+
+    first = session.get_reference_contour(str(ref_path))
+    assert session.get_reference_contour(str(ref_path)) is first
+    assert len(first[0]) == 3
+
+    _write_midi(ref_path, [60, 62, 64, 65, 67])
+    second = session.get_reference_contour(str(ref_path))
+    assert second is not first
+    assert len(second[0]) == 5
+
+
+def test_pcm_buffers_are_wrapped_without_copy():
+    """PCM float32 được bọc zero-copy, PCM int16 được chuyển về [-1, 1]"""
+    samples = np.sin(np.linspace(0, 100, 16000)).astype(np.float32)
+    assert np.shares_memory(pcm_to_float(samples), samples)
+    wrapped = pcm_to_float(memoryview(samples))
+    assert np.shares_memory(wrapped, samples)
+
+    pcm16 = (samples * 32767).astype(np.int16)
+    converted = pcm_to_float(pcm16.tobytes(), dtype='int16')
+    assert converted.dtype == np.float32
+    assert np.max(np.abs(converted - samples)) < 1e-3
+
+
+def test_pcm_scoring_error_format():
+    """Chấm điểm từ PCM trả về cùng định dạng JSON (ở đây là lỗi reference)"""
+    samples = np.zeros(16000, dtype=np.float32)
+    parsed = json.loads(score_karaoke_pcm_and_get_json(samples, 16000, "non_existent_ref.wav"))
+    assert "Reference file not found" in parsed["error"]
+    assert parsed["final_score"] == 0.0
+
+
+def test_result_cache_dedupes_repeat_submissions(tmp_path, monkeypatch):
+    """Cùng nội dung audio + reference + tham số: trả kết quả đã lưu, không trích xuất lại"""
+    calls = []
+
+    def fake_extract_user(self, user_audio, method=None, **kwargs):
+        calls.append(user_audio)
+        time_user = np.arange(0, 3, 0.05)
+        return time_user, np.full(len(time_user), 262.0)
+
+    monkeypatch.setattr(KaraokeSession, 'extract_user', fake_extract_user)
+    _write_midi(tmp_path / "ref.mid", [60, 60, 60])
+    ref = str(tmp_path / "ref.mid")
+    for name, content in (("a.wav", b"take"), ("b.wav", b"take"), ("c.wav", b"other")):
+        (tmp_path / name).write_bytes(content)
+
+    session = KaraokeSession(result_cache_size=2, result_cache_ttl=60.0)
+    first = session.score(str(tmp_path / "a.wav"), ref)
+    again = session.score(str(tmp_path / "b.wav"), ref)  # tên khác, nội dung giống
+    assert again.pop('cached') is True and again == first and 'cached' not in first
+    session.score(str(tmp_path / "a.wav"), ref, tolerance_cents=20.0)
+    session.score(str(tmp_path / "c.wav"), ref)
+    assert len(calls) == 3
+    stats = session.result_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (1, 3, 1, 2)
+
+    session.result_cache.ttl_seconds = 0.0
+    session.score(str(tmp_path / "c.wav"), ref)
+    assert len(calls) == 4 and session.result_cache_stats()['expired'] == 1
+    assert KaraokeSession(result_cache_size=0).result_cache_stats() == {}
+    # Mặc định tắt: chỉ host chạy lâu (scoring_server) bật cache
+    assert KaraokeSession().result_cache is None
+    from scoring_server import ScoringServer
+    assert ScoringServer().session_kwargs['result_cache_size'] == DEFAULT_RESULT_CACHE_SIZE
+
+
+def _fake_extract_pcm(self, user_audio, method=None, sample_rate=None, dtype='float32', **kwargs):
+    """Contour giả: tần số lấy từ sample đầu tiên của PCM (kiểm tra PCM tới worker nguyên vẹn)"""
+    time_user = np.arange(0, 3, 0.05)
+    return time_user, np.full(len(time_user), float(pcm_to_float(user_audio, dtype)[0]))
+
+
+def _installed_references(_):
+    """Reference dùng chung mà một worker đang giữ (chạy trong worker)"""
+    import library_interface
+    time.sleep(0.05)
+    return list(library_interface._pool_session._shared_references)
+
+
+def test_worker_pool_shares_reference_contours(tmp_path, monkeypatch):
+    """Worker fork đọc reference từ shared memory, không trích xuất lại; PCM gửi qua shared memory"""
+    monkeypatch.setattr(KaraokeSession, 'extract_user', _fake_extract_pcm)  # worker fork kế thừa
+    _write_midi(tmp_path / "ref.mid", [60, 60, 60])
+    ref = str(tmp_path / "ref.mid")
+    REGISTRY.reset()
+
+    with KaraokeWorkerPool(workers=2, references=[ref], start_method='fork') as pool:
+        stats = pool.stats()
+        assert stats['shared_references'] == 2 and stats['shared_bytes'] > 0
+        assert pool.preload_references([ref]) == 0
+
+        pcm = np.full(16000, 262.0, dtype=np.float32)
+        futures = [pool.submit(pcm.tobytes(), ref, sample_rate=16000) for _ in range(3)]
+        futures.append(pool.submit(pcm, ref, sample_rate=16000, scoring_mode='notes'))
+        results = [future.result(timeout=60) for future in futures]
+        assert all('error' not in r and r['final_score'] > 95 for r in results)
+        assert results[-1]['notes_hit'] == 3
+        assert 'Reference file not found' in pool.score(pcm, str(tmp_path / "missing.mid"),
+                                                        sample_rate=16000)['error']
+
+        # File sửa lại được publish lại: worker bỏ bản cũ thay vì giữ mãi trong _shared_references
+        old_key = pool._session.reference_key(ref)
+        _write_midi(tmp_path / "ref.mid", [60, 62, 64, 65])
+        assert pool.preload_references([ref]) == 1 and pool.stats()['shared_references'] == 2
+        for future in [pool.submit(pcm, ref, sample_rate=16000, scoring_mode='notes') for _ in range(4)]:
+            assert future.result(timeout=60)['notes_total'] == 4
+        new_key = pool._session.reference_key(ref)
+        updated = [installed for installed in pool._executor.map(_installed_references, range(4))
+                   if new_key in installed]
+        assert updated and all(len(installed) == 2 and old_key not in installed for installed in updated)
+
+    # Mỗi phiên bản reference chỉ trích xuất một lần (lúc publish), mọi lần chấm đều hit bản dùng chung
+    assert REGISTRY.value('karaoke_cache_requests_total', cache='reference', result='miss') == 2
+    assert REGISTRY.value('karaoke_cache_requests_total', cache='reference', result='hit') >= 2
+    assert REGISTRY.value('karaoke_score_errors_total', type='FileNotFoundError') == 1
+
+
+class _SlowSession(KaraokeSession):
+    """Session giả lập inference chậm (không cần model)"""
+
+    def score(self, *args, **kwargs):
+        time.sleep(0.2)
+        return {'final_score': 50.0}
+
+
+def test_async_session_bounds_concurrency_and_times_out():
+    """AsyncKaraokeSession giới hạn số lần chấm đồng thời, báo thời gian chờ và hỗ trợ timeout"""
+    async def run():
+        async_session = AsyncKaraokeSession(session=_SlowSession(), max_concurrency=2)
+        results = await asyncio.gather(*[async_session.score("u.wav", "r.wav") for _ in range(4)])
+        waits = sorted(r['queue_wait_s'] for r in results)
+        assert waits[0] < 0.05 and waits[-1] >= 0.15
+        assert all(r['compute_s'] >= 0.15 for r in results)
+
+        try:
+            await async_session.score("u.wav", "r.wav", timeout=0.05)
+            assert False, "expected timeout"
+        except asyncio.TimeoutError:
+            pass
+        async_session.close()
+
+    asyncio.run(run())
+
+    # Process pool không pickle được session.score + CancellationToken: báo lỗi ngay khi tạo
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=1) as process_pool:
+        with pytest.raises(TypeError, match='thread executor'):
+            AsyncKaraokeSession(session=_SlowSession(), executor=process_pool)
+
+
+def test_async_timeout_stops_running_score(tmp_path, monkeypatch):
+    """Timeout hủy token của request: worker dừng (ScoringCancelled) trước khi slot được dùng lại"""
+    events = []
+
+    def slow_extract_user(self, user_audio, method=None, cancel_token=None, **kwargs):
+        events.append(('start', user_audio))
+        if user_audio.endswith('slow.wav'):
+            try:
+                for _ in range(500):
+                    check_cancelled(cancel_token)
+                    time.sleep(0.01)
+            except ScoringCancelled:
+                events.append(('cancelled', user_audio))
+                raise
+        time_user = np.arange(0, 3, 0.05)
+        return time_user, np.full(len(time_user), 262.0)
+
+    monkeypatch.setattr(KaraokeSession, 'extract_user', slow_extract_user)
+    _write_midi(tmp_path / "ref.mid", [60, 60, 60])
+    ref = str(tmp_path / "ref.mid")
+    slow, fast = str(tmp_path / "slow.wav"), str(tmp_path / "fast.wav")
+    (tmp_path / "slow.wav").write_bytes(b'slow')
+    (tmp_path / "fast.wav").write_bytes(b'fast')
+
+    async def run():
+        async_session = AsyncKaraokeSession(session=KaraokeSession(), max_concurrency=1)
+        started = time.monotonic()
+        try:
+            await async_session.score(slow, ref, timeout=0.1)
+            assert False, "expected timeout"
+        except asyncio.TimeoutError:
+            pass
+        result = await async_session.score(fast, ref)
+        async_session.close()
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert events == [('start', slow), ('cancelled', slow), ('start', fast)]
+    assert 'error' not in result and elapsed < 2.0
+
+
 if __name__ == "__main__":
     print("\n" + "=" * 60)
     print("KIỂM TRA THƯ VIỆN LIBRARY_INTERFACE")
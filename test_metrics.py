@@ -0,0 +1,67 @@
+"""
+Test metrics.py: registry, định dạng Prometheus và số liệu do session ghi
+"""
+import numpy as np
+
+from library_interface import KaraokeSession, get_metrics_text
+from metrics import LATENCY_BUCKETS, REGISTRY, FileExporter, MetricsRegistry
+from test_karaoke_scorer import _write_midi
+
+
+def test_registry_renders_prometheus_text(tmp_path):
+    """Counter / gauge / histogram (bucket cộng dồn), take() + merge() giữa hai process"""
+    registry = MetricsRegistry()
+    registry.inc('karaoke_score_errors_total', type='ValueError')
+    registry.inc('karaoke_score_errors_total', 2, type='ValueError')
+    registry.set('karaoke_queue_depth', 3, queue='server')
+    for seconds in (0.004, 0.3, 500.0):
+        registry.observe('karaoke_stage_duration_seconds', seconds, stage='match.dtw')
+
+    text = registry.render()
+    assert '# TYPE karaoke_score_errors_total counter' in text
+    assert 'karaoke_score_errors_total{type="ValueError"} 3' in text
+    assert 'karaoke_queue_depth{queue="server"} 3' in text
+    assert 'karaoke_stage_duration_seconds_bucket{stage="match.dtw",le="0.005"} 1' in text
+    assert 'karaoke_stage_duration_seconds_bucket{stage="match.dtw",le="0.5"} 2' in text
+    assert 'karaoke_stage_duration_seconds_bucket{stage="match.dtw",le="+Inf"} 3' in text
+    assert 'karaoke_stage_duration_seconds_count{stage="match.dtw"} 3' in text
+    assert text.count('_bucket{') == len(LATENCY_BUCKETS) + 1
+
+    parent = MetricsRegistry()
+    parent.merge(registry.take())
+    parent.merge({'values': [['karaoke_score_errors_total', {'type': 'ValueError'}, 1.0]]})
+    assert parent.value('karaoke_score_errors_total', type='ValueError') == 4
+    assert 'karaoke_stage_duration_seconds_count{stage="match.dtw"} 3' in parent.render()
+    assert 'karaoke_queue_depth' not in parent.render()  # gauge không được chuyển qua take()
+    assert registry.value('karaoke_score_errors_total', type='ValueError') == 0
+    assert registry.value('karaoke_queue_depth', queue='server') == 3
+
+    exporter = FileExporter(str(tmp_path / 'karaoke.prom'), interval=60.0, registry=parent).start()
+    exporter.stop()
+    assert (tmp_path / 'karaoke.prom').read_text(encoding='utf-8') == parent.render()
+
+
+def test_session_records_scores_errors_and_stages(tmp_path, monkeypatch):
+    """Session ghi bài đã chấm, lỗi theo loại, cache hit và độ trễ từng stage vào REGISTRY"""
+    def fake_extract_user(self, user_audio, method=None, **kwargs):
+        time_user = np.arange(0, 2, 0.05)
+        return time_user, np.full(len(time_user), 262.0)
+
+    monkeypatch.setattr(KaraokeSession, 'extract_user', fake_extract_user)
+    _write_midi(tmp_path / 'c4.mid')
+    (tmp_path / 'take.wav').write_bytes(b'take')
+    REGISTRY.reset()
+
+    session = KaraokeSession(result_cache_size=8)
+    for _ in range(2):
+        session.score(str(tmp_path / 'take.wav'), str(tmp_path / 'c4.mid'))
+    session.score(str(tmp_path / 'missing.wav'), str(tmp_path / 'c4.mid'))
+
+    assert REGISTRY.value('karaoke_scores_total', scoring_mode='frames', cached='false') == 1
+    assert REGISTRY.value('karaoke_scores_total', scoring_mode='frames', cached='true') == 1
+    assert REGISTRY.value('karaoke_score_errors_total', type='FileNotFoundError') == 1
+    assert REGISTRY.value('karaoke_cache_requests_total', cache='result', result='hit') == 1
+    assert REGISTRY.value('karaoke_cache_requests_total', cache='reference', result='miss') == 1
+    text = get_metrics_text()
+    assert 'karaoke_stage_duration_seconds_count{stage="match.dtw"} 1' in text
+    assert 'karaoke_score_duration_seconds_count{outcome="error"} 1' in text
@@ -0,0 +1,126 @@
+"""
+Test PitchAdvisor với pitch contour tổng hợp (không cần file audio)
+"""
+import numpy as np
+
+from pitch_advisor import PitchAdvisor, StreamingPitchAdvisor
+from pitch_matcher import PitchMatcher
+
+
+def _synthetic_contours(duration: float = 20.0, rate: float = 10.0):
+    """Tạo contour chuẩn (E4) và contour người hát có vài đoạn lệch"""
+    time = np.arange(0, duration, 1.0 / rate)
+    freq_ref = np.full_like(time, 330.0)
+    freq_user = freq_ref.copy()
+    # Đoạn 2.0s - 4.0s hát cao 600 cents, đoạn 10.0s - 11.0s hát thấp 500 cents
+    freq_user[(time >= 2.0) & (time < 4.0)] *= 2 ** (600 / 1200)
+    freq_user[(time >= 10.0) & (time < 11.0)] *= 2 ** (-500 / 1200)
+    return time, freq_user, time, freq_ref
+
+
+def test_problem_regions_are_timestamped():
+    """Các đoạn lệch được trả về kèm thời gian và hướng lệch, đoạn tệ nhất trước"""
+    advisor = PitchAdvisor(tolerance_cents=100.0)
+    result = advisor.analyze_pitch_contour(*_synthetic_contours())
+    regions = result['problem_regions']
+
+    assert len(regions) == 2
+    assert regions[0]['direction'] == 'sharp'
+    assert abs(regions[0]['start'] - 2.0) < 0.15 and abs(regions[0]['end'] - 3.9) < 0.15
+    assert abs(regions[0]['mean_deviation_cents'] - 600) < 5
+    assert regions[1]['direction'] == 'flat'
+    assert abs(regions[1]['start'] - 10.0) < 0.15
+
+
+def test_problem_regions_merge_nearby_runs():
+    """Hai run lệch cách nhau một khoảng ngắn được gộp thành một đoạn"""
+    advisor = PitchAdvisor(tolerance_cents=100.0, region_merge_gap=0.5)
+    time = np.arange(0, 5, 0.1)
+    cents_ref = np.full_like(time, 100.0)
+    cents_user = cents_ref.copy()
+    cents_user[10:15] += 400
+    cents_user[17:22] += 400  # cách run trước 0.3s
+
+    regions = advisor.find_problem_regions(time, cents_user, cents_ref)
+    assert len(regions) == 1
+    assert regions[0]['frames'] == 10
+    assert abs(regions[0]['start'] - 1.0) < 1e-6 and abs(regions[0]['end'] - 2.1) < 1e-6
+
+
+def test_no_problem_regions_when_on_pitch():
+    """Hát đúng pitch thì không có đoạn nào có vấn đề"""
+    advisor = PitchAdvisor(tolerance_cents=100.0)
+    time = np.arange(0, 5, 0.1)
+    freq = np.full_like(time, 330.0)
+    result = advisor.analyze_pitch_contour(time, freq, time, freq)
+    assert result['problem_regions'] == []
+
+
+def test_streaming_advisor_matches_batch():
+    """StreamingPitchAdvisor cho cùng kết quả với phân tích batch khi nhận hết frame"""
+    rng = np.random.default_rng(0)
+    time = np.arange(0, 60, 0.1)
+    cents_ref = 300 * np.sin(time) + rng.normal(0, 20, len(time))
+    cents_user = cents_ref + rng.normal(40, 150, len(time))
+    cents_user[rng.random(len(time)) < 0.05] = 0.0  # vài frame không có pitch
+
+    batch = PitchAdvisor(tolerance_cents=100.0).analyze_aligned(time, cents_user, cents_ref)
+
+    streaming = StreamingPitchAdvisor(tolerance_cents=100.0)
+    streaming.update_frames(time[:300], cents_user[:300], cents_ref[:300])
+    partial = streaming.get_analysis()  # làm mới giữa bài không làm thay đổi trạng thái
+    streaming.update_frames(time[300:], cents_user[300:], cents_ref[300:])
+    result = streaming.get_analysis()
+
+    assert partial['metrics'] != result['metrics']
+    assert result['metrics'] == batch['metrics']
+    assert result['problem_regions'] == batch['problem_regions']
+    assert result['advices'] == batch['advices']
+    assert result['issues'] == batch['issues']
+    assert result['strengths'] == batch['strengths']
+
+
+def test_streaming_advisor_matches_batch_on_gapped_timeline():
+    """Timeline voiced_only có chỗ nhảy cóc: streaming cắt run tại đó như batch, đoạn đóng được báo ngay"""
+    time = np.concatenate((np.arange(0, 5, 0.1), np.arange(8, 13, 0.1)))
+    freq_ref = np.full_like(time, 262.0)
+    freq_user = freq_ref.copy()
+    freq_user[(time > 4.45) & (time < 8.55)] *= 2 ** (500 / 1200)  # lệch liền qua chỗ nhảy cóc
+    freq_user[(time > 11.0) & (time < 11.35)] *= 2 ** (-450 / 1200)
+
+    advisor = PitchAdvisor(tolerance_cents=100.0, precision='float32')
+    matcher = PitchMatcher(precision='float32')
+    batch = advisor.analyze_aligned(time, matcher.hz_to_cents(freq_user), matcher.hz_to_cents(freq_ref))
+    assert len(batch['problem_regions']) == 3
+
+    closed = []
+    streaming = StreamingPitchAdvisor(tolerance_cents=100.0, precision='float32',
+                                      max_problem_regions=2, on_region=closed.append)
+    streaming.update_hz(time, freq_user, freq_ref)
+    result = streaming.get_analysis()
+    top_two = PitchAdvisor(tolerance_cents=100.0, precision='float32', max_problem_regions=2) \
+        .analyze_aligned(time, matcher.hz_to_cents(freq_user), matcher.hz_to_cents(freq_ref))
+    assert result == top_two
+    assert [r['start'] for r in closed] == [4.5, 8.0, 11.1]  # đoạn cuối đóng khi bài còn chạy tiếp
+    assert len(streaming._closed) == 2
+
+
+def test_streaming_advisor_counts_peaks_exactly_at_threshold():
+    """Hai peak sát ngưỡng std * 0.5 (cách nhau < 1 cent): streaming đếm đúng như batch, cùng lời khuyên"""
+    time = np.arange(0, 12, 0.02)
+    melody = np.select([time < 3, time < 6, time < 9], [200.0, 500.0, 700.0], 300.0)
+    cents_ref = melody.copy()
+    cents_ref[80:] += 30 * np.sin(2 * np.pi * 5.5 * time[80:])
+    cents_user = melody - 150.0
+    cents_user[100:] += 15 * np.sin(2 * np.pi * 5 * time[100:])
+    # Hai nốt luyến ngắn: một vừa trên, một vừa dưới ngưỡng peak (ngưỡng tính lại tới khi ổn định)
+    for _ in range(5):
+        threshold = np.std(cents_user) * 0.5
+        cents_user[[20, 40]] = threshold + 0.001, threshold - 0.001
+
+    batch = PitchAdvisor(tolerance_cents=100.0).analyze_aligned(time, cents_user, cents_ref)
+    assert "Thiếu các điểm nhấn" in batch['issues']  # 40 peak < 0.7 x 58, sai một peak là mất lời khuyên
+
+    streaming = StreamingPitchAdvisor(tolerance_cents=100.0)
+    streaming.update_frames(time, cents_user, cents_ref)
+    assert streaming.get_analysis() == batch
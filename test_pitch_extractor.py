@@ -0,0 +1,88 @@
+"""
+Test PitchExtractor: chấm một đoạn của bài chỉ decode / suy luận đoạn đó, cache activation CREPE
+"""
+import numpy as np
+import soundfile as sf
+
+from activation_cache import ActivationCache
+from library_interface import KaraokeSession
+from pitch_extractor import WINDOW_MARGIN_SECONDS, PitchExtractor
+from test_cancellation import _FakeCrepeModel, _fake_crepe
+from test_karaoke_scorer import _write_midi
+
+
+def test_window_decodes_only_requested_span(tmp_path):
+    """start / end: decode đoạn cửa sổ + margin, thời gian trả về tính từ đầu bài"""
+    model = _FakeCrepeModel()
+    extractor = PitchExtractor(method='crepe', normalize_audio=False)
+    extractor._crepe_model = _fake_crepe(model)
+    audio = np.random.default_rng(0).standard_normal(16000 * 60).astype(np.float32)
+    sf.write(tmp_path / 'song.wav', audio, 16000)
+
+    time, _ = extractor.extract_pitch(str(tmp_path / 'song.wav'), step_size=10, start=20.0, end=30.0)
+    assert time[0] == 20.0 and abs(time[-1] - 30.0) < 1e-9 and len(time) == 1001
+    assert sum(model.batches) == 1 + int((10.0 + 2 * WINDOW_MARGIN_SECONDS) * 100)
+
+    # PCM int16 thô được cắt trước khi chuyển sang float, cho cùng kết quả với file
+    pcm = (audio * 8000).astype(np.int16).tobytes()
+    pcm_time, _ = extractor.extract_pitch(pcm, sample_rate=16000, dtype='int16', step_size=10,
+                                          start=20.0, end=30.0)
+    np.testing.assert_allclose(pcm_time, time)
+    tail, _ = extractor.extract_pitch(audio, sample_rate=16000, step_size=10, start=59.0)
+    assert tail[0] == 59.0 and len(tail) == 101
+
+
+def test_session_scores_only_the_window(tmp_path, monkeypatch):
+    """Session cắt reference MIDI theo cửa sổ và truyền start / end cho phần trích xuất người hát"""
+    requested = []
+
+    def fake_extract_user(self, user_audio, method=None, start=None, end=None, **kwargs):
+        requested.append((start, end))
+        time_user = np.arange(start, end, 0.05)
+        return time_user, np.full(len(time_user), 262.0)
+
+    monkeypatch.setattr(KaraokeSession, 'extract_user', fake_extract_user)
+    _write_midi(tmp_path / 'c4.mid')
+    (tmp_path / 'take.wav').touch()
+    session = KaraokeSession()
+
+    results = session.score(str(tmp_path / 'take.wav'), str(tmp_path / 'c4.mid'), start=0.5, end=1.5)
+    assert requested == [(0.5, 1.5)]
+    assert results['final_score'] > 95 and results['duration'] <= 1.0 + 1e-6
+    by_note = session.score(str(tmp_path / 'take.wav'), str(tmp_path / 'c4.mid'),
+                            scoring_mode='notes', start=0.5, end=1.5)
+    assert by_note['notes_total'] == 2 and by_note['notes'][0]['onset'] == 0.5
+    assert 'Invalid scoring window' in session.score(str(tmp_path / 'take.wav'), str(tmp_path / 'c4.mid'),
+                                                     start=2.0, end=1.0)['error']
+
+
+def test_activation_cache_redecodes_without_inference(tmp_path):
+    """Đổi ngưỡng confidence / bật Viterbi dùng activation đã lưu (float16, .npz), không chạy lại model"""
+    model = _FakeCrepeModel()
+    cache_dir = str(tmp_path / 'activations')
+    extractor = PitchExtractor(method='crepe', normalize_audio=False, activation_cache=ActivationCache(cache_dir))
+    extractor._crepe_model = _fake_crepe(model)
+    audio = np.random.default_rng(0).standard_normal(16000 * 5).astype(np.float32)
+    sf.write(tmp_path / 'take.wav', audio, 16000)
+
+    time, freq = extractor.extract_pitch(str(tmp_path / 'take.wav'), step_size=10)
+    inferred = sum(model.batches)
+    assert len(time) == inferred == 501
+    files = list((tmp_path / 'activations').glob('*.npz'))
+    assert len(files) == 1
+    with np.load(files[0]) as data:
+        assert data['activation'].dtype == np.float16 and data['activation'].shape == (501, 360)
+
+    smoothed, _ = extractor.extract_pitch(str(tmp_path / 'take.wav'), step_size=10, use_viterbi=True)
+    np.testing.assert_array_equal(smoothed, time)
+    strict, _ = extractor.extract_pitch(str(tmp_path / 'take.wav'), step_size=10, confidence_threshold=0.95)
+    assert len(strict) == 0  # đỉnh activation 0.9 < 0.95
+    assert sum(model.batches) == inferred and extractor.activation_cache.stats()['hits'] == 2
+
+    # Process / extractor khác đọc lại từ đĩa; PCM và step size khác là khóa khác
+    fresh = PitchExtractor(method='crepe', normalize_audio=False, activation_cache=ActivationCache(cache_dir))
+    fresh._crepe_model = _fake_crepe(model)
+    np.testing.assert_array_equal(fresh.extract_pitch(str(tmp_path / 'take.wav'), step_size=10)[1], freq)
+    assert sum(model.batches) == inferred
+    fresh.extract_pitch(audio, sample_rate=16000, step_size=20)
+    assert sum(model.batches) == inferred + 251
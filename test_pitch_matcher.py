@@ -0,0 +1,129 @@
+"""
+Test PitchMatcher: độ chính xác float32 so với float64
+"""
+import json
+
+import numpy as np
+import pytest
+
+from pitch_advisor import PitchAdvisor
+from pitch_matcher import PitchMatcher, find_voiced_segments, segment_notes
+
+
+def _synthetic_take(seconds=300.0, frame_rate=100.0, seed=0):
+    """Reference và bài hát người dùng (lệch, vibrato, đoạn im lặng) dài vài phút"""
+    rng = np.random.default_rng(seed)
+    time = np.arange(0, seconds, 1.0 / frame_rate)
+    notes = 220.0 * 2 ** (rng.integers(0, 12, size=len(time) // 50 + 1).repeat(50)[:len(time)] / 12)
+    freq_ref = notes.copy()
+    freq_user = notes * 2 ** ((30 * np.sin(2 * np.pi * 5 * time) + rng.normal(0, 40, len(time))) / 1200)
+    freq_user[(time % 20) > 18] = 0.0
+    freq_user[(time > 100) & (time < 104)] *= 2 ** (300 / 1200)
+    return time, freq_user, time, freq_ref
+
+
+def test_float32_matches_float64_within_tolerance():
+    """Điểm float32 lệch < 0.05 so với float64, contour / cents giữ float32 suốt pipeline"""
+    take = _synthetic_take()
+    results = {}
+    for precision in ('float64', 'float32'):
+        matcher = PitchMatcher(tolerance_cents=50.0, difficulty_mode='normal', precision=precision)
+        aligned_time, cents_user, cents_ref = matcher.align_cents(*take)
+        assert aligned_time.dtype == cents_user.dtype == cents_ref.dtype == np.dtype(precision)
+        results[precision] = matcher.score_aligned(aligned_time, cents_user, cents_ref)
+        results[precision]['advice'] = PitchAdvisor(tolerance_cents=50.0, precision=precision) \
+            .analyze_pitch_contour(*take)
+
+    json.dumps(results)  # không còn scalar NumPy float32 trong kết quả
+    single, double = results['float32'], results['float64']
+    for key in ('final_score', 'accuracy', 'dtw_score'):
+        assert abs(single[key] - double[key]) <= 0.05, key
+    assert abs(single['mae_cents'] - double['mae_cents']) <= 0.02
+    assert single['dtw_distance'] == pytest.approx(double['dtw_distance'], rel=1e-3)
+    assert single['duration'] == double['duration']
+    regions32, regions64 = single['advice']['problem_regions'], double['advice']['problem_regions']
+    assert [(r['start'], r['end'], r['frames']) for r in regions32] == \
+           [(r['start'], r['end'], r['frames']) for r in regions64]
+    for r32, r64 in zip(regions32, regions64):
+        assert abs(r32['mean_offset_cents'] - r64['mean_offset_cents']) <= 0.02
+
+    with pytest.raises(ValueError):
+        PitchMatcher(precision='float16')
+
+
+def test_voiced_only_skips_silence():
+    """voiced_only: lưới chỉ gồm đoạn cả hai cùng có pitch, khoảng lặng không bị nội suy và chấm"""
+    time = np.arange(0, 6, 0.05)
+    freq_ref = np.where(time < 2, 262.0, 392.0)
+    ref_voiced = (time < 2) | (time >= 4)
+    user_voiced = (time < 2) | (time >= 4.5)  # vào câu thứ hai muộn
+    take = (time[user_voiced], freq_ref[user_voiced], time[ref_voiced], freq_ref[ref_voiced])
+
+    segments = find_voiced_segments(take[2], take[3])
+    np.testing.assert_allclose(segments, [[-0.025, 1.975], [3.975, 5.975]])
+
+    dense = PitchMatcher(tolerance_cents=50.0).calculate_score(*take)
+    matcher = PitchMatcher(tolerance_cents=50.0, voiced_only=True)
+    aligned_time, cents_user, cents_ref = matcher.align_cents(*take)
+    assert not np.any((aligned_time > 2.0) & (aligned_time < 4.5))
+    assert np.all(cents_user != 0) and np.all(cents_ref != 0)
+    voiced = matcher.score_aligned(aligned_time, cents_user, cents_ref)
+    assert voiced['accuracy'] == 100.0 and voiced['mae_cents'] == 0.0
+    assert dense['accuracy'] < voiced['accuracy']
+
+    # Nốt MIDI liền nhau: mỗi nốt giữ cao độ của mình, không kéo sang nốt kế tiếp
+    notes = np.array([[0.0, 0.5], [0.5, 1.0]])
+    _, _, freq = matcher.align_time_series(np.arange(0, 1, 0.05), np.full(20, 262.0),
+                                           notes[:, 0], np.array([262.0, 294.0]), segments2=notes)
+    np.testing.assert_allclose(freq, [262.0] * 5 + [294.0] * 5)
+
+    advice = PitchAdvisor(tolerance_cents=50.0, voiced_only=True).analyze_pitch_contour(*take)
+    assert advice['problem_regions'] == []
+
+
+def test_note_segmentation_and_note_scoring(tmp_path, monkeypatch):
+    """Reference tách thành nốt một lần, người hát được chấm theo từng nốt"""
+    time = np.arange(0, 3.5, 0.02)
+    target = np.select([time < 1, time < 2, time < 2.5], [-900.0, -500.0, np.nan], -200.0)
+    vibrato = 20 * np.sin(2 * np.pi * 5.5 * time)
+    freq_ref = np.nan_to_num(440.0 * 2 ** ((target + vibrato) / 1200))
+    voiced = freq_ref > 0
+
+    notes = segment_notes(time[voiced], freq_ref[voiced])
+    assert len(notes) == 3
+    np.testing.assert_allclose(notes[:, 2], [-900, -500, -200], atol=5)
+    np.testing.assert_allclose(notes[:, :2], [[-0.01, 1.01], [0.99, 2.01], [2.49, 3.51]], atol=0.03)
+
+    # Hát đúng nốt 1, thấp 40 cents ở nốt 2, bỏ nốt 3
+    sung = time < 2
+    freq_user = 440.0 * 2 ** ((np.where(time < 1, -900.0, -540.0) + vibrato) / 1200)
+    matcher = PitchMatcher(tolerance_cents=50.0)
+    results = matcher.score_notes(time[sung], freq_user[sung], notes)
+    json.dumps(results)
+    assert (results['notes_total'], results['notes_sung'], results['notes_hit']) == (3, 2, 2)
+    first, second, third = results['notes']
+    assert first['score'] == 100.0 and abs(second['deviation_cents'] + 40) < 5
+    assert 0 < second['score'] < 100.0 and third['score'] == 0.0 and third['sung_cents'] is None
+    assert 40 < results['final_score'] < 70
+    assert results['duration'] == round(notes[:, 1].max() - notes[:, 0].min(), 2)
+    # Median từng cửa sổ khớp np.median, kể cả cửa sổ chẵn / lẻ frame và nốt chồng nhau
+    overlapping = np.array([[0.0, 0.5, -900.0], [0.3, 1.01, -900.0], [1.0, 1.5, -500.0]])
+    cents = matcher.hz_to_cents(freq_user[sung])
+    for note, result in zip(overlapping, matcher.score_notes(time[sung], freq_user[sung], overlapping)['notes']):
+        window = (time[sung] >= note[0]) & (time[sung] < note[1])
+        assert abs(result['sung_cents'] - np.median(cents[window])) < 0.01
+    # Không hát nốt nào: JSON hợp lệ (không có Infinity)
+    silent = matcher.score_notes(np.zeros(0), np.zeros(0), notes)
+    assert silent['mae_cents'] is None and silent['final_score'] == 0.0
+    json.dumps(silent, allow_nan=False)
+
+    # Session: reference MIDI chấm theo nốt, không cần căn chỉnh / DTW
+    from library_interface import KaraokeSession
+    from test_karaoke_scorer import _fake_extract_user, _write_midi
+    monkeypatch.setattr(KaraokeSession, 'extract_user', _fake_extract_user)
+    _write_midi(tmp_path / 'c4.mid')
+    (tmp_path / 'take.wav').touch()
+    by_note = KaraokeSession().score(str(tmp_path / 'take.wav'), str(tmp_path / 'c4.mid'),
+                                     scoring_mode='notes', include_timings=True)
+    assert by_note['notes_hit'] == 4 and by_note['final_score'] > 95
+    assert 'match.dtw' not in by_note['timings']
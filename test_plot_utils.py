@@ -0,0 +1,46 @@
+"""
+Test giảm điểm khi vẽ contour (plot_utils.py)
+"""
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from plot_utils import DecimatedLine, lttb_decimate, minmax_decimate
+
+
+def _contour(n=200_000):
+    time = np.arange(n) * 0.01
+    freq = 300.0 + 50.0 * np.sin(time)
+    freq[n // 2 + 23_457] = 900.0  # đỉnh hẹp một frame
+    freq[5000:5100] = np.nan
+    return time, freq
+
+
+def test_minmax_keeps_extremes_and_respects_view():
+    time, freq = _contour()
+    indices = minmax_decimate(time, freq, 2000)
+    assert len(indices) <= 2002 and np.all(np.diff(indices) > 0)
+    assert 123_457 in indices
+    assert indices[0] == 0 and indices[-1] == len(time) - 1
+
+    # Khi zoom vào, chỉ chọn điểm trong vùng hiển thị (cộng một điểm mỗi bên)
+    zoomed = minmax_decimate(time, freq, 2000, xmin=100.0, xmax=101.0)
+    np.testing.assert_array_equal(zoomed, np.arange(9999, 10102))
+
+
+def test_lttb_and_decimated_line_update_on_zoom():
+    time, freq = _contour(50_000)
+    freq = np.nan_to_num(freq)
+    indices = lttb_decimate(time, freq, 500)
+    assert len(indices) == 500 and indices[0] == 0 and indices[-1] == len(time) - 1
+
+    fig, ax = plt.subplots()
+    line = DecimatedLine(ax, time, freq, max_points=1000)
+    assert len(line.line.get_xdata()) <= 1002
+    assert ax.get_xlim()[1] >= time[-1]
+
+    ax.set_xlim(10.0, 12.0)
+    xdata = line.line.get_xdata()
+    assert len(xdata) == 203 and xdata[0] < 10.0 < 12.0 < xdata[-1]
+    plt.close(fig)
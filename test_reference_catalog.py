@@ -0,0 +1,76 @@
+"""
+Test catalog contour reference (reference_catalog.py)
+"""
+import json
+
+import numpy as np
+
+from library_interface import KaraokeSession
+from reference_catalog import ReferenceCatalog, build_catalog, encode_record
+from test_karaoke_scorer import _fake_extract_user, _write_midi
+
+
+def test_round_trip_and_append(tmp_path):
+    """Contour đọc lại trong sai số lượng tử hóa, record sau thay record trước"""
+    path = str(tmp_path / 'songs.kcat')
+    time = np.arange(0, 3, 0.05)
+    freq = np.linspace(200.0, 400.0, len(time))
+    freq[10] = 0.0  # frame không có pitch bị bỏ
+
+    with ReferenceCatalog(path) as catalog:
+        catalog.add('song/a', time, freq, metadata={'source': 'a.wav'})
+        catalog.add('song/b', np.array([0.0, 100.0]), np.array([330.0, 330.0]))
+        catalog.add('song/a', time[:5], freq[:5])
+        assert len(catalog) == 2
+
+    # Record ghi dở ở cuối file (process bị kill) bị bỏ qua
+    with open(path, 'ab') as f:
+        f.write(encode_record('song/c', time, freq)[:30])
+
+    with ReferenceCatalog(path, create=False) as catalog:
+        assert sorted(catalog.song_ids()) == ['song/a', 'song/b']
+        time_a, freq_a = catalog.get_contour('song/a')
+        np.testing.assert_allclose(time_a, time[:5], atol=1e-3)
+        np.testing.assert_allclose(1200 * np.log2(freq_a / freq[:5]), 0, atol=0.2)
+        # Khoảng trống > 65 giây chuyển sang lưu time float32
+        time_b, _ = catalog.get_contour('song/b')
+        np.testing.assert_allclose(time_b, [0.0, 100.0])
+        assert catalog.get_notes('song/b').shape == (0, 3)
+
+        # Writer khác ghi thêm, reader thấy khi tra song ID mới
+        with ReferenceCatalog(path) as writer:
+            writer.add('song/d', time, freq)
+        assert 'song/d' in catalog
+
+
+def test_build_and_score_by_song_id(tmp_path, monkeypatch):
+    """Xây catalog từ thư mục, chấm theo song_id không cần file reference"""
+    monkeypatch.setattr(KaraokeSession, 'extract_user', _fake_extract_user)
+    songs = tmp_path / 'songs'
+    (songs / 'pop').mkdir(parents=True)
+    _write_midi(songs / 'pop' / 'c4.mid')
+    catalog_path = str(tmp_path / 'songs.kcat')
+
+    stats = build_catalog(str(songs), catalog_path, session=KaraokeSession())
+    assert stats == {'added': 1, 'skipped': 0, 'failed': 0}
+    assert build_catalog(str(songs), catalog_path, session=KaraokeSession())['skipped'] == 1
+    # Đổi tham số trích xuất: bài được tính lại thay vì giữ contour cũ
+    assert build_catalog(str(songs), catalog_path, session=KaraokeSession(midi_track_filter=None))['added'] == 1
+    assert build_catalog(str(songs), catalog_path, session=KaraokeSession())['added'] == 1
+
+    with ReferenceCatalog(catalog_path) as catalog:
+        notes = catalog.get_notes('pop/c4')
+        assert len(notes) == 4 and np.allclose(notes[:, 2], -900)
+        assert catalog.get_metadata('pop/c4')['method'] == 'midi'
+
+    user_path = tmp_path / 'take.wav'
+    user_path.touch()
+    session = KaraokeSession(catalog_path=catalog_path)
+    by_id = session.score(str(user_path), song_id='pop/c4')
+    by_path = session.score(str(user_path), str(songs / 'pop' / 'c4.mid'))
+    assert 'error' not in by_id
+    assert abs(by_id['final_score'] - by_path['final_score']) < 1.0
+
+    missing = json.loads(session.score_json(str(user_path), song_id='pop/unknown'))
+    assert 'error' in missing and missing['final_score'] == 0.0
+    session.close()
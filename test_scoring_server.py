@@ -0,0 +1,102 @@
+"""
+Test HTTP scoring server trên localhost (không cần model hay file audio thật)
+"""
+import http.client
+import json
+import time
+from concurrent.futures import Future
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from metrics import REGISTRY
+from scoring_server import MAX_BODY_BYTES, ScoringServer
+
+
+def _request(url, data=None, content_type='application/json'):
+    """Gửi request và trả về (status, JSON)"""
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf-8'))
+
+
+def test_scoring_server_end_to_end():
+    """Server trả cùng JSON schema với library, và trả 429 khi hàng đợi đầy"""
+    REGISTRY.reset()
+    server = ScoringServer(port=0, workers=1, max_queue=0)
+    server.start()
+    try:
+        host, port = server.address
+        base = f"http://{host}:{port}"
+
+        status, health = _request(base + "/health")
+        assert status == 200 and health['status'] == 'ok' and health['capacity'] == 1
+
+        body = json.dumps({'user_audio_path': 'non_existent_user.wav',
+                           'reference_path': 'non_existent_ref.wav'}).encode('utf-8')
+        status, result = _request(base + "/score", body)
+        assert status == 200
+        assert 'User audio file not found' in result['error'] and result['final_score'] == 0.0
+
+        pcm = np.zeros(16000, dtype=np.float32).tobytes()
+        status, result = _request(base + "/score/pcm?sample_rate=16000&reference_path=missing.wav",
+                                  pcm, content_type='application/octet-stream')
+        assert status == 200 and 'Reference file not found' in result['error']
+
+        # Body thiếu trường, không phải object JSON, hoặc tham số sai kiểu -> 400 kèm JSON lỗi
+        for bad_body in (b'{}', b'[]', b'"x"', b'{"user_audio_path": "a.wav", "reference_path": "b.wav", '
+                                              b'"tolerance_cents": [1]}'):
+            status, result = _request(base + "/score", bad_body)
+            assert status == 400 and 'Invalid request' in result['error']
+
+        # Chiếm hết chỗ trong hàng đợi -> request mới bị từ chối
+        assert server.try_acquire_slot()
+        status, result = _request(base + "/score", body)
+        assert status == 429
+        server.release_slot()
+
+        # Metrics của worker được gộp vào process server
+        deadline = time.monotonic() + 5
+        while True:
+            with urllib.request.urlopen(base + "/metrics", timeout=30) as response:
+                assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                metrics = response.read().decode('utf-8')
+            if 'karaoke_score_errors_total{type="FileNotFoundError"} 2' in metrics or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        assert 'karaoke_score_errors_total{type="FileNotFoundError"} 2' in metrics
+        assert 'karaoke_score_errors_total{type="QueueFull"} 1' in metrics
+        assert 'karaoke_queue_depth{queue="server"} 0' in metrics
+
+        # Body quá lớn / Content-Length hỏng: trả lỗi và đóng kết nối thay vì parse body làm request
+        for length, expected in ((str(MAX_BODY_BYTES + 1), 413), ('abc', 400)):
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            connection.putrequest('POST', '/score')
+            connection.putheader('Content-Length', length)
+            connection.endheaders(b'{"user_audio_path": "x"}')
+            response = connection.getresponse()
+            assert response.status == expected and response.getheader('Connection') == 'close'
+            assert 'error' in json.loads(response.read().decode('utf-8'))
+            connection.close()
+
+        # Lỗi bất kỳ từ worker pool -> 500 kèm JSON lỗi
+        pool = server._pool
+
+        class _FailingPool:
+            def submit(self, *args, **kwargs):
+                future = Future()
+                future.set_exception(RuntimeError('worker exploded'))
+                return future
+
+        server._pool = _FailingPool()
+        try:
+            status, result = _request(base + "/score", body)
+        finally:
+            server._pool = pool
+        assert status == 500 and result['error'] == 'worker exploded'
+    finally:
+        server.shutdown()